@@ -1,112 +1,92 @@
-import sys
-import os
-import re
+"""聊天处理Qt适配模块
 
-# 获取当前文件的目录，并将项目根目录添加到sys.path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+该模块把chat_process.processor中不依赖图形界面的ChatProcessor适配为QObject，
+将其钩子方法转发为Qt信号，供图形界面连接。
 
-from PyQt6.QtCore import Qt, QTimer, pyqtSignal, pyqtSlot, QObject
-from spark_api import spark_api
-from chat_process import error_code
-from chat_process import string_to_html
-import asyncio
+Classes:
+    ProcessingModule: 处理模块类
+"""
 
-class ProcessingModule(QObject):
+from PyQt6.QtCore import pyqtSignal, QObject
+
+from chat_process.processor import ChatProcessor
+
+
+class ProcessingModule(QObject, ChatProcessor):
     """处理模块类，用于处理聊天信息。
 
+    处理逻辑见ChatProcessor，本类只负责把处理结果以信号的形式发射。
+
     Args:
         QObject : QObject类, Qt的基类, 提供信号和槽机制
         processing_finish : pyqtSignal, 处理完成的信号，在处理完成后发射
         processing_fail : pyqtSignal, 处理失败的信号，在处理失败后发射
-        chat_history : ChatHistory, 聊天记录类, 用于记录聊天信息
-        chat_params : ChatParams, 聊天参数类, 用于设置聊天参数 //目前前端没有设置聊天参数
-        chat_model : ChatModel, 聊天模型类, 用于设置聊天模型
-        format_tool : StringToHtml, 字符串转html类, 用于将字符串转换为html格式
+        process_partial : pyqtSignal, 部分回答的信号，流式回复每到达一段就发射一次，
+            参数为新增的稳定html、未结束的块的类型、块中新完成的行和未完成的最后一行的临时html，
+            含义见ChatProcessor.on_partial
+        process_cancel : pyqtSignal, 处理被取消的信号，在用户停止请求或移出排队中的数据后发射
+        process_start : pyqtSignal, 开始处理的信号，排队中的数据轮到处理时发射，参数为前端传来的数据
     """
     process_finish = pyqtSignal(str)
     process_fail = pyqtSignal(str)
-    
-    def __init__(self):
-        
-        """初始化处理模块。"""
-        super().__init__()
-        self.chat_history = spark_api.ChatHistory()
-        self.chat_params = spark_api.ChatParams()
-        self.model = spark_api.chat_models[0]
-        self.format_tool = string_to_html.StringToHtml()
-        
-    async def process(self, data: list) -> None:
-        """处理数据,然后向后端发送请求，接收回复并处理，最后发射处理结果信号。
+    process_partial = pyqtSignal(str, str, list, str)
+    process_cancel = pyqtSignal(str)
+    process_start = pyqtSignal(list)
+
+    def __init__(self, conversation: str = "default"):
+        """初始化处理模块。
 
         Args:
-            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
+            conversation: str, 对话id，见ChatProcessor
         """
-        resquest_data = self.translate(data)
-        try:
-            api_result = await self.resquest_chat(resquest_data)
-            formatted_result = self.format_tool.translate(api_result)
-            response = self.translate_result(formatted_result, data)
-            self.process_finish.emit(response)
-            
-        except Exception as e:
-            e_code = str(e).split("Code:'")[1].split("'")[0]
-            #根据错误码在字典中获取错误信息
-            error_message = error_code.error_codes[int(e_code)]
-            self.process_fail.emit(error_message)
-            
-    def translate(self, data: list) -> list:
-        """翻译数据,将前端传来的数据翻译成后端需要的数据格式。
+        super().__init__(conversation=conversation)
+
+    def on_start(self, data: list) -> None:
+        """发射开始处理的信号。
 
         Args:
             data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
-            
-        return:
-            res: list, 后端需要的数据格式，包含模型类型，历史记录，聊天参数，问题和唯一标识。
         """
-        res = []
-        model_index = int(data[1][0]) - 1
-        res.append(spark_api.chat_models[model_index])
-        res.append(self.chat_history)
-        res.append(self.chat_params)
-        res.append(data[3])
-        res.append(data[0])
-        
-        return res
-    
-    async def resquest_chat(self, resquest_date: list) -> str:
-        """请求聊天,向后端发送请求，接收回复的数据。
+        self.process_start.emit(data)
+
+    def on_partial(self, stable: str, kind: str, lines: list, tail: str) -> None:
+        """发射部分回答的信号。
+
+        Args:
+            stable: str, 新增的稳定html
+            kind: str, 未结束的块的类型："code"、"ul"、"ol"，不在块中时为空字符串
+            lines: list, 块中新完成的行
+            tail: str, 未完成的最后一行的临时html
+        """
+        self.process_partial.emit(stable, kind, lines, tail)
+
+    def on_finish(self, response: str) -> None:
+        """发射处理完成的信号。
+
         Args:
-            resquest_data: list, 后端需要的数据格式，包含模型类型，历史记录，聊天参数，问题和唯一标识。
+            response: str, 前端需要的完整回答
+        """
+        self.process_finish.emit(response)
+
+    def on_fail(self, message: str) -> None:
+        """发射处理失败的信号。
 
-        Returns:
-            str, 机器人的回答
+        Args:
+            message: str, 错误信息
         """
-        api_result = await spark_api.request_chat(resquest_date[0], 
-                                        resquest_date[1], 
-                                        resquest_date[2], 
-                                        resquest_date[3])
-        
-        return api_result
-    
-    ##将处理结果转化为前端展示的格式
-    def translate_result(self, formatted_result: str, data: list) -> str:
-        """翻译结果,将后端返回处理过的数据翻译成前端需要的数据格式。
+        self.process_fail.emit(message)
+
+    def on_cancel(self, data_id: str) -> None:
+        """发射处理被取消的信号。
 
         Args:
-            formatted_result: str, 后端返回处理过的数据，包含机器人的回答。
-            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
-            
-        return:
-            res: str, 前端需要的数据格式，包含所使用的模型名称和机器人的回答。
+            data_id: str, 被取消的数据的唯一标识
         """
-        response = f"回答: <br> {formatted_result}"
-        response= re.sub(r'(<br>\s*)+', '<br>', response)
-        return response
-        
+        self.process_cancel.emit(data_id)
+
 
 ## 测试
 # if __name__ == "__main__":
 #     processing_module = ProcessingModule()
 #     data = ["1", "模型4", "user", "你好"]
 #     asyncio.run(processing_module.process(data))
-
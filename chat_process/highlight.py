@@ -0,0 +1,133 @@
+"""代码块语法高亮模块
+
+该模块把代码块转换为带语法高亮的html。安装了可选的pygments（pip install pygments）时
+使用pygments高亮，样式以内联style输出，QTextEdit无需样式表即可显示；未安装pygments、
+没有标注语言或语言无法识别时，只转义html特殊字符。
+高亮结果按(语言, 代码哈希)缓存，同一段代码（例如重新显示历史消息时）只高亮一次。
+pygments在第一次高亮时才导入，不影响启动时间。
+
+Classes:
+    HighlightCache: 高亮结果缓存类
+
+Functions:
+    highlight: 高亮一段代码
+
+使用示例：
+    code_html = highlight("print(1)\\n", "python")
+"""
+
+import hashlib
+import html
+import threading
+from collections import OrderedDict
+
+from spark_api import config
+
+
+class HighlightCache:
+    """高亮结果缓存类
+
+    以(语言, 代码的blake2b摘要)为键，按最近使用的顺序保留有限条结果，可以在多个线程中使用。
+
+    Attributes:
+        max_entries: int 缓存的最大条数
+    """
+    def __init__(self, max_entries: int | None = None) -> None:
+        self.max_entries = max_entries or config.highlight_cache_entries
+        self._entries: OrderedDict[tuple[str, bytes], str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(code: str, language: str) -> tuple[str, bytes]:
+        """生成缓存键
+
+        Args:
+            code: str 代码
+            language: str 语言
+
+        Returns:
+            tuple[str, bytes]: (小写的语言, 代码的摘要)
+        """
+        digest = hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+        return language.lower(), digest
+
+    def get(self, key: tuple[str, bytes]) -> str | None:
+        """查找缓存
+
+        Args:
+            key: tuple[str, bytes] 缓存键
+
+        Returns:
+            str | None: 高亮结果，未命中时为None
+        """
+        with self._lock:
+            code_html = self._entries.get(key)
+            if code_html is not None:
+                self._entries.move_to_end(key)
+            return code_html
+
+    def put(self, key: tuple[str, bytes], code_html: str) -> None:
+        """写入缓存
+
+        Args:
+            key: tuple[str, bytes] 缓存键
+            code_html: str 高亮结果
+        """
+        with self._lock:
+            self._entries[key] = code_html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+cache = HighlightCache()
+"""HighlightCache: 默认的高亮结果缓存"""
+
+
+def _pygments_highlight(code: str, language: str) -> str | None:
+    """使用pygments高亮
+
+    Args:
+        code: str 代码
+        language: str 语言
+
+    Returns:
+        str | None: 高亮结果，未安装pygments或语言无法识别时为None
+    """
+    try:
+        from pygments import highlight as pygments_highlight
+        from pygments.formatters import HtmlFormatter
+        from pygments.lexers import get_lexer_by_name
+        from pygments.util import ClassNotFound
+    except ImportError:
+        return None
+    try:
+        lexer = get_lexer_by_name(language, stripnl=False)
+    except ClassNotFound:
+        return None
+    return pygments_highlight(code, lexer, HtmlFormatter(nowrap=True, noclasses=True))
+
+
+def highlight(code: str, language: str) -> str:
+    """高亮一段代码
+
+    Args:
+        code: str 代码，每行以换行符结尾
+        language: str 代码块标注的语言，可以为空
+
+    Returns:
+        str: 代码的html，不含外层的<pre><code>标签
+    """
+    if not language:
+        return html.escape(code, quote=False)
+    key = cache.make_key(code, language)
+    code_html = cache.get(key)
+    if code_html is None:
+        code_html = _pygments_highlight(code, language)
+        if code_html is None:
+            code_html = html.escape(code, quote=False)
+        cache.put(key, code_html)
+    return code_html
@@ -0,0 +1,422 @@
+"""聊天处理核心模块
+
+该模块包含不依赖图形界面的聊天处理逻辑：把前端数据翻译为请求、流式请求回答、
+把回答逐段转换为html，并通过on_partial/on_finish/on_fail/on_cancel四个钩子方法输出结果。
+模块不导入PyQt6，批量任务、服务进程和测试可以直接使用ChatProcessor，
+图形界面通过chat_process.chat_process中的ProcessingModule把钩子转发为Qt信号。
+转换html（包括代码块的语法高亮）默认在后台的渲染线程中进行，结果回到事件循环后再调用钩子方法，
+长回答的转换不会推迟网络读取和界面刷新。
+
+Classes:
+    ChatProcessor: 聊天处理类
+
+使用示例：
+    class PrintProcessor(ChatProcessor):
+        def on_finish(self, response: str) -> None:
+            print(response)
+
+    asyncio.run(PrintProcessor().process(["1", "1", "user", "你好"]))
+"""
+
+import asyncio
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable
+
+from spark_api import spark_api
+from spark_api import engine
+from spark_api import config
+from spark_api import metrics
+from spark_api import hedging
+from spark_api import search
+from spark_api.errors import SparkApiError
+from spark_api.storage import open_store
+from chat_process import error_code
+from chat_process import string_to_html
+
+# 连续的<br>合并为一个；以字面量开头的模式可以快速跳过不含<br>的内容（例如高亮后的长代码块）
+_BR_RUN_RE = re.compile(r"<br>(?:\s*<br>)*\s*")
+
+render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+"""ThreadPoolExecutor: 渲染线程，只有一个线程，各段回答按提交的顺序转换"""
+
+
+class _AnswerRenderer:
+    """把一个回答逐段转换为稳定的html、未结束的块中新完成的行和临时的html。
+
+    代码块和列表结束后才整体作为稳定内容输出，此前只输出块中新完成的行和未完成的最后一行，
+    每段的输出量与该段的长度有关，与未结束的块的长度无关。
+    方法可以在渲染线程中调用，同一个回答的调用需要依次进行。
+
+    Attributes:
+        elapsed: float 转换所用的总时间（秒）
+    """
+
+    def __init__(self, prefix: str, highlight: bool) -> None:
+        self.elapsed = 0.0
+        self._renderer = string_to_html.StreamingHtmlRenderer(highlight)
+        self._result = ""
+        self._stable_len = 0 # _result中已作为稳定内容输出的长度
+        self._stable_prefix = prefix
+
+    def feed(self, delta: str) -> tuple[str, str, list[str], str]:
+        """输入一段回答。
+
+        Args:
+            delta: str, 回答的增量片段
+
+        Returns:
+            tuple[str, str, list[str], str], 新增的稳定html、未结束的块的类型、
+                块中新完成的行和未完成的最后一行的临时html，含义见ChatProcessor.on_partial
+        """
+        start = time.perf_counter()
+        renderer = self._renderer
+        self._result += renderer.feed(delta)
+        end = renderer.block_start if renderer.open_block else len(self._result)
+        stable = self._stable_prefix + self._result[self._stable_len:end]
+        self._stable_len = end
+        self._stable_prefix = ""
+        res = stable, renderer.block_kind, renderer.take_block_lines(), renderer.pending_line()
+        self.elapsed += time.perf_counter() - start
+        return res
+
+    def finish(self) -> str:
+        """结束输入。
+
+        Returns:
+            str, 整个回答的html
+        """
+        start = time.perf_counter()
+        self._result += self._renderer.finish()
+        self.elapsed += time.perf_counter() - start
+        return self._result
+
+
+class ChatProcessor:
+    """聊天处理类，用于处理聊天信息。
+
+    子类通过重写钩子方法接收处理结果，默认的钩子方法什么也不做。
+    提交的数据进入本对话的队列，按提交的顺序逐条处理：上一条的回答写入消息记录之后才发送下一条，
+    满足Spark同一时间只能有一个问题在回答中的要求（10007），处理期间仍然可以继续提交。
+
+    Attributes:
+        chat_history : ChatHistory, 聊天记录类, 用于记录聊天信息
+        chat_params : ChatParams, 聊天参数类, 用于设置聊天参数 //目前前端没有设置聊天参数
+        model : ChatModel, 聊天模型类, 用于设置聊天模型
+        format_tool : StringToHtml, 字符串转html类, 用于将字符串转换为html格式
+        uid : str, 本处理模块（会话）使用的用户id，避免多个窗口之间的并发冲突
+        conversation : str, 对话id，各对话的消息记录分别保存
+    """
+
+    def __init__(self, conversation: str = "default", **kwargs):
+        """初始化处理模块。
+
+        Args:
+            conversation: str, 对话id，用于区分存储和搜索索引中的消息记录
+        """
+        super().__init__(**kwargs)
+        self.conversation = conversation
+        if config.history_path:
+            max_tokens = max(model.context_tokens for model in spark_api.chat_models)
+            store = open_store(config.history_path, conversation)
+            index = search.shared_index() # 未配置config.search_index_path时为None
+            if index is not None:
+                index.sync(conversation, store) # 为索引建立之前保存的消息补建索引
+            self.chat_history = spark_api.ChatHistory.from_store(
+                store, max_tokens, index=index, conversation=conversation)
+        else:
+            self.chat_history = spark_api.ChatHistory()
+        self.chat_params = spark_api.ChatParams()
+        self.model = spark_api.chat_models[0]
+        self.format_tool = string_to_html.StringToHtml()
+        self.uid = engine.new_uid()
+        self._task: asyncio.Task | None = None # 正在处理的任务
+        self._task_id: str | None = None
+        self._queue: deque[tuple[list, float | None, asyncio.Future]] = deque()
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def busy(self) -> bool:
+        """bool, 是否有正在处理或排队的数据"""
+        return self._worker is not None and not self._worker.done()
+
+    @property
+    def queued(self) -> list[list]:
+        """list[list], 排队中（尚未开始处理）的数据，按处理顺序排列"""
+        return [data for data, _, _ in self._queue]
+
+    def on_start(self, data: list) -> None:
+        """一条数据开始处理时调用，此前的数据都已处理完毕。
+
+        Args:
+            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
+        """
+
+    def on_partial(self, stable: str, kind: str, lines: list, tail: str) -> None:
+        """收到一段流式回复时调用。
+
+        回答依次由三部分组成：稳定内容、未结束的代码块或列表、未完成的最后一行。
+        stable不为空时，此前收到的块中的行所在的块已经结束，整个块的html包含在stable中，
+        前端应去掉已显示的块，追加stable，再开始显示新的块。
+
+        Args:
+            stable: str, 新增的稳定html（标签已闭合，之后不再改动）
+            kind: str, 未结束的块的类型："code"、"ul"、"ol"，不在块中时为空字符串
+            lines: list, 块中新完成的行，追加在已收到的行之后；代码块中为代码原文，列表中为列表项的html
+            tail: str, 未完成的最后一行的临时html（下一次调用时被替换）
+        """
+
+    def on_finish(self, response: str) -> None:
+        """处理完成时调用。
+
+        Args:
+            response: str, 前端需要的完整回答
+        """
+
+    def on_fail(self, message: str) -> None:
+        """处理失败时调用。
+
+        Args:
+            message: str, 错误信息
+        """
+
+    def on_cancel(self, data_id: str) -> None:
+        """处理被取消时调用。
+
+        Args:
+            data_id: str, 被取消的数据的唯一标识
+        """
+
+    def submit(self, data: list, timeout: float | None = None) -> asyncio.Future:
+        """提交数据，排在已提交的数据之后，在事件循环中依次处理。
+
+        Args:
+            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
+            timeout: float | None, 超时时长（秒），从开始处理时计算，为None时使用config.request_timeout
+
+        Returns:
+            asyncio.Future, 这条数据处理完毕时完成，被取消时随之取消
+        """
+        done = asyncio.get_event_loop().create_future()
+        self._queue.append((data, timeout, done))
+        if not self.busy:
+            self._worker = asyncio.ensure_future(self._drain())
+        return done
+
+    def cancel(self, data_id: str | None = None) -> None:
+        """取消一条数据的处理。
+
+        取消正在处理的数据时关闭连接并撤销尚未得到回答的问题，之后继续处理队列中的下一条；
+        取消排队中的数据时直接将其移出队列。
+
+        Args:
+            data_id: str | None, 数据的唯一标识，为None时取消正在处理的数据
+        """
+        if data_id is not None:
+            for item in self._queue:
+                if item[0][0] == data_id:
+                    self._queue.remove(item)
+                    item[2].cancel()
+                    self.on_cancel(data_id)
+                    return
+        if self._task is not None and not self._task.done():
+            if data_id is None or self._task_id == data_id:
+                self._task.cancel()
+
+    async def _drain(self) -> None:
+        """按提交的顺序处理队列中的数据，直到队列为空。"""
+        while self._queue:
+            data, timeout, done = self._queue.popleft()
+            timeout = config.request_timeout if timeout is None else timeout
+            deadline = time.monotonic() + timeout if timeout > 0 else None
+            self.on_start(data)
+            self._task_id = data[0]
+            self._task = asyncio.ensure_future(self.process(data, deadline))
+            try:
+                # 等待处理结束（此时回答已写入消息记录），处理被取消不影响队列中的其他数据
+                await asyncio.wait([self._task])
+            except asyncio.CancelledError:
+                self._task.cancel()
+                for _, _, pending in self._queue:
+                    pending.cancel()
+                self._queue.clear()
+                done.cancel()
+                raise
+            if self._task.cancelled():
+                done.cancel()
+            elif self._task.exception() is not None:
+                done.set_exception(self._task.exception())
+            else:
+                done.set_result(None)
+
+    async def close(self) -> None:
+        """停止处理并关闭存储后端。
+
+        移出排队中的数据，取消正在处理的数据，等到其撤销尚未得到回答的问题之后才关闭存储后端。
+        """
+        for data in self.queued:
+            self.cancel(data[0])
+        self.cancel()
+        if self._worker is not None:
+            await asyncio.gather(self._worker, return_exceptions=True)
+        if self.chat_history.store is not None:
+            self.chat_history.store.close()
+
+    def prewarm(self, model_name: str) -> None:
+        """预热模型的连接，使随后的发送只需写入请求。前端切换模型或开始输入时调用。
+
+        Args:
+            model_name: str, 前端的模型名称，以模型序号开头，例如"1.Spark Lite"
+        """
+        model = spark_api.chat_models[int(model_name[0]) - 1]
+        spark_api.prewarmer.warm(model.url)
+
+    async def process(self, data: list, deadline: float | None = None) -> None:
+        """处理数据,然后向后端发送请求，接收回复并处理，最后通过钩子方法输出处理结果。
+
+        回复以流式到达，每收到一段就调用一次on_partial，
+        使前端在生成过程中即可看到已到达的回答。代码块和列表结束后才整体作为稳定内容输出，
+        此前只输出新完成的行，前端只需追加内容并替换未完成的最后一行，不必重建整个回答或未结束的块。
+        config.render_highlight为True时，代码块在结束后整体高亮。
+        超过截止时间时调用on_fail，被取消时调用on_cancel。
+
+        Args:
+            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
+            deadline: float | None, 截止时间（time.monotonic()），为None时不限时
+        """
+        resquest_data = self.translate(data)
+        try:
+            renderer = _AnswerRenderer(self.translate_result("", data),
+                                       config.render_highlight)
+            async for delta in self.stream_chat(resquest_data, deadline):
+                self.on_partial(*await self.render(renderer.feed, delta))
+            formatted_result = await self.render(renderer.finish)
+            response = await self.render(self.translate_result, formatted_result, data)
+            self.on_finish(response)
+            # 启用metrics时记录转换html所用的时间
+            if metrics.recorder is not None:
+                metrics.recorder.observe("render", resquest_data[0].name,
+                                         renderer.elapsed)
+
+        except asyncio.CancelledError:
+            self.on_cancel(data[0])
+            raise
+
+        except TimeoutError:
+            self.on_fail("处理超时，请重试。")
+
+        except SparkApiError as e:
+            #根据错误码在字典中获取错误信息
+            error_message = error_code.error_codes.get(e.code, str(e))
+            self.on_fail(error_message)
+
+        except Exception as e:
+            self.on_fail(f"请求失败: {e}")
+
+    async def render(self, func: Callable, *args):
+        """执行转换html的函数。
+
+        config.render_in_thread为True时在渲染线程中执行，事件循环在等待期间继续处理网络读取和界面刷新；
+        否则直接在事件循环中执行。
+
+        Args:
+            func: Callable, 转换html的函数
+            *args: 函数的参数
+
+        Returns:
+            函数的返回值
+        """
+        if not config.render_in_thread:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(render_executor, func, *args)
+
+    def translate(self, data: list) -> list:
+        """翻译数据,将前端传来的数据翻译成后端需要的数据格式。
+
+        Args:
+            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
+
+        return:
+            res: list, 后端需要的数据格式，包含模型类型，历史记录，聊天参数，问题和唯一标识。
+        """
+        res = []
+        model_index = int(data[1][0]) - 1
+        res.append(spark_api.chat_models[model_index])
+        res.append(self.chat_history)
+        res.append(self.chat_params)
+        res.append(data[3])
+        res.append(data[0])
+
+        return res
+
+    async def resquest_chat(self, resquest_date: list) -> str:
+        """请求聊天,向后端发送请求，接收回复的数据。
+        Args:
+            resquest_data: list, 后端需要的数据格式，包含模型类型，历史记录，聊天参数，问题和唯一标识。
+
+        Returns:
+            str, 机器人的回答
+        """
+        api_result = await spark_api.request_chat(resquest_date[0],
+                                        resquest_date[1],
+                                        resquest_date[2],
+                                        resquest_date[3],
+                                        self.uid)
+
+        return api_result
+
+    async def stream_chat(
+        self,
+        resquest_date: list,
+        deadline: float | None = None,
+    ) -> AsyncIterator[str]:
+        """流式请求聊天,向后端发送请求，逐段产出回复的数据。
+
+        config.hedge_backup_model不为0时，使用对冲请求，主模型迟迟没有回复时改用后备模型。
+
+        Args:
+            resquest_data: list, 后端需要的数据格式，包含模型类型，历史记录，聊天参数，问题和唯一标识。
+            deadline: float | None, 截止时间（time.monotonic()），为None时不限时
+
+        Yields:
+            str, 机器人回答的增量片段
+        """
+        backup_index = config.hedge_backup_model - 1
+        if 0 <= backup_index < len(spark_api.chat_models):
+            models = [resquest_date[0]]
+            if spark_api.chat_models[backup_index] is not resquest_date[0]:
+                models.append(spark_api.chat_models[backup_index])
+            async for delta in hedging.hedged_stream_chat(models,
+                                                          resquest_date[1],
+                                                          resquest_date[2],
+                                                          resquest_date[3],
+                                                          self.uid,
+                                                          deadline):
+                yield delta
+            return
+
+        async for delta in spark_api.stream_chat(resquest_date[0],
+                                                 resquest_date[1],
+                                                 resquest_date[2],
+                                                 resquest_date[3],
+                                                 self.uid,
+                                                 deadline=deadline):
+            yield delta
+
+    ##将处理结果转化为前端展示的格式
+    def translate_result(self, formatted_result: str, data: list) -> str:
+        """翻译结果,将后端返回处理过的数据翻译成前端需要的数据格式。
+
+        Args:
+            formatted_result: str, 后端返回处理过的数据，包含机器人的回答。
+            data: list, 前端传来的数据，包含唯一标识、模型名称、信息类型和内容。
+
+        return:
+            res: str, 前端需要的数据格式，包含所使用的模型名称和机器人的回答。
+        """
+        response = f"回答: <br> {formatted_result}"
+        response = _BR_RUN_RE.sub('<br>', response)
+        return response
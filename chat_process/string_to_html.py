@@ -1,28 +1,284 @@
-import re
 """str格式转换html模块
 
 该模块用于将str格式的聊天内容转换为html格式，以便在前端展示。
+转换以行为单位单遍进行，可以随着流式回复逐段输入，总耗时与回答长度成线性关系。
+支持代码块、行内代码、标题、有序/无序列表和加粗，并对html特殊字符进行转义。
 """
 
+import html
+import re
+
+from chat_process.highlight import highlight as highlight_code
+
+_FENCE = "```"
+_HEADING_RE = re.compile(r"(#{1,6})\s+(.*)")
+_UNORDERED_RE = re.compile(r"\s*[-*+]\s+(.*)")
+_ORDERED_RE = re.compile(r"\s*\d+[.)]\s+(.*)")
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+
+
+def render_inline(text: str) -> str:
+    """转换一行文本中的行内格式。
+
+    转义html特殊字符，并将`code`转换为<code>、**bold**转换为<b>。
+
+    Args:
+        text: str，一行文本
+
+    Returns:
+        str, html格式的文本
+    """
+    segments = text.split("`")
+    if len(segments) % 2 == 0: # 反引号不成对时，最后一个反引号按普通字符处理
+        segments[-2:] = ["`".join(segments[-2:])]
+    res = []
+    for i, segment in enumerate(segments):
+        segment = html.escape(segment, quote=False)
+        if i % 2:
+            res.append(f"<code>{segment}</code>")
+        else:
+            res.append(_BOLD_RE.sub(r"<b>\1</b>", segment))
+    return "".join(res)
+
+
+class StreamingHtmlRenderer:
+    """流式的str转html渲染器。
+
+    通过feed逐段输入回答，只有完整的行才会被转换并返回，不完整的最后一行暂存在缓冲区中，
+    因此跨越两段输入的代码块标记也能被正确识别。pending_html返回缓冲区中内容的临时转换结果，
+    以便在行结束前就能展示。open_block为False时，已返回的html中的标签都已闭合，
+    前端可以把它们作为稳定的内容追加显示，之后不再改动。
+    启用语法高亮时，代码块在结束后才整体返回高亮的html，结束前的内容只出现在pending_html中。
+
+    流式显示时不必在每次输入后重新获取整个未结束的块：block_start是未结束的块在已返回的html中的起始位置，
+    take_block_lines只返回该块中上次调用之后新完成的行，pending_line只转换未完成的最后一行，
+    每次输入的处理量只与新到达的内容有关。
+
+    Attributes:
+        in_code: bool，当前是否在代码块中
+        language: str，当前代码块的语言
+        highlight: bool，是否对代码块进行语法高亮
+        block_start: int，未结束的代码块或列表在已返回的html（feed返回值依次拼接）中的起始位置
+    """
+
+    def __init__(self, highlight: bool = False) -> None:
+        self.in_code = False
+        self.language = ""
+        self.highlight = highlight
+        self.block_start = 0
+        self._emitted = 0 # 已返回的html的总长度
+        self._opened_at: int | None = None # 本行的html中块开始的位置
+        self._list_tag = ""
+        self._pending: list[str] = []
+        self._code: list[str] = [] # 启用高亮时，当前代码块中已完成的行
+        self._block_lines: list[str] = [] # 当前块中已完成的行：代码行的原文或列表项的html
+        self._taken = 0 # _block_lines中已由take_block_lines返回的行数
+
+    @property
+    def open_block(self) -> bool:
+        """bool，当前是否在未结束的代码块或列表中"""
+        return self.in_code or bool(self._list_tag)
+
+    @property
+    def block_kind(self) -> str:
+        """str，未结束的块的类型："code"、"ul"、"ol"，不在块中时为空字符串"""
+        return "code" if self.in_code else self._list_tag
+
+    def feed(self, chunk: str) -> str:
+        """输入一段回答。
+
+        Args:
+            chunk: str，新到达的回答片段
+
+        Returns:
+            str, 本次新完成的行转换出的html
+        """
+        if "\n" not in chunk:
+            if chunk:
+                self._pending.append(chunk)
+            return ""
+
+        lines = chunk.split("\n")
+        self._pending.append(lines[0])
+        lines[0] = "".join(self._pending)
+        self._pending = [lines.pop()]
+        res = []
+        for line in lines:
+            self._opened_at = None
+            line_html = self._render_line(line)
+            if self._opened_at is not None:
+                self.block_start = self._emitted + self._opened_at
+            self._emitted += len(line_html)
+            res.append(line_html)
+        return "".join(res)
+
+    def finish(self) -> str:
+        """结束输入，转换缓冲区中剩余的内容并闭合未结束的标签。
+
+        Returns:
+            str, 剩余内容转换出的html
+        """
+        res = ""
+        if self._pending:
+            line = "".join(self._pending)
+            self._pending = []
+            if line:
+                res = self._render_line(line)
+        res += self._close_blocks()
+        self._emitted += len(res)
+        return res
+
+    def take_block_lines(self) -> list[str]:
+        """获取未结束的块中上次调用之后新完成的行。
+
+        块结束或新的块开始时，尚未取走的行随之丢弃（它们已包含在块结束时返回的html中）。
+
+        Returns:
+            list[str], 代码块中为代码行的原文（不含换行符，未转义），列表中为列表项内容的html
+        """
+        lines = self._block_lines[self._taken:]
+        self._taken = len(self._block_lines)
+        return lines
+
+    def pending_line(self) -> str:
+        """获取未完成的最后一行的临时转换结果，不含当前块中已完成的行。
+
+        Returns:
+            str, 临时的html；在代码块中时为<pre>包裹的转义文本
+        """
+        line = "".join(self._pending)
+        stripped = line.strip()
+        if stripped and _FENCE.startswith(stripped[:3]):
+            return "" # 可能是代码块标记的开头，等待这一行完整
+        if self.in_code:
+            return f"<pre>{html.escape(line, quote=False)}</pre>" if line else ""
+        return render_inline(line)
+
+    def pending_html(self) -> str:
+        """获取缓冲区中未完成的行的临时转换结果。
+
+        结果末尾会闭合当前未结束的代码块和列表，与已返回的html拼接后即为完整的html。
+        启用高亮时结果包含整个未结束的代码块，流式显示应使用take_block_lines和pending_line。
+
+        Returns:
+            str, 临时的html
+        """
+        line = "".join(self._pending)
+        stripped = line.strip()
+        if stripped and _FENCE.startswith(stripped[:3]):
+            line = "" # 可能是代码块标记的开头，等待这一行完整
+        if self.in_code:
+            # 启用高亮时代码块的开始标签和已完成的行都还没有返回
+            opener = ("<pre><code>" + html.escape("".join(self._code), quote=False)
+                      if self.highlight else "")
+            return opener + html.escape(line, quote=False) + "</code></pre>"
+        res = render_inline(line)
+        if self._list_tag:
+            return f"{res}</li></{self._list_tag}>" if res else f"</{self._list_tag}>"
+        return res
+
+    def _close_blocks(self) -> str:
+        """闭合未结束的代码块和列表。
+
+        Returns:
+            str, 闭合标签
+        """
+        res = ""
+        if self.in_code:
+            res += self._close_code()
+        if self._list_tag:
+            res += f"</{self._list_tag}>"
+            self._list_tag = ""
+            self._reset_block_lines()
+        return res
+
+    def _reset_block_lines(self) -> None:
+        """丢弃上一个块中已完成的行。"""
+        self._block_lines = []
+        self._taken = 0
+
+    def _close_code(self) -> str:
+        """结束当前代码块。
+
+        Returns:
+            str, 闭合标签；启用高亮时为整个代码块高亮后的html
+        """
+        self.in_code = False
+        self._reset_block_lines()
+        if not self.highlight:
+            return "</code></pre>"
+        code = "".join(self._code)
+        self._code = []
+        return f"<pre><code>{highlight_code(code, self.language)}</code></pre>"
+
+    def _render_line(self, line: str) -> str:
+        """转换一个完整的行。
+
+        Args:
+            line: str，不含换行符的一行
+
+        Returns:
+            str, html
+        """
+        line = line.rstrip("\r")
+        stripped = line.strip()
+
+        if stripped.startswith(_FENCE):
+            if self.in_code:
+                return self._close_code()
+            res = self._close_blocks()
+            self.in_code = True
+            self.language = stripped[3:].strip()
+            self._opened_at = len(res)
+            return res if self.highlight else res + "<pre><code>"
+        if self.in_code:
+            self._block_lines.append(line)
+            if not self.highlight:
+                return html.escape(line, quote=False) + "\n"
+            self._code.append(line + "\n")
+            return ""
+
+        for pattern, tag in ((_UNORDERED_RE, "ul"), (_ORDERED_RE, "ol")):
+            match = pattern.fullmatch(line)
+            if match:
+                res = ""
+                if self._list_tag != tag:
+                    res = self._close_blocks()
+                    self._opened_at = len(res)
+                    res += f"<{tag}>"
+                    self._list_tag = tag
+                item = render_inline(match.group(1))
+                self._block_lines.append(item)
+                return res + f"<li>{item}</li>"
+
+        res = self._close_blocks()
+        if not stripped:
+            return res
+        match = _HEADING_RE.fullmatch(stripped)
+        if match:
+            level = len(match.group(1))
+            return res + f"<h{level}>{render_inline(match.group(2))}</h{level}>"
+        return res + render_inline(line) + "<br>"
+
+
 class StringToHtml:
     """将str格式的聊天内容转换为html格式。
 
+    Attributes:
+        highlight: bool，是否对代码块进行语法高亮
     """
 
+    def __init__(self, highlight: bool = False) -> None:
+        self.highlight = highlight
+
     def translate(self, response:str)->str:
         """翻译聊天内容,将str格式的聊天内容翻译为html格式。
-        
+
         Args:
         response: str，str格式的聊天内容
-        
+
         Returns:
             str, html格式的聊天内容
         """
-        response = response.replace("\n", "<br>")
-        while "```" in response:
-            response = response.replace("```", "<code>", 1)
-            response = response.replace("```", "</code>", 1)
-        response= re.sub(r'(<br>\s*)+', '<br>', response)
-        response = re.sub(r'</code><br>', '</code>', response)
-        return response
-        
\ No newline at end of file
+        renderer = StreamingHtmlRenderer(self.highlight)
+        return renderer.feed(response) + renderer.finish()
@@ -0,0 +1,182 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+from chat_process.processor import ChatProcessor
+from spark_api import config
+from spark_api import spark_api
+from spark_api.mock_server import MockSparkServer
+from spark_api.scheduler import RequestScheduler
+from spark_api.storage import open_store
+
+# 核心模块的导入耗时预算（毫秒），批量任务和服务进程每次启动都要付出这部分时间
+IMPORT_BUDGET_MS = 300
+HEADLESS_MODULES = ["chat_process.processor", "spark_api.batch", "spark_api.hedging"]
+
+
+def import_time_ms(module: str) -> float:
+    """在新的解释器中用-X importtime测量导入模块的累计耗时"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        # 格式：import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise AssertionError(f"{module} not found in importtime output")
+
+
+class RecordingProcessor(ChatProcessor):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def on_partial(self, stable, kind, lines, tail):
+        self.events.append(("partial", stable, kind, lines, tail))
+
+    def on_finish(self, response):
+        self.events.append(("finish", response))
+
+    def on_fail(self, message):
+        self.events.append(("fail", message))
+
+    def on_start(self, data):
+        self.events.append(("start", data[0]))
+
+    def on_cancel(self, data_id):
+        self.events.append(("cancel", data_id))
+
+
+# 测试核心模块不依赖图形界面和websockets，导入耗时在预算内，并且可以脱离Qt处理聊天
+class TestProcessorClass():
+    def testcase_0(self):
+        code = (f"import sys, {', '.join(HEADLESS_MODULES)}; "
+                "print(sorted({'PyQt6', 'qasync', 'websockets'} & set(sys.modules)))")
+        result = subprocess.run([sys.executable, "-c", code],
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == "[]"
+
+    def testcase_1(self):
+        # 取多次测量的最小值，减少机器负载带来的波动
+        elapsed = min(import_time_ms("chat_process.processor") for _ in range(3))
+        assert elapsed < IMPORT_BUDGET_MS
+
+    def testcase_2(self, monkeypatch):
+        monkeypatch.setattr(spark_api, "scheduler",
+                            RequestScheduler(base_delay=0.001, qps=1000))
+
+        async def main():
+            async with MockSparkServer(answer="**你好**\n世界", chunk_size=3) as server:
+                monkeypatch.setattr(spark_api, "chat_models", [server.model()])
+                processor = RecordingProcessor()
+                await processor.submit(["1", "1", "user", "hi"])
+                return processor
+        processor = asyncio.run(main())
+        assert processor.events[-1] == ("finish", "回答: <br><b>你好</b><br>世界<br>")
+        assert processor.events[0] == ("start", "1")
+        assert all(event[0] == "partial" for event in processor.events[1:-1])
+        assert processor.chat_history.messages[-1]["content"] == "**你好**\n世界"
+
+    def testcase_3(self, monkeypatch):
+        monkeypatch.setattr(spark_api, "scheduler",
+                            RequestScheduler(base_delay=0.001, qps=1000))
+        monkeypatch.setattr(config, "render_in_thread", True)
+        monkeypatch.setattr(config, "render_highlight", True)
+        code = "".join(f"def f{i}(x):\n    return [x * {i} for _ in range(10)]\n"
+                       for i in range(500))
+        answer = "代码：\n```python\n" + code + "```\n"
+
+        async def main():
+            async with MockSparkServer(answer=answer, chunk_size=4096) as server:
+                monkeypatch.setattr(spark_api, "chat_models", [server.model()])
+                processor = RecordingProcessor()
+                gaps = []
+                task = processor.submit(["1", "1", "user", "hi"])
+                last = time.perf_counter()
+                while not task.done(): # 转换html期间事件循环仍能及时运行其他任务
+                    await asyncio.sleep(0.001)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+                return processor, max(gaps)
+        processor, max_gap = asyncio.run(main())
+        assert processor.events[-1][0] == "finish"
+        assert "return" in processor.events[-1][1]
+        assert max_gap < 0.1
+
+    def testcase_4(self, monkeypatch):
+        monkeypatch.setattr(spark_api, "scheduler",
+                            RequestScheduler(base_delay=0.001, qps=1000))
+
+        async def main():
+            async with MockSparkServer(chunk_size=1, token_rate=200) as server:
+                monkeypatch.setattr(spark_api, "chat_models", [server.model()])
+                processor = RecordingProcessor()
+                # 处理期间继续提交，按顺序排队，上一条回答写入消息记录后才发送下一条
+                done = [processor.submit([str(i), "1", "user", f"问题{i}"])
+                        for i in range(4)]
+                assert processor.busy
+                assert [data[0] for data in processor.queued] == ["0", "1", "2", "3"]
+                processor.cancel("2")
+                await asyncio.gather(*done, return_exceptions=True)
+                lengths = [len(request["payload"]["message"]["text"])
+                           for request in server.requests]
+                return processor, lengths, server.peak_concurrency, done
+        processor, lengths, peak, done = asyncio.run(main())
+        assert [e for e in processor.events if e[0] in ("start", "cancel")] == [
+            ("cancel", "2"), ("start", "0"), ("start", "1"), ("start", "3")]
+        assert lengths == [1, 3, 5]
+        assert peak == 1
+        assert done[2].cancelled() and not processor.busy
+        assert [msg["content"] for msg in processor.chat_history.messages[1::2]] == [
+            "收到：问题0", "收到：问题1", "收到：问题3"]
+
+    def testcase_5(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(spark_api, "scheduler",
+                            RequestScheduler(base_delay=0.001, qps=1000))
+        path = str(tmp_path / "history.jsonl")
+        monkeypatch.setattr(config, "history_path", path)
+
+        async def main():
+            async with MockSparkServer(first_token_latency=5) as server:
+                monkeypatch.setattr(spark_api, "chat_models", [server.model()])
+                processor = RecordingProcessor()
+                processor.submit(["0", "1", "user", "hi"])
+                processor.submit(["1", "1", "user", "排队中"])
+                while not server.requests:
+                    await asyncio.sleep(0.01)
+                # 关闭时等到撤销未得到回答的问题之后才关闭存储
+                await processor.close()
+                return processor
+        processor = asyncio.run(main())
+        assert ("cancel", "0") in processor.events and ("cancel", "1") in processor.events
+        assert not any(event[0] == "fail" for event in processor.events)
+        store = open_store(path)
+        assert len(store) == 0
+        store.close()
+
+    def testcase_6(self, monkeypatch):
+        monkeypatch.setattr(spark_api, "scheduler",
+                            RequestScheduler(base_delay=0.001, qps=1000))
+        lines = [f"value_{i} = compute(value_{i - 1}) + {i}" for i in range(1000)]
+        answer = "代码：\n```python\n" + "\n".join(lines) + "\n```\n"
+
+        async def main():
+            async with MockSparkServer(answer=answer, chunk_size=6) as server:
+                monkeypatch.setattr(spark_api, "chat_models", [server.model()])
+                processor = RecordingProcessor()
+                await processor.submit(["1", "1", "user", "hi"])
+                return processor
+        processor = asyncio.run(main())
+        partials = [event for event in processor.events if event[0] == "partial"]
+        # 未结束的代码块逐行追加，每段只输出新完成的行和未完成的最后一行
+        assert [line for event in partials for line in event[3]] == lines
+        assert {event[2] for event in partials} == {"", "code"}
+        size = sum(len(event[4]) + sum(map(len, event[3])) for event in partials)
+        assert size < 10 * len(answer)
+        stable = "".join(event[1] for event in partials)
+        assert processor.events[-1][1].startswith(stable)
+        assert "</code></pre>" in stable
@@ -0,0 +1,69 @@
+from chat_process import highlight
+from chat_process.string_to_html import StringToHtml, StreamingHtmlRenderer
+
+# 测试str转html，以及流式输入与一次性输入的结果一致
+class TestStringToHtmlClass():
+    def testcase_0(self):
+        res = StringToHtml().translate("a <b>\n```py\nx < 1\n```\n- `c`\n# t")
+        assert res == ("a &lt;b&gt;<br><pre><code>x &lt; 1\n</code></pre>"
+                       "<ul><li><code>c</code></li></ul><h1>t</h1>")
+
+    def testcase_1(self):
+        text = "# 标题\n正文 **粗**\n\n1. a\n2. b\n```\ncode\n```\n结束"
+        renderer = StreamingHtmlRenderer()
+        res = ""
+        for ch in text:
+            res += renderer.feed(ch)
+        res += renderer.finish()
+        assert res == StringToHtml().translate(text)
+
+    def testcase_2(self):
+        renderer = StreamingHtmlRenderer()
+        assert renderer.feed("```\nx = 1\n`") == "<pre><code>x = 1\n"
+        assert renderer.open_block
+        assert renderer.pending_html() == "</code></pre>"
+        assert renderer.feed("``\n") == "</code></pre>"
+        assert not renderer.open_block
+
+    def testcase_3(self):
+        text = "前言\n```python\nx = 1 < 2\n```\n```unknown\n<a>\n```\n"
+        renderer = StreamingHtmlRenderer(highlight=True)
+        res = renderer.feed("前言\n```python\nx = 1")
+        # 代码块结束前只在临时内容中显示转义后的代码
+        assert res == "前言<br>"
+        assert renderer.pending_html() == "<pre><code>x = 1</code></pre>"
+        res += renderer.feed(text[len("前言\n```python\nx = 1"):]) + renderer.finish()
+        assert res == StringToHtml(highlight=True).translate(text)
+        assert res.endswith("<pre><code>&lt;a&gt;\n</code></pre>")
+        key = highlight.cache.make_key("x = 1 < 2\n", "python")
+        assert highlight.cache.get(key) is not None
+        if highlight._pygments_highlight("x\n", "python") is not None:
+            assert "<span" in res
+
+    def testcase_4(self):
+        renderer = StreamingHtmlRenderer(highlight=True)
+        res = renderer.feed("前言\n```python\nx = 1\ny")
+        # 块在已返回的html中的起始位置，以及只返回新完成的行和未完成的行
+        assert renderer.block_kind == "code"
+        assert renderer.block_start == len("前言<br>")
+        assert renderer.take_block_lines() == ["x = 1"]
+        assert renderer.take_block_lines() == []
+        assert renderer.pending_line() == "<pre>y</pre>"
+        res += renderer.feed(" < 2\n```\n- a\n- `b`")
+        assert renderer.block_kind == "ul"
+        assert res[renderer.block_start:] == "<ul><li>a</li>"
+        # 代码块的行在块结束时一并丢弃
+        assert renderer.take_block_lines() == ["a"]
+        assert renderer.pending_line() == "- <code>b</code>"
+        renderer.feed("\n")
+        assert renderer.take_block_lines() == ["<code>b</code>"]
+
+    def testcase_5(self):
+        # 长代码块逐段输入时，新完成的行和未完成的行的总长度与代码长度成正比（比例取决于行长）
+        renderer = StreamingHtmlRenderer(highlight=True)
+        text = "```python\n" + "value = compute(value) + 1\n" * 2000
+        total = 0
+        for i in range(0, len(text), 6):
+            renderer.feed(text[i:i + 6])
+            total += sum(map(len, renderer.take_block_lines())) + len(renderer.pending_line())
+        assert total < 10 * len(text)
@@ -1,173 +1,255 @@
 """AI Chat Client
 
 该模块提供一个简单的聊天界面，用户可以通过输入框与模拟AI进行对话。
-聊天界面包括发送消息、选择模型、清空聊天记录等功能。
+聊天界面包括发送消息、选择模型、清空聊天记录等功能，多个对话以标签页的形式同时进行。
 """
 import asyncio
 from qasync import QEventLoop
+import os
+import re
 import sys
+import tempfile
+import time
+from collections import deque
 from datetime import datetime
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QPushButton, QTextBrowser, QComboBox, QMenuBar, QWidgetAction
+    QTextEdit, QPushButton, QTextBrowser, QComboBox, QMenuBar, QWidgetAction,
+    QListWidget, QListWidgetItem, QTabWidget, QToolButton, QLineEdit
+)
+from PyQt6.QtGui import (
+    QFont, QTextCursor, QTextBlockFormat, QTextCharFormat, QTextListFormat, QAction
 )
-from PyQt6.QtGui import QFont, QTextCursor, QTextBlockFormat, QTextCharFormat, QAction
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal, pyqtSlot
 from chat_process.chat_process import ProcessingModule
+from spark_api import config
+from spark_api import metrics
+from spark_api import search
+from spark_api.storage import HistoryStore, JsonlHistoryStore, open_store
 
+# 以这些块级标签结尾的html插入后，后续内容需要另起一个块，否则会并入该块
+_BLOCK_END_RE = re.compile(r"</(h[1-6]|ul|ol|pre)>\s*$")
 
-class ChatGui(QMainWindow):
-    """聊天界面类，用于与用户交互并处理聊天信息。
+# 各类消息的对齐方式
+_ALIGNMENTS = {
+    "user": Qt.AlignmentFlag.AlignRight,
+    "processing": Qt.AlignmentFlag.AlignLeft,
+    "ai": Qt.AlignmentFlag.AlignLeft,
+    "system": Qt.AlignmentFlag.AlignCenter,
+}
+
+# 流式显示未结束的列表时使用的列表样式
+_LIST_STYLES = {
+    "ul": QTextListFormat.Style.ListDisc,
+    "ol": QTextListFormat.Style.ListDecimal,
+}
+
+
+class _DisplayEntry:
+    """聊天显示区中的一条消息。
+
+    Attributes:
+        start: 消息在文档中的起始位置（消息块前的分隔符）。
+        tag: 消息的类型（user, processing, ai, system）。
+        html: 消息显示的html。
+        archived: 消息是否已保存在归档中（从归档中重新载入的消息）。
+    """
+    __slots__ = ("start", "tag", "html", "archived")
+
+    def __init__(self, start: int, tag: str, html: str, archived: bool = False):
+        self.start = start
+        self.tag = tag
+        self.html = html
+        self.archived = archived
+
+
+class ChatTab(QWidget):
+    """一个对话标签页，包含聊天显示区、排队列表和该对话的处理模块。
+
+    每个对话有各自的处理模块、消息记录和显示区归档，互不影响，可以同时进行。
 
     Attributes:
         send_data_signal: 用于向处理模块发送数据的信号。
-        timeout_signal: 超时信号，用于在处理模块超时时触发。
-        current_model: 当前选中的模型。
+        processing_changed: 开始或结束处理一条消息时发射，参数为是否正在处理。
+        conversation: 对话id，用于区分存储中的消息记录和显示区归档。
+        current_model: 本对话当前选中的模型。
+        processing: 是否正在处理消息。
         data_structure: 记录发送的消息数据。
-        allow_send: 控制是否允许发送消息。
         processing_message_id: 当前处理消息的唯一标识。
         processing_block_position: 记录"正在处理中..."消息的位置。
+        processing_block_end: 记录"正在处理中..."消息结束的位置，回答可能占据多个块。
+        answer_stable_end: 流式回答中稳定内容结束的位置，为None时尚未开始显示回答。
+        answer_block_end: 流式回答中未结束的代码块或列表结束的位置，块中新完成的行追加在这里，
+            其后为每次刷新时替换的临时内容（未完成的最后一行）。
+        render_timer: 刷新流式回答显示的计时器，间隔内到达的片段合并为一次刷新。
+        render_interval: 当前的刷新间隔（毫秒），界面刷新耗时较长时自动增大。
+        display_archive: 显示区的归档，超出显示上限的旧消息移出文档后保存在这里，向上滚动到顶部时按页重新载入。
+        queue_list: 排队中的消息列表，正在处理时发送的消息在这里等待，轮到处理时移入聊天显示区。
     """
     send_data_signal = pyqtSignal(list)
-    timeout_signal = pyqtSignal(str)
+    processing_changed = pyqtSignal(bool)
 
-    def __init__(self):
-        """初始化聊天界面。"""
-        super().__init__()
-        self.setWindowTitle("AI Chat Client")
-        self.setGeometry(800, 450, 800, 600)
+    def __init__(self, conversation: str, current_model: str, parent: QWidget | None = None):
+        """初始化对话标签页。
 
-        self.current_model = "1.Spark Lite"
+        Args:
+            conversation: 对话id。
+            current_model: 对话使用的模型。
+            parent: 父控件。
+        """
+        super().__init__(parent)
+        self.conversation = conversation
+        self.current_model = current_model
+        self.processing = False
+        self._closing: asyncio.Future | None = None
         self.data_structure = []
-        self.allow_send = True
         self.processing_message_id = None
         self.processing_block_position = 0
-
-        self.processing_module = ProcessingModule()
+        self.processing_block_end = 0
+        self.answer_stable_end = None
+        self.answer_block_end = None
+        self.render_interval = config.render_interval_ms
+        self._pending_stable: list[str] = []
+        self._pending_kind = ""
+        self._pending_lines: list[str] = []
+        self._pending_tail = ""
+        self._block_list = None # 流式显示未结束的列表时使用的QTextList
+
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self._flush_partial)
+
+        # 显示区只保留最近的config.display_max_messages条消息，
+        # 文档中显示的是归档中[_archive_start, 末尾)的消息，再加上尚未归档的消息
+        self._entries: deque[_DisplayEntry] = deque()
+        self._processing_entry = None
+        self.display_archive = self._open_display_archive()
+        self._archive_floor = 0
+        self._archive_start = len(self.display_archive)
+
+        self.processing_module = ProcessingModule(conversation)
 
         self._setup_ui()
         self._setup_signals()
-        self._setup_menu()
+        self._load_older()
 
-    def _setup_ui(self):
-        """设置界面元素，包括聊天显示区和输入区。"""
-        central_widget = QWidget()
-        self.setCentralWidget(central_widget)
-        layout = QVBoxLayout(central_widget)
+    def _open_display_archive(self) -> HistoryStore:
+        """打开显示区的归档。
 
-        self.chat_display = QTextBrowser()
-        layout.addWidget(self.chat_display)
+        默认对话的归档名为"display"，其他对话为"display-对话id"。
+        未配置config.display_archive_path时，归档保存在临时目录中，程序退出后删除。
 
-        input_layout = QHBoxLayout()
-        self.msg_entry = QTextEdit(self)
-        self.msg_entry.setFixedHeight(50)
-        self.msg_entry.setFont(QFont("Arial", 12))
-        input_layout.addWidget(self.msg_entry)
+        Returns:
+            HistoryStore: 归档，每条记录的role为消息类型，content为消息显示的html。
+        """
+        if config.display_archive_path:
+            name = "display" if self.conversation == "default" else f"display-{self.conversation}"
+            return open_store(config.display_archive_path, name)
+        self._archive_dir = tempfile.TemporaryDirectory()
+        return JsonlHistoryStore(os.path.join(self._archive_dir.name, "display.jsonl"))
 
-        self.send_button = QPushButton("发送")
-        self.send_button.setFixedSize(70, 50)
-        self.send_button.clicked.connect(self._send_message)
-        input_layout.addWidget(self.send_button)
+    def _setup_ui(self):
+        """设置界面元素，包括聊天显示区和排队列表。"""
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
 
-        layout.addLayout(input_layout)
+        self.chat_display = QTextBrowser()
+        self.chat_display.verticalScrollBar().valueChanged.connect(self._on_scroll)
+        layout.addWidget(self.chat_display)
 
-    ##因为processing_module.process是一个异步函数，所以需要在这里设置信号与处理方法的连接
-    async def _process(self, data: list):
-        """异步处理数据"""
-        await self.processing_module.process(data)
+        self.queue_list = QListWidget(self)
+        self.queue_list.setMaximumHeight(80)
+        self.queue_list.setToolTip("双击移出队列")
+        self.queue_list.itemDoubleClicked.connect(
+            lambda item: self.processing_module.cancel(item.data(Qt.ItemDataRole.UserRole)))
+        self.queue_list.hide()
+        layout.addWidget(self.queue_list)
 
     def _setup_signals(self):
         """设置信号与处理方法的连接。"""
         self.processing_module.process_finish.connect(self._on_process_finish)
         self.processing_module.process_fail.connect(self._on_process_fail)
-        self.send_data_signal.connect(lambda data: asyncio.create_task(self._process(data)))
-        self.timeout_signal.connect(self._on_process_fail)
-
-    def _setup_menu(self):
-        """设置菜单栏，包括文件、编辑和设置菜单。"""
-        menubar = self.menuBar()
-        if not menubar:
-            raise ValueError("No menu bar found.")
-
-        file_menu = menubar.addMenu('文件')
-        if not file_menu:
-            raise ValueError("Failed to create file menu.")
+        self.processing_module.process_partial.connect(self._on_process_partial)
+        self.processing_module.process_cancel.connect(self._on_process_cancel)
+        self.processing_module.process_start.connect(self._on_process_start)
+        # 处理模块在事件循环中处理数据，超时由截止时间传递到请求中
+        self.send_data_signal.connect(self.processing_module.submit)
 
-        exit_action = QAction('退出', self)
-        exit_action.triggered.connect(self.close)
-        file_menu.addAction(exit_action)
+    def set_model(self, model: str):
+        """切换本对话的模型，显示提示消息并预热连接。
 
-        edit_menu = menubar.addMenu('编辑')
-        if not edit_menu:
-            raise ValueError("Failed to create edit menu.")
-        clear_action = QAction('清空', self)
-        clear_action.triggered.connect(self._clear_chat)
-        edit_menu.addAction(clear_action)
+        Args:
+            model: 模型名称。
+        """
+        self.current_model = model
+        self._display_message(f"已切换到 {self.current_model}", "system")
+        self.prewarm()
 
-        settings_menu = menubar.addMenu('设置')
-        if not settings_menu:
-            raise ValueError("Failed to create settings menu.")
-        self.model_combo = QComboBox(self)
-        self.model_combo.addItems(["1.Spark Lite", "2.Spark Pro", "3.Spark Pro-128K", "4.Spark Max", "5.Spark Max-32K", "6.Spark4.0 Ultra"])
-        self.model_combo.setCurrentIndex(0)
-        self.model_combo.currentIndexChanged.connect(self._on_model_changed)
+    def prewarm(self):
+        """预热本对话当前模型的连接。"""
+        self.processing_module.prewarm(self.current_model)
 
-        model_widget = QWidget(self)
-        model_layout = QVBoxLayout(model_widget)
-        model_layout.setContentsMargins(0, 0, 0, 0)
-        model_layout.addWidget(self.model_combo)
+    def send(self, user_input: str):
+        """把一条消息发送给处理模块。
 
-        model_action = QWidgetAction(self)
-        model_action.setDefaultWidget(model_widget)
-        settings_menu.addAction(model_action)
+        处理模块正在处理其他消息时，消息先显示在排队列表中，轮到处理时再显示到聊天显示区。
 
-    def _on_model_changed(self):
-        """更新当前选中的模型，并显示提示消息。"""
-        self.current_model = self.model_combo.currentText()
-        self._display_message(f"已切换到 {self.current_model}", "system")
+        Args:
+            user_input: 用户输入的消息。
+        """
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        self.data_structure = [timestamp, self.current_model, "text", user_input]
 
-    def _send_message(self):
-        """处理发送消息的逻辑，包括显示用户消息和发送数据给处理模块。"""
-        if not self.allow_send:
-            return
+        if self.processing_module.busy:
+            item = QListWidgetItem(f"排队中：{user_input}")
+            item.setData(Qt.ItemDataRole.UserRole, timestamp)
+            self.queue_list.addItem(item)
+            self.queue_list.show()
 
-        user_input = self.msg_entry.toPlainText().strip()
-        if not user_input:
-            return
+        # 所发送的信号即为
+        self.send_data_signal.emit(self.data_structure)
 
-        self._display_message(user_input, "user")
-        self.msg_entry.clear()
+    def stop(self):
+        """停止正在处理的消息。"""
+        self.processing_module.cancel()
 
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-        self.data_structure = [timestamp, self.current_model, "text", user_input]
-        self.processing_message_id = timestamp
+    @pyqtSlot(list)
+    def _on_process_start(self, data: list):
+        """处理模块开始处理一条消息时，显示用户消息和“正在处理中...”。
 
-        self.allow_send = False
-        self.send_button.setEnabled(False)
+        Args:
+            data: 发送的数据列表，包含唯一标识、模型名称、信息类型和内容。
+        """
+        self._remove_queued(data[0])
+        self._display_message(data[3], "user")
+        self.processing_message_id = data[0]
+        self._set_processing(True)
 
         # 记录“正在处理中...”的位置，以便后续替换
         self.processing_block_position = self._display_message("正在处理中...", "processing")
+        self.processing_block_end = self.chat_display.textCursor().position()
 
-        # 所发送的信号即为
-        self.send_data_signal.emit(self.data_structure)
-        self._start_timeout_timer(100000, timestamp)
-
-    def _start_timeout_timer(self, timeout_duration: int, timestamp: str):
-        """启动超时计时器。
+    def _remove_queued(self, message_id: str):
+        """从排队列表中移除一条消息，列表为空时隐藏。
 
         Args:
-            timeout_duration: 超时时间（毫秒）。
-            timestamp: 当前消息的唯一标识符。
+            message_id: 消息的唯一标识符。
         """
-        self.timeout_timer = QTimer()
-        self.timeout_timer.setSingleShot(True)
-        self.timeout_timer.timeout.connect(lambda: self.timeout_signal.emit(timestamp))
-        self.timeout_timer.start(timeout_duration)
+        for row in range(self.queue_list.count()):
+            if self.queue_list.item(row).data(Qt.ItemDataRole.UserRole) == message_id:
+                self.queue_list.takeItem(row)
+                break
+        if not self.queue_list.count():
+            self.queue_list.hide()
+
+    def _set_processing(self, processing: bool):
+        """切换是否正在处理，并通知界面更新停止按钮。处理期间仍可发送，消息进入队列。
 
-    def _stop_timeout_timer(self):
-        """停止超时计时器。"""
-        if hasattr(self, 'timeout_timer') and self.timeout_timer.isActive():
-            self.timeout_timer.stop()
+        Args:
+            processing: 是否正在处理。
+        """
+        self.processing = processing
+        self.processing_changed.emit(processing)
 
     @pyqtSlot(str)
     def _on_process_finish(self, response: str):
@@ -176,32 +258,137 @@ class ChatGui(QMainWindow):
         Args:
             response: 处理模块返回的消息内容。
         """
+        self._reset_partial()
         self._replace_processing_message(response)
-        self.allow_send = True
-        self.send_button.setEnabled(True)
-        self._stop_timeout_timer()
+        self._set_processing(False)
+
+    @pyqtSlot(str, str, list, str)
+    def _on_process_partial(self, stable: str, kind: str, lines: list, tail: str):
+        """缓存流式到达的部分回答，等待下一次刷新时显示。
+
+        Args:
+            stable: 新增的稳定html，显示后不再改动；不为空时此前的块已经结束。
+            kind: 未结束的块的类型（code, ul, ol），不在块中时为空字符串。
+            lines: 块中新完成的行。
+            tail: 未完成的最后一行的临时html，替换上一次的临时内容。
+        """
+        if stable:
+            self._pending_stable.append(stable)
+            self._pending_lines.clear()
+        self._pending_kind = kind
+        self._pending_lines.extend(lines)
+        self._pending_tail = tail
+        if not self.render_timer.isActive():
+            self.render_timer.start(self.render_interval)
+
+    def _flush_partial(self):
+        """刷新流式回答的显示。
+
+        新的稳定内容替换已显示的块中的行，追加在稳定内容末尾；未结束的块中新完成的行追加在块末尾；
+        最后替换未完成的最后一行。每次刷新的工作量只与新到达的内容有关，不重建整个回答或未结束的块。
+        刷新耗时超过刷新间隔的一半时增大间隔，让更多片段合并到一次刷新中，避免阻塞事件循环。
+        """
+        start = time.perf_counter()
+        if self.answer_stable_end is None:
+            self._replace_processing_message("")
+            self.answer_stable_end = self.answer_block_end = self.processing_block_end
+
+        old_end = self.processing_block_end
+        cursor = self.chat_display.textCursor()
+        cursor.setPosition(self.answer_block_end)
+        cursor.setPosition(self.processing_block_end, QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+        if self._pending_stable:
+            # 已显示的块已经结束，整个块的html包含在稳定内容中
+            cursor.setPosition(self.answer_stable_end, QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+            self._block_list = None
+            for stable in self._pending_stable:
+                cursor.insertHtml(stable)
+                if _BLOCK_END_RE.search(stable):
+                    cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+            self._pending_stable.clear()
+            self.answer_stable_end = cursor.position()
+        for line in self._pending_lines:
+            self._insert_block_line(cursor, line)
+        self._pending_lines.clear()
+        self.answer_block_end = cursor.position()
+        if self._pending_tail:
+            if self.answer_block_end > self.answer_stable_end:
+                cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+            cursor.insertHtml(self._pending_tail)
+        self.processing_block_end = cursor.position()
+        self._shift_after_processing(self.processing_block_end - old_end)
+        self.chat_display.setTextCursor(cursor)
+        self.chat_display.ensureCursorVisible()
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.render_interval = min(max(config.render_interval_ms, int(elapsed * 2)),
+                                   config.render_max_interval_ms)
+
+    def _insert_block_line(self, cursor: QTextCursor, line: str):
+        """在未结束的代码块或列表末尾另起一个块追加一行。
+
+        Args:
+            cursor: 块末尾的光标，插入后位于新的一行末尾。
+            line: 代码行的原文或列表项的html。
+        """
+        if self._pending_kind == "code":
+            char_format = QTextCharFormat()
+            char_format.setFont(QFont("Courier New", 12))
+            char_format.setFontFixedPitch(True)
+            cursor.insertBlock(QTextBlockFormat(), char_format)
+            cursor.insertText(line)
+            return
+        cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        if self._block_list is None:
+            self._block_list = cursor.createList(_LIST_STYLES[self._pending_kind])
+        else:
+            self._block_list.add(cursor.block())
+        cursor.insertHtml(line)
+
+    def _reset_partial(self):
+        """停止刷新并丢弃尚未显示的部分回答。"""
+        self.render_timer.stop()
+        self._pending_stable.clear()
+        self._pending_kind = ""
+        self._pending_lines.clear()
+        self._pending_tail = ""
+        self._block_list = None
+        self.answer_stable_end = None
+        self.answer_block_end = None
+        self.render_interval = config.render_interval_ms
 
     @pyqtSlot(str)
     def _on_process_fail(self, error: str):
         """处理处理模块失败的情况。
 
         Args:
-            code: 错误信息,有可能是API调用返回错误状态也可能是当前消息的唯一标识符。
+            error: 错误信息，包括API调用返回的错误和请求超时。
         """
-        if error == self.processing_message_id:
-            self._replace_processing_message("处理超时，请重试。", is_error=True)
-            self.allow_send = True
-            self.send_button.setEnabled(True)
-            self._stop_timeout_timer()
+        self._reset_partial()
+        self._replace_processing_message(error, is_error=True)
+        self._set_processing(False)
+
+    @pyqtSlot(str)
+    def _on_process_cancel(self, message_id: str):
+        """处理用户停止请求或移出排队中的消息的情况。
+
+        Args:
+            message_id: 被停止的消息的唯一标识符。
+        """
+        if message_id == self.processing_message_id:
+            self._reset_partial()
+            self._replace_processing_message("已停止。", is_error=True)
+            self._set_processing(False)
         else:
-            self._replace_processing_message(error, is_error=True)
-            self.allow_send = True
-            self.send_button.setEnabled(True)
-            self._stop_timeout_timer()
-            
+            self._remove_queued(message_id)
+
     def _display_message(self, message: str, tag: str) -> int:
         """显示消息到聊天显示区。
 
+        显示前先把超出显示上限的旧消息移出文档并归档。
+
         Args:
             message: 要显示的消息内容。
             tag: 消息的类型（user, processing, ai, system）。
@@ -209,31 +396,118 @@ class ChatGui(QMainWindow):
         Returns:
             int: 消息块的位置。
         """
+        self._trim_display(config.display_max_messages - 1)
         cursor = self.chat_display.textCursor()
         cursor.movePosition(QTextCursor.MoveOperation.End)
 
-        block_format = QTextBlockFormat()
-        char_format = QTextCharFormat()
-        char_format.setFont(QFont("Arial", 12))
-
         formatted_message=""
         if tag == "user":
-            block_format.setAlignment(Qt.AlignmentFlag.AlignRight)
             formatted_message = f"<b>你</b><br>{message}"
         elif tag in ["processing", "ai"]:
-            block_format.setAlignment(Qt.AlignmentFlag.AlignLeft)
             formatted_message = f"<b>{self.current_model}</b><br>{message}"
         elif tag == "system":
-            block_format.setAlignment(Qt.AlignmentFlag.AlignCenter)
             formatted_message = f"<i>{message}</i>"
 
-        cursor.insertBlock(block_format, char_format)
-        cursor.insertHtml(formatted_message)
+        entry = _DisplayEntry(cursor.position(), tag, formatted_message)
+        self._entries.append(entry)
+        if tag == "processing":
+            self._processing_entry = entry
+        self._insert_entry(cursor, tag, formatted_message)
         self.chat_display.setTextCursor(cursor)
         self.chat_display.ensureCursorVisible()
 
         return cursor.block().position()
 
+    def _insert_entry(self, cursor: QTextCursor, tag: str, html: str):
+        """在光标处另起一个块插入一条消息。
+
+        Args:
+            cursor: 插入位置的光标，插入后位于消息末尾。
+            tag: 消息的类型（user, processing, ai, system）。
+            html: 消息显示的html。
+        """
+        block_format = QTextBlockFormat()
+        block_format.setAlignment(_ALIGNMENTS[tag])
+        char_format = QTextCharFormat()
+        char_format.setFont(QFont("Arial", 12))
+        cursor.insertBlock(block_format, char_format)
+        cursor.insertHtml(html)
+
+    def _shift_positions(self, delta: int):
+        """在文档开头插入或删除内容后，平移记录的位置。
+
+        Args:
+            delta: 位置的变化量。
+        """
+        for entry in self._entries:
+            entry.start += delta
+        self.processing_block_position += delta
+        self.processing_block_end += delta
+        if self.answer_stable_end is not None:
+            self.answer_stable_end += delta
+            self.answer_block_end += delta
+
+    def _shift_after_processing(self, delta: int):
+        """正在处理的消息长度变化后，平移其后的消息（例如回答期间显示的切换模型提示）的位置。
+
+        Args:
+            delta: 正在处理的消息长度的变化量。
+        """
+        if not delta:
+            return
+        for entry in reversed(self._entries):
+            if entry is self._processing_entry:
+                break
+            entry.start += delta
+
+    def _trim_display(self, limit: int):
+        """把超出数量上限的最早的消息移出文档，尚未归档的消息写入归档。
+
+        Args:
+            limit: 文档中保留的消息数上限。
+        """
+        document = self.chat_display.document()
+        while len(self._entries) > max(limit, 1):
+            entry = self._entries.popleft()
+            end = self._entries[0].start
+            cursor = QTextCursor(document)
+            cursor.setPosition(entry.start)
+            cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+            if not entry.archived:
+                self.display_archive.append({"role": entry.tag, "content": entry.html})
+            self._archive_start += 1
+            self._shift_positions(entry.start - end)
+
+    def _load_older(self):
+        """从归档中载入一页更早的消息，插入到文档开头，并保持当前看到的内容不动。"""
+        if self._archive_start <= self._archive_floor:
+            return
+        start = max(self._archive_start - config.display_page_size, self._archive_floor)
+        messages = self.display_archive.read(start, self._archive_start)
+        scroll_bar = self.chat_display.verticalScrollBar()
+        old_maximum, old_value = scroll_bar.maximum(), scroll_bar.value()
+
+        cursor = QTextCursor(self.chat_display.document())
+        loaded = []
+        for msg in messages:
+            loaded.append(_DisplayEntry(cursor.position(), msg["role"], msg["content"], True))
+            self._insert_entry(cursor, msg["role"], msg["content"])
+        self._shift_positions(cursor.position())
+        self._entries.extendleft(reversed(loaded))
+        self._archive_start = start
+        scroll_bar.setValue(old_value + scroll_bar.maximum() - old_maximum)
+
+    @pyqtSlot(int)
+    def _on_scroll(self, value: int):
+        """滚动到顶部时载入更早的消息。
+
+        Args:
+            value: 滚动条的位置。
+        """
+        if value == self.chat_display.verticalScrollBar().minimum():
+            self._load_older()
+
     def _replace_processing_message(self, new_message: str, is_error: bool = False):
         """替换“正在处理中...”的消息内容。
 
@@ -241,8 +515,11 @@ class ChatGui(QMainWindow):
             new_message: 要替换的内容。
             is_error: 是否为错误消息。
         """
+        old_end = self.processing_block_end
         cursor = self.chat_display.textCursor()
-        cursor.setPosition(self.processing_block_position)
+        # 选中从消息块前的分隔符到消息结束的全部内容，回答转换为html后可能包含多个块
+        cursor.setPosition(max(self.processing_block_position - 1, 0))
+        cursor.setPosition(self.processing_block_end, QTextCursor.MoveMode.KeepAnchor)
 
         block_format = QTextBlockFormat()
         block_format.setAlignment(Qt.AlignmentFlag.AlignLeft)
@@ -255,16 +532,319 @@ class ChatGui(QMainWindow):
         else:
             formatted_message = f"<b>{self.current_model}</b>{new_message}"
 
-        cursor.select(QTextCursor.SelectionType.BlockUnderCursor)
+        formatted_message = f"<div style='text-align: left;'>{formatted_message}</div>"
         cursor.insertBlock(block_format, char_format)
-        temp = f"<div style='text-align: left;'>{formatted_message}</div>"
-        cursor.insertHtml(f"<div style='text-align: left;'>{formatted_message}</div>")
+        cursor.insertHtml(formatted_message)
+        if self._processing_entry is not None:
+            self._processing_entry.tag = "ai"
+            self._processing_entry.html = formatted_message
+        self.processing_block_end = cursor.position()
+        self._shift_after_processing(self.processing_block_end - old_end)
         self.chat_display.setTextCursor(cursor)
         self.chat_display.ensureCursorVisible()
 
-    def _clear_chat(self):
-        """清空聊天记录。"""
+    def clear(self):
+        """清空聊天记录，清空前的归档不再载入。"""
         self.chat_display.clear()
+        self._entries.clear()
+        self._processing_entry = None
+        self._archive_start = self._archive_floor = len(self.display_archive)
+
+    def shutdown(self) -> asyncio.Future:
+        """关闭对话：把仍在显示的消息写入归档，下次打开时可以重新载入；
+        取消排队和正在处理的消息，撤销未得到回答的问题后关闭消息记录的存储。
+
+        多次调用返回同一个Future。
+
+        Returns:
+            asyncio.Future: 处理模块关闭完成时结束。
+        """
+        if self._closing is not None:
+            return self._closing
+        self._reset_partial()
+        for entry in self._entries:
+            if not entry.archived and entry.tag != "processing":
+                self.display_archive.append({"role": entry.tag, "content": entry.html})
+        self._entries.clear()
+        self.display_archive.close()
+        self._closing = asyncio.ensure_future(self.processing_module.close())
+        return self._closing
+
+
+class ChatGui(QMainWindow):
+    """聊天界面类，用于与用户交互并处理聊天信息。
+
+    每个对话是一个标签页（ChatTab），输入区、模型选择和停止按钮作用于当前的标签页。
+    顶部的搜索框在所有对话（包括已关闭的对话）的消息中搜索，双击结果切换到对应的对话。
+
+    Attributes:
+        tabs: 对话标签页。第一个标签页为默认对话，其余对话以创建时间为id。
+        current_model: 当前标签页选中的模型。
+        search_entry: 搜索框。
+        search_results: 搜索结果列表，按相关度排序，没有结果时隐藏。
+        search_timer: 搜索框停止输入一段时间后才开始搜索的计时器。
+    """
+
+    def __init__(self):
+        """初始化聊天界面。"""
+        super().__init__()
+        self.setWindowTitle("AI Chat Client")
+        self.setGeometry(800, 450, 800, 600)
+
+        self.current_model = "1.Spark Lite"
+        self._typing = False
+        self._tab_count = 0
+        self._closing_tabs: set[asyncio.Future] = set() # 已移除但尚未关闭完成的标签页
+
+        self._setup_ui()
+        self._setup_menu()
+        self._new_tab("default")
+
+    @property
+    def current_tab(self) -> ChatTab:
+        """ChatTab: 当前的对话标签页"""
+        return self.tabs.currentWidget()
+
+    def _setup_ui(self):
+        """设置界面元素，包括对话标签页和输入区。"""
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        layout = QVBoxLayout(central_widget)
+
+        self.search_entry = QLineEdit(self)
+        self.search_entry.setPlaceholderText("搜索所有对话")
+        self.search_entry.setClearButtonEnabled(True)
+        if not (config.search_index_path and config.history_path):
+            self.search_entry.setPlaceholderText("搜索需要配置history_path和search_index_path")
+            self.search_entry.setEnabled(False)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self._run_search)
+        self.search_entry.textChanged.connect(lambda: self.search_timer.start(150))
+        layout.addWidget(self.search_entry)
+
+        self.search_results = QListWidget(self)
+        self.search_results.setMaximumHeight(150)
+        self.search_results.setToolTip("双击打开所在的对话")
+        self.search_results.itemDoubleClicked.connect(self._open_search_result)
+        self.search_results.hide()
+        layout.addWidget(self.search_results)
+
+        self.tabs = QTabWidget(self)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.tabCloseRequested.connect(self._close_tab)
+        self.tabs.currentChanged.connect(self._on_tab_changed)
+        new_tab_button = QToolButton(self)
+        new_tab_button.setText("+")
+        new_tab_button.setToolTip("新建对话")
+        new_tab_button.clicked.connect(lambda: self._new_tab())
+        self.tabs.setCornerWidget(new_tab_button)
+        layout.addWidget(self.tabs)
+
+        input_layout = QHBoxLayout()
+        self.msg_entry = QTextEdit(self)
+        self.msg_entry.setFixedHeight(50)
+        self.msg_entry.setFont(QFont("Arial", 12))
+        # 开始输入时预热连接，发送时只需写入请求
+        self.msg_entry.textChanged.connect(self._on_text_changed)
+        input_layout.addWidget(self.msg_entry)
+
+        self.send_button = QPushButton("发送")
+        self.send_button.setFixedSize(70, 50)
+        self.send_button.clicked.connect(self._send_message)
+        input_layout.addWidget(self.send_button)
+
+        self.stop_button = QPushButton("停止")
+        self.stop_button.setFixedSize(70, 50)
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(lambda: self.current_tab.stop())
+        input_layout.addWidget(self.stop_button)
+
+        layout.addLayout(input_layout)
+
+    def _setup_menu(self):
+        """设置菜单栏，包括文件、编辑和设置菜单。"""
+        menubar = self.menuBar()
+        if not menubar:
+            raise ValueError("No menu bar found.")
+
+        file_menu = menubar.addMenu('文件')
+        if not file_menu:
+            raise ValueError("Failed to create file menu.")
+
+        new_tab_action = QAction('新建对话', self)
+        new_tab_action.setShortcut("Ctrl+T")
+        new_tab_action.triggered.connect(lambda: self._new_tab())
+        file_menu.addAction(new_tab_action)
+
+        exit_action = QAction('退出', self)
+        exit_action.triggered.connect(self.close)
+        file_menu.addAction(exit_action)
+
+        edit_menu = menubar.addMenu('编辑')
+        if not edit_menu:
+            raise ValueError("Failed to create edit menu.")
+        clear_action = QAction('清空', self)
+        clear_action.triggered.connect(lambda: self.current_tab.clear())
+        edit_menu.addAction(clear_action)
+
+        settings_menu = menubar.addMenu('设置')
+        if not settings_menu:
+            raise ValueError("Failed to create settings menu.")
+        self.model_combo = QComboBox(self)
+        self.model_combo.addItems(["1.Spark Lite", "2.Spark Pro", "3.Spark Pro-128K", "4.Spark Max", "5.Spark Max-32K", "6.Spark4.0 Ultra"])
+        self.model_combo.setCurrentIndex(0)
+        self.model_combo.currentIndexChanged.connect(self._on_model_changed)
+
+        model_widget = QWidget(self)
+        model_layout = QVBoxLayout(model_widget)
+        model_layout.setContentsMargins(0, 0, 0, 0)
+        model_layout.addWidget(self.model_combo)
+
+        model_action = QWidgetAction(self)
+        model_action.setDefaultWidget(model_widget)
+        settings_menu.addAction(model_action)
+
+    def _new_tab(self, conversation: str | None = None) -> ChatTab:
+        """新建一个对话标签页并切换到该标签页。
+
+        Args:
+            conversation: 对话id，为None时以当前时间生成。
+
+        Returns:
+            ChatTab: 新建的标签页。
+        """
+        conversation = conversation or datetime.now().strftime("%Y%m%d%H%M%S%f")
+        tab = ChatTab(conversation, self.current_model, self.tabs)
+        tab.processing_changed.connect(lambda processing, tab=tab: self._on_processing_changed(tab, processing))
+        self._tab_count += 1
+        self.tabs.setCurrentIndex(self.tabs.addTab(tab, f"对话{self._tab_count}"))
+        return tab
+
+    @pyqtSlot(int)
+    def _close_tab(self, index: int):
+        """关闭一个对话标签页，关闭最后一个标签页时新建一个空对话。
+
+        Args:
+            index: 标签页的下标。
+        """
+        tab = self.tabs.widget(index)
+        self.tabs.removeTab(index)
+        # 等到处理模块撤销未得到回答的问题之后再销毁标签页，期间发射的信号仍有接收者
+        closing = tab.shutdown()
+        self._closing_tabs.add(closing)
+        closing.add_done_callback(self._closing_tabs.discard)
+        closing.add_done_callback(lambda _: tab.deleteLater())
+        if not self.tabs.count():
+            self._new_tab()
+
+    @pyqtSlot(int)
+    def _on_tab_changed(self, index: int):
+        """切换标签页时，模型选择和停止按钮跟随当前对话。
+
+        Args:
+            index: 当前标签页的下标。
+        """
+        tab = self.tabs.widget(index)
+        if tab is None:
+            return
+        self.current_model = tab.current_model
+        self.model_combo.blockSignals(True)
+        self.model_combo.setCurrentText(tab.current_model)
+        self.model_combo.blockSignals(False)
+        self.stop_button.setEnabled(tab.processing)
+
+    def _on_processing_changed(self, tab: ChatTab, processing: bool):
+        """对话开始或结束处理时，更新停止按钮。只有当前标签页的状态影响按钮。
+
+        Args:
+            tab: 状态变化的标签页。
+            processing: 是否正在处理。
+        """
+        if tab is self.current_tab:
+            self.stop_button.setEnabled(processing)
+
+    def _find_tab(self, conversation: str) -> int:
+        """查找对话所在的标签页。
+
+        Args:
+            conversation: 对话id。
+
+        Returns:
+            int: 标签页的下标，对话没有打开时为-1。
+        """
+        for index in range(self.tabs.count()):
+            if self.tabs.widget(index).conversation == conversation:
+                return index
+        return -1
+
+    def _run_search(self):
+        """在搜索索引中查询搜索框的内容，显示按相关度排序的结果。"""
+        query = self.search_entry.text().strip()
+        self.search_results.clear()
+        search_index = search.shared_index()
+        results = search_index.search(query) if query and search_index is not None else []
+        for result in results:
+            index = self._find_tab(result.conversation)
+            title = self.tabs.tabText(index) if index >= 0 else result.conversation
+            sender = "你" if result.role == "user" else "AI"
+            item = QListWidgetItem(f"{title} · {sender}：{search.snippet(result.content, query)}")
+            item.setData(Qt.ItemDataRole.UserRole, result.conversation)
+            item.setToolTip(result.content[:500])
+            self.search_results.addItem(item)
+        self.search_results.setVisible(bool(results))
+
+    def _open_search_result(self, item: QListWidgetItem):
+        """切换到搜索结果所在的对话，对话已关闭时重新打开。
+
+        Args:
+            item: 被双击的搜索结果。
+        """
+        conversation = item.data(Qt.ItemDataRole.UserRole)
+        index = self._find_tab(conversation)
+        if index >= 0:
+            self.tabs.setCurrentIndex(index)
+        else:
+            self._new_tab(conversation)
+
+    def _on_model_changed(self):
+        """更新当前对话选中的模型，并显示提示消息。"""
+        self.current_model = self.model_combo.currentText()
+        self.current_tab.set_model(self.current_model)
+
+    def _on_text_changed(self):
+        """输入框从空变为非空（开始输入一条消息）时，预热当前对话模型的连接。"""
+        typing = not self.msg_entry.document().isEmpty()
+        if typing and not self._typing:
+            self.current_tab.prewarm()
+        self._typing = typing
+
+    def _send_message(self):
+        """处理发送消息的逻辑，把消息发送给当前对话。"""
+        user_input = self.msg_entry.toPlainText().strip()
+        if not user_input:
+            return
+
+        self.msg_entry.clear()
+        self.current_tab.send(user_input)
+
+    def closeEvent(self, event):
+        """关闭窗口时关闭所有对话，仍在显示的消息写入归档，下次启动时可以重新载入。
+
+        仍有对话在撤销未得到回答的问题时先忽略本次关闭，全部关闭完成后再关闭窗口。
+
+        Args:
+            event: 关闭事件。
+        """
+        closing = [self.tabs.widget(index).shutdown() for index in range(self.tabs.count())]
+        closing += self._closing_tabs
+        if not all(future.done() for future in closing):
+            event.ignore()
+            asyncio.gather(*closing, return_exceptions=True).add_done_callback(
+                lambda _: self.close())
+            return
+        super().closeEvent(event)
 
 
 #----------------以下是模拟处理模块
@@ -299,6 +879,7 @@ class ChatGui(QMainWindow):
 
 async def main():
     """程序入口，启动聊天界面应用。"""
+    metrics.enable_from_config()
     app = QApplication(sys.argv)
     gui = ChatGui()
     gui.show()
@@ -0,0 +1,215 @@
+"""批量请求模块
+
+该模块提供不依赖图形界面的批量请求工具：从JSONL文件中读取问题（可带历史消息），
+以有限的并发数发送给一个或多个聊天模型，每完成一个就写入输出的JSONL文件。
+输出文件中已成功的条目在再次运行时会被跳过，因此中断后可以直接续跑。
+
+输入的每一行：
+    {"id": "q1", "prompt": "你好", "history": [{"role": "user", "content": "..."}, ...]}
+    id可省略（使用行号），history可省略。
+
+输出的每一行：
+    {"id": "q1", "model": "Spark Lite", "answer": "...", "error": null, "elapsed_ms": 812.3}
+
+使用方法：
+    python -m spark_api.batch prompts.jsonl results.jsonl --model 1 --model 4 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Iterator
+
+from spark_api import spark_api
+from spark_api.data import chat_models
+from spark_api.data_structure import ChatModel, ChatHistory
+from spark_api.engine import ChatEngine
+from spark_api.errors import SparkApiError
+from spark_api.scheduler import RequestScheduler
+
+
+def find_model(name: str) -> ChatModel:
+    """按序号（从1开始）、名称或domain查找聊天模型
+
+    Args:
+        name: str 序号、名称或domain
+
+    Returns:
+        ChatModel: 聊天模型
+
+    Raises:
+        ValueError: 找不到对应的模型
+    """
+    if name.isdigit() and 1 <= int(name) <= len(chat_models):
+        return chat_models[int(name) - 1]
+    for model in chat_models:
+        if name in (model.name, model.domain):
+            return model
+    raise ValueError(f"unknown model: {name}")
+
+
+def read_prompts(path: str) -> Iterator[dict]:
+    """逐行读取问题
+
+    Args:
+        path: str 输入文件路径
+
+    Yields:
+        dict: 问题，包含"id"、"prompt"和"history"
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(line_no))
+            item.setdefault("history", [])
+            yield item
+
+
+def read_done(path: str) -> set[tuple[str, str]]:
+    """读取输出文件中已成功的条目
+
+    Args:
+        path: str 输出文件路径
+
+    Returns:
+        set[tuple[str, str]]: 已成功的(id, 模型名称)
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError: # 中断时写了一半的行
+                continue
+            if result.get("error") is None:
+                done.add((str(result["id"]), result["model"]))
+    return done
+
+
+def _drop_partial_line(path: str) -> None:
+    """截掉输出文件末尾中断时写了一半的行，使续跑追加的条目从新的一行开始
+
+    Args:
+        path: str 输出文件路径
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0: # 从末尾向前按块查找最后一个换行符
+            start = max(pos - 65536, 0)
+            f.seek(start)
+            block = f.read(pos - start)
+            index = block.rfind(b"\n")
+            if index >= 0:
+                pos = start + index + 1
+                break
+            pos = start
+        if pos < end:
+            f.truncate(pos)
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    models: list[ChatModel],
+    concurrency: int,
+) -> tuple[int, int]:
+    """运行批量请求
+
+    Args:
+        input_path: str 输入文件路径
+        output_path: str 输出文件路径
+        models: list[ChatModel] 每个问题都发送给这些模型
+        concurrency: int 并发数
+
+    Returns:
+        tuple[int, int]: (成功数, 失败数)
+    """
+    done = read_done(output_path)
+    _drop_partial_line(output_path)
+    engine = ChatEngine(max_concurrency=concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = [0, 0]
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        async def worker() -> None:
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                item, model = job
+                session = engine.new_session(model, ChatHistory(item["history"]))
+                start = time.perf_counter()
+                answer, error = None, None
+                try:
+                    answer = await engine.request(session, item["prompt"])
+                except SparkApiError as e:
+                    error = e.code
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                out.write(json.dumps({
+                    "id": item["id"],
+                    "model": model.name,
+                    "answer": answer,
+                    "error": error,
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+                }, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[error is not None] += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            # 逐行读取并放入有界队列，输入文件再大也不会一次性载入内存
+            for item in read_prompts(input_path):
+                for model in models:
+                    if (str(item["id"]), model.name) not in done:
+                        await queue.put((item, model))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+    return counts[0], counts[1]
+
+
+def main(argv: list[str] | None = None) -> None:
+    """命令行入口
+
+    Args:
+        argv: list[str] | None 命令行参数，为None时使用sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m spark_api.batch",
+        description="批量发送JSONL文件中的问题，结果写入JSONL文件，支持中断后续跑。")
+    parser.add_argument("input", help="输入的JSONL文件")
+    parser.add_argument("output", help="输出的JSONL文件，已存在时跳过其中已成功的条目")
+    parser.add_argument("-m", "--model", action="append",
+                        help="模型序号、名称或domain，可重复指定；默认使用第一个模型")
+    parser.add_argument("-c", "--concurrency", type=int,
+                        default=spark_api.credential_pool.max_concurrency,
+                        help="并发数，默认为各组API信息授权的并发数之和")
+    parser.add_argument("--qps", type=float, default=spark_api.credential_pool.qps,
+                        help="授权的每秒请求数，默认为各组API信息授权的QPS之和")
+    args = parser.parse_args(argv)
+
+    spark_api.scheduler = RequestScheduler(qps=args.qps,
+                                           max_concurrency=args.concurrency,
+                                           credentials=spark_api.credential_pool)
+    models = [find_model(name) for name in args.model or ["1"]]
+    start = time.perf_counter()
+    ok, failed = asyncio.run(run_batch(args.input, args.output, models,
+                                       args.concurrency))
+    print(f"{ok} succeeded, {failed} failed in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
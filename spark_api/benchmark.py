@@ -0,0 +1,221 @@
+"""性能测试模块
+
+该模块包含spark_api的基准测试，请求相关的测试全部针对本地的MockSparkServer，
+不需要API信息和网络，结果可以复现：
+    bench_history: ChatHistory追加与修剪的开销
+    bench_signing: URL签名的开销（每次签名与签名缓存）
+    bench_encode: 请求序列化的开销（整体编码与拼接缓存的JSON片段）
+    bench_stream: 单个请求的首token延迟和token速率
+    bench_throughput: 不同并发数下经由request_chat的端到端吞吐量
+
+使用方法：
+    python -m spark_api.benchmark
+"""
+
+import asyncio
+import statistics
+import time
+
+from spark_api import fastjson
+from spark_api import spark_api
+from spark_api.data_structure import ChatHistory, ChatParams
+from spark_api.mock_server import MockSparkServer
+from spark_api.scheduler import RequestScheduler
+
+
+def bench_history(
+    sizes: tuple[int, ...] = (1000, 10000, 100000),
+    max_tokens: int = 8192,
+) -> list[tuple[int, float, float]]:
+    """测试ChatHistory追加与修剪的开销
+
+    对每个规模，先向消息记录中追加size条消息，再按max_tokens修剪，
+    分别统计平均每次追加和平均每移除一条消息的耗时。
+
+    Args:
+        sizes: tuple[int, ...] 消息记录的规模
+        max_tokens: int 修剪时使用的最大token长度
+
+    Returns:
+        list[tuple[int, float, float]]: (规模, 每次追加耗时ns, 每条修剪耗时ns)
+    """
+    results = []
+    for size in sizes:
+        history = ChatHistory([])
+        start = time.perf_counter_ns()
+        for i in range(size):
+            history.append_message("user" if i % 2 == 0 else "assistant",
+                                   f"消息{i}")
+        append_ns = (time.perf_counter_ns() - start) / size
+
+        before = len(history)
+        start = time.perf_counter_ns()
+        history.trim_message(max_tokens)
+        evicted = max(before - len(history), 1)
+        trim_ns = (time.perf_counter_ns() - start) / evicted
+        results.append((size, append_ns, trim_ns))
+    return results
+
+
+def bench_signing(count: int = 10000) -> tuple[float, float]:
+    """测试URL签名的开销
+
+    Args:
+        count: int 签名次数
+
+    Returns:
+        tuple[float, float]: (每次签名耗时us, 经由签名缓存耗时us)
+    """
+    url = "wss://spark-api.xf-yun.com/v1.1/chat"
+    start = time.perf_counter()
+    for _ in range(count):
+        spark_api.generate_url(url)
+    sign_us = (time.perf_counter() - start) / count * 1e6
+
+    cache = spark_api.SignedUrlCache()
+    start = time.perf_counter()
+    for _ in range(count):
+        cache.get(url)
+    cached_us = (time.perf_counter() - start) / count * 1e6
+    return sign_us, cached_us
+
+
+def bench_encode(
+    sizes: tuple[int, ...] = (10, 100, 1000),
+    count: int = 200,
+) -> list[tuple[int, float, float]]:
+    """测试请求序列化的开销
+
+    对每个规模的消息记录，分别统计整体编码gen_params的结果和使用encode_params拼接
+    缓存的JSON片段的耗时，后者包含追加一条新消息的开销。
+
+    Args:
+        sizes: tuple[int, ...] 消息记录的规模
+        count: int 每个规模的测试次数
+
+    Returns:
+        list[tuple[int, float, float]]: (规模, 整体编码耗时us, 拼接耗时us)
+    """
+    model = spark_api.chat_models[2]
+    params = ChatParams()
+    results = []
+    for size in sizes:
+        history = ChatHistory([])
+        for i in range(size):
+            history.append_message("user" if i % 2 == 0 else "assistant",
+                                   f"消息{i}" * 50)
+        start = time.perf_counter()
+        for _ in range(count):
+            fastjson.dumps(spark_api.gen_params(model, history, params))
+        full_us = (time.perf_counter() - start) / count * 1e6
+
+        start = time.perf_counter()
+        for _ in range(count):
+            history.append_message("user", "新的问题" * 50)
+            spark_api.encode_params(model, history, params)
+            history.pop_message()
+        incremental_us = (time.perf_counter() - start) / count * 1e6
+        results.append((size, full_us, incremental_us))
+    return results
+
+
+async def bench_stream(
+    answer_len: int = 2000,
+    first_token_latency: float = 0.05,
+    token_rate: float = 0.0,
+) -> tuple[float, float]:
+    """测试单个请求的首token延迟和token速率
+
+    Args:
+        answer_len: int 回答的字符数
+        first_token_latency: float 模拟服务的首帧延迟（秒）
+        token_rate: float 模拟服务的每秒token数，0表示不限速
+
+    Returns:
+        tuple[float, float]: (首token延迟ms, 每秒token数)
+    """
+    async with MockSparkServer(answer="字" * answer_len,
+                               first_token_latency=first_token_latency,
+                               token_rate=token_rate) as server:
+        start = time.perf_counter()
+        first = None
+        received = 0
+        async for delta in spark_api.stream_chat(server.model(), ChatHistory([]),
+                                                 ChatParams(), "你好"):
+            if first is None:
+                first = time.perf_counter()
+            received += len(delta)
+        end = time.perf_counter()
+    return (first - start) * 1000, received / max(end - first, 1e-9)
+
+
+async def bench_throughput(
+    levels: tuple[int, ...] = (1, 4, 16, 64),
+    requests: int = 256,
+    token_rate: float = 2000.0,
+) -> list[tuple[int, float, float, float]]:
+    """测试不同并发数下的端到端吞吐量
+
+    Args:
+        levels: tuple[int, ...] 并发数
+        requests: int 每个并发数下的请求总数
+        token_rate: float 模拟服务的每秒token数
+
+    Returns:
+        list[tuple[int, float, float, float]]: (并发数, 每秒请求数, p50延迟ms, p95延迟ms)
+    """
+    results = []
+    async with MockSparkServer(answer="字" * 100, token_rate=token_rate) as server:
+        model = server.model()
+        for level in levels:
+            semaphore = asyncio.Semaphore(level)
+            latencies = []
+
+            async def one(i: int) -> None:
+                async with semaphore:
+                    start = time.perf_counter()
+                    await spark_api.request_chat(model, ChatHistory([]),
+                                                 ChatParams(), f"问题{i}",
+                                                 uid=f"bench{i}")
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests)))
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            results.append((level, requests / elapsed,
+                            statistics.median(latencies), p95))
+    return results
+
+
+def main() -> None:
+    """运行所有基准测试并打印结果"""
+    print("ChatHistory append/trim")
+    print(f"{'size':>10} {'append ns/op':>14} {'trim ns/msg':>14}")
+    for size, append_ns, trim_ns in bench_history():
+        print(f"{size:>10} {append_ns:>14.1f} {trim_ns:>14.1f}")
+
+    sign_us, cached_us = bench_signing()
+    print("\nURL signing")
+    print(f"generate_url {sign_us:.2f} us/op, SignedUrlCache {cached_us:.2f} us/op")
+
+    print("\nRequest encoding")
+    print(f"{'messages':>10} {'full us/op':>14} {'cached us/op':>14}")
+    for size, full_us, incremental_us in bench_encode():
+        print(f"{size:>10} {full_us:>14.1f} {incremental_us:>14.1f}")
+
+    # 基准测试不受默认调度器的授权QPS限制
+    spark_api.scheduler = RequestScheduler(qps=1e6, max_concurrency=1024)
+    ttft_ms, tokens_per_s = asyncio.run(bench_stream())
+    print("\nStreaming (mock, 50 ms first-token latency)")
+    print(f"time to first token {ttft_ms:.1f} ms, {tokens_per_s:.0f} tokens/s")
+
+    print("\nThroughput via request_chat (mock)")
+    print(f"{'concurrency':>12} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for level, rps, p50, p95 in asyncio.run(bench_throughput()):
+        print(f"{level:>12} {rps:>10.1f} {p50:>10.1f} {p95:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""回答缓存模块
+
+该模块提供可选的回答缓存。以(模型domain, temperature, top_k, 消息记录)的哈希为键，
+缓存机器人回答的流式片段，命中时可以按原样重放，调用方看到的仍是流式接口。
+
+缓存分两级：内存中的LRU缓存和可选的SQLite磁盘缓存，两级都支持过期时间，
+内存缓存按条数淘汰，磁盘缓存按总字节数淘汰最久未访问的条目。
+
+Classes:
+    ResponseCache: 回答缓存类
+
+使用示例：
+    cache = ResponseCache(disk_path="cache.db")
+    answer = await request_chat(model, history, params, "你好", cache=cache)
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+from spark_api import config
+from spark_api import fastjson
+from spark_api.data_structure import (
+    ChatModel,
+    ChatHistory,
+    ChatParams
+)
+
+
+class ResponseCache:
+    """回答缓存类
+
+    Attributes:
+        max_entries: int 内存缓存的最大条数
+        ttl: float 缓存的有效时长（秒）
+        disk_path: str 磁盘缓存的数据库路径，为空时不使用磁盘缓存
+        disk_max_bytes: int 磁盘缓存的最大字节数
+        hits: int 命中次数
+        misses: int 未命中次数
+    """
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        ttl: float | None = None,
+        disk_path: str | None = None,
+        disk_max_bytes: int | None = None,
+    ) -> None:
+        self.max_entries = max_entries or config.cache_max_entries
+        self.ttl = config.cache_ttl if ttl is None else ttl
+        self.disk_path = (config.cache_disk_path
+                          if disk_path is None else disk_path)
+        self.disk_max_bytes = disk_max_bytes or config.cache_disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[list[str], float]] = OrderedDict()
+        self._conn = None
+        self._disk_bytes = 0
+        if self.disk_path:
+            self._open_disk()
+
+    def _open_disk(self) -> None:
+        """打开磁盘缓存"""
+        self._conn = sqlite3.connect(self.disk_path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, deltas TEXT NOT NULL, "
+            "expires REAL NOT NULL, accessed REAL NOT NULL, "
+            "size INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed "
+            "ON responses (accessed)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_expires "
+            "ON responses (expires)"
+        )
+        row = self._conn.execute("SELECT SUM(size) FROM responses").fetchone()
+        self._disk_bytes = row[0] or 0
+
+    @staticmethod
+    def make_key(
+        model: ChatModel,
+        params: ChatParams,
+        history: ChatHistory,
+    ) -> str:
+        """生成缓存键
+
+        Args:
+            model: ChatModel 模型
+            params: ChatParams 请求参数
+            history: ChatHistory 消息记录（包含本次的问题）
+
+        Returns:
+            str: 缓存键
+        """
+        raw = history.encoded_messages(
+            fastjson.dumps([model.domain, params.temperature, params.top_k]))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        """读取缓存
+
+        先查内存缓存，再查磁盘缓存；磁盘缓存命中的条目会被放入内存缓存。
+
+        Args:
+            key: str 缓存键
+
+        Returns:
+            list[str] | None: 回答的流式片段，未命中时为None
+        """
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._memory[key]
+
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT deltas, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] > now:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE responses SET accessed = ? WHERE key = ?",
+                        (now, key),
+                    )
+                deltas = json.loads(row[0])
+                self._put_memory(key, deltas, row[1])
+                self.hits += 1
+                return deltas
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, deltas: list[str]) -> None:
+        """写入缓存
+
+        Args:
+            key: str 缓存键
+            deltas: list[str] 回答的流式片段
+        """
+        expires = time.time() + self.ttl
+        self._put_memory(key, deltas, expires)
+        if self._conn is None:
+            return
+
+        data = json.dumps(deltas, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        with self._conn:
+            row = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._disk_bytes -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, data, expires, time.time(), size),
+            )
+            self._disk_bytes += size
+            self._evict_disk()
+
+    def _put_memory(self, key: str, deltas: list[str], expires: float) -> None:
+        """写入内存缓存，超过条数上限时淘汰最久未使用的条目
+
+        Args:
+            key: str 缓存键
+            deltas: list[str] 回答的流式片段
+            expires: float 过期时间戳
+        """
+        self._memory[key] = (deltas, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        """删除过期条目，并在超过字节数上限时淘汰最久未访问的条目"""
+        now = time.time()
+        expired = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses WHERE expires <= ?",
+            (now,),
+        ).fetchone()[0]
+        if expired:
+            self._conn.execute(
+                "DELETE FROM responses WHERE expires <= ?", (now,)
+            )
+            self._disk_bytes -= expired
+
+        while self._disk_bytes > self.disk_max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,)
+                )
+                self._disk_bytes -= size
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+
+    def stats(self) -> dict:
+        """获取缓存统计
+
+        Returns:
+            dict: 命中次数、未命中次数、内存条数和磁盘字节数
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def close(self) -> None:
+        """关闭磁盘缓存"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -5,4 +5,70 @@ api_key: str = "your_api_key"
 
 # 配置参数
 temperature: float = 0.5
-top_k: int = 4
\ No newline at end of file
+top_k: int = 4
+
+# 配置会话
+uid: str = "CCLMSY" # 默认用户id，未指定会话时使用
+max_concurrency: int = 8 # 同一进程内同时进行的请求数上限
+
+# 配置签名URL缓存
+url_sign_ttl: float = 240.0 # 签名URL的复用时长（秒），Spark允许的时钟偏差为300秒
+url_refresh_ahead: float = 30.0 # 距离过期不足该时长（秒）时在后台提前刷新签名
+
+# 配置消息记录持久化
+history_path: str = "" # 消息记录的存储文件，.db/.sqlite使用SQLite，其余使用JSONL；为空时不持久化
+
+# 配置回答缓存（需在请求时传入ResponseCache才会启用）
+cache_max_entries: int = 1024 # 内存缓存的最大条数
+cache_ttl: float = 24 * 3600.0 # 缓存的有效时长（秒）
+cache_disk_path: str = "" # 磁盘缓存的数据库路径，为空时只使用内存缓存
+cache_disk_max_bytes: int = 64 * 1024 * 1024 # 磁盘缓存的最大字节数
+
+# 配置重试与流控
+max_retries: int = 3 # 可重试错误（10008/10110/10222/11202/11203）的最大重试次数
+retry_base_delay: float = 0.5 # 退避的基础时长（秒），每次重试翻倍并加入随机抖动
+retry_max_delay: float = 8.0 # 退避的最大时长（秒）
+qps: float = 2.0 # 授权的每秒请求数
+
+# 配置性能指标导出（均为空时不记录）
+metrics_jsonl_path: str = "" # 每个请求各阶段耗时的JSON Lines文件
+metrics_prometheus_path: str = "" # Prometheus文本格式的指标文件
+
+# 配置对冲请求
+hedge_delay: float = 1.0 # 首token延迟样本不足时，发出后备请求前的等待时长（秒）
+hedge_backup_model: int = 0 # 图形界面使用的后备模型序号（从1开始），0表示不对冲
+hedge_probe_timeout: float = 10.0 # 未被采用的请求在后台等待首个片段以记录首token延迟的最长时间（秒）
+
+# 配置请求超时
+request_timeout: float = 100.0 # 图形界面每个请求的超时时长（秒），超时后取消请求并关闭连接
+
+# 配置流式回答的显示刷新
+render_interval_ms: int = 33 # 刷新显示的最小间隔（毫秒），间隔内到达的片段合并为一次刷新
+render_max_interval_ms: int = 250 # 界面跟不上时刷新间隔的上限（毫秒）
+render_in_thread: bool = True # 在后台线程中把回答转换为html，长回答和代码高亮不阻塞事件循环
+render_highlight: bool = True # 代码块语法高亮（需要安装pygments，未安装时只转义）
+highlight_cache_entries: int = 256 # 高亮结果的缓存条数，按(语言, 代码哈希)缓存
+
+# 配置聊天显示区
+display_max_messages: int = 200 # 显示区保留的最近消息数，更早的消息移出显示区并归档
+display_page_size: int = 50 # 向上滚动到顶部时，每次从归档中重新载入的消息数
+display_archive_path: str = "" # 归档的保存路径（.db/.sqlite使用SQLite，可与history_path相同），为空时保存在临时目录
+
+# 配置消息搜索
+search_index_path: str = "" # 搜索索引的SQLite数据库路径，需同时配置history_path；为空时不建立索引，搜索框不可用
+search_candidates: int = 1000 # 匹配的消息很多时，只在最近的这么多条匹配中按相关度排序
+
+# 配置多组API信息（除上面的app_id、api_secret、api_key之外）
+# 每项为{"app_id": ..., "api_key": ..., "api_secret": ..., "qps": ..., "max_concurrency": ...}，
+# qps和max_concurrency可省略（使用上面的qps和max_concurrency）。请求分配给负载最低的一组，
+# 默认调度器的QPS和并发上限为各组之和
+credentials: list[dict] = []
+credential_cooldown: float = 5.0 # 某一组秒级/并发流控超限后暂停分配的时长（秒）
+
+# 配置网关服务（python -m spark_api.gateway），多个本地客户端共享一个进程的会话和并发名额
+gateway_host: str = "127.0.0.1" # 监听地址
+gateway_port: int = 8765 # 监听端口
+gateway_max_sessions: int = 1024 # 保留的会话数上限，超过时丢弃最久未使用的空闲会话
+
+# 配置连接预热
+prewarm_ttl: float = 20.0 # 切换模型或开始输入时预热的连接的保留时长（秒），超过后关闭；0表示不预热
@@ -12,12 +12,12 @@ from spark_api.data_structure import(
 )
 
 chat_models = [
-    ChatModel("Spark Lite", "wss://spark-api.xf-yun.com/v1.1/chat", "lite", 4096),
-    ChatModel("Spark Pro", "wss://spark-api.xf-yun.com/v3.1/chat", "generalv3", 8192),
-    ChatModel("Spark Pro-128K", " wss://spark-api.xf-yun.com/chat/pro-128k", "pro-128k", 4096),
-    ChatModel("Spark Max", "wss://spark-api.xf-yun.com/v3.5/chat", "generalv3.5", 8192),
-    ChatModel("Spark Max-32K", "wss://spark-api.xf-yun.com/chat/max-32k", "max-32k", 8192),
-    ChatModel("Spark4.0 Ultra", "wss://spark-api.xf-yun.com/v4.0/chat", "4.0Ultra", 8192)
+    ChatModel("Spark Lite", "wss://spark-api.xf-yun.com/v1.1/chat", "lite", 4096, 8192),
+    ChatModel("Spark Pro", "wss://spark-api.xf-yun.com/v3.1/chat", "generalv3", 8192, 8192),
+    ChatModel("Spark Pro-128K", " wss://spark-api.xf-yun.com/chat/pro-128k", "pro-128k", 4096, 131072),
+    ChatModel("Spark Max", "wss://spark-api.xf-yun.com/v3.5/chat", "generalv3.5", 8192, 8192),
+    ChatModel("Spark Max-32K", "wss://spark-api.xf-yun.com/chat/max-32k", "max-32k", 8192, 32768),
+    ChatModel("Spark4.0 Ultra", "wss://spark-api.xf-yun.com/v4.0/chat", "4.0Ultra", 8192, 8192)
 ] 
 """list: 聊天模型列表"""
 
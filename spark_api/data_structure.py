@@ -8,6 +8,19 @@ Classes:
     ChatHistory: 消息记录类
 """
 
+import sys
+from array import array
+from collections import deque
+
+from spark_api import fastjson
+from spark_api.search import SearchIndex
+from spark_api.storage import HistoryStore
+from spark_api import tokens
+
+
+_PAGE_SIZE = 256 # 从存储后端分页读取时每页的消息数
+
+
 class ChatModel:
     """聊天模型类
     
@@ -16,12 +29,21 @@ class ChatModel:
         url: str 模型的websockets请求地址
         domain: str 模型的domain
         max_tokens: int 模型的最大token长度
+        context_tokens: int 请求中消息记录（包含问题）的最大token数
     """
-    def __init__(self, name: str, url: str, domain: str, max_tokens: int) -> None:
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        domain: str,
+        max_tokens: int,
+        context_tokens: int | None = None,
+    ) -> None:
         self.name = name
         self.url = url
         self.domain = domain
         self.max_tokens = max_tokens
+        self.context_tokens = context_tokens or max_tokens
 
 
 class ChatParams:
@@ -37,58 +59,247 @@ class ChatParams:
         self.top_k = top_k
 
 
+class _Message:
+    """一条消息的紧凑记录
+
+    与字典相比，每条消息只需一个定长的对象；发送者字符串经过驻留，所有消息共享同一个对象。
+
+    Attributes:
+        role: str 发送者
+        content: str 消息内容
+    """
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str) -> None:
+        self.role = sys.intern(role)
+        self.content = content
+
+    def to_dict(self) -> dict:
+        """转换为消息字典
+
+        Returns:
+            dict: 包含"role"和"content"的消息
+        """
+        return {"role": self.role, "content": self.content}
+
+
 class ChatHistory:
     """消息记录类
-    
+
+    消息以_Message记录存放在列表中，每条消息的token估计值存放在并行的array中，并维护估计值的总和。
+    修剪时只移动起始下标，被修剪的部分超过一半时才一次性删除，
+    追加和修剪都是均摊O(1)的操作，与消息记录的长度无关。
+    估计值由tokens.estimator在追加时计算一次（未校准），与token数比较时再按校准系数换算。
+    每条消息编码后的JSON片段也随消息一起缓存，生成请求时只需拼接，不必重新编码整个消息记录。
+    指定存储后端时，追加的消息会同时写入存储，内存中只保留修剪后的上下文窗口，
+    更早的消息可以通过page按需读取。指定搜索索引时，追加和撤销的消息同时更新索引；
+    持久化的索引以存储中的下标区分消息，必须与存储后端一起使用，否则抛出ValueError。
+
     Attributes:
         messages: list 消息列表。每个元素是一个字典，包含两个键值对，分别是"role"和"content"，分别表示发送者和消息内容
-        _msg_len: list 每条消息的长度
-    
+        total_len: int 所有消息未校准的token估计值之和
+        store: HistoryStore | None 存储后端，为None时不持久化
+        first_index: int 内存中第一条消息在存储中的下标
+        index: SearchIndex | None 搜索索引，为None时不建立索引
+        conversation: str 对话id，用于区分索引中各对话的消息
+        _records: list[_Message] 消息记录，前_head条已被修剪
+        _json: list[str] 每条消息编码后的JSON片段（以","开头），与_records一一对应
+        _lengths: array 每条消息未校准的token估计值，与_records一一对应
+        _head: int 第一条未被修剪的消息在_records中的下标
+
     Functions:
         __init__: 初始化方法
         __str__: 字符串方法
+        __len__: 消息条数
         trim_message: 修剪消息记录
         append_message: 追加消息
-
-    TODO: 消息记录的持久化
+        pop_message: 撤销最后一条消息
+        encoded_messages: 消息列表的JSON字符串
+        from_store: 从存储后端加载上下文窗口
+        page: 从存储后端读取一段消息
     """
-    def __init__(self, messages: list=[]) -> None:
-        self.messages = messages
-        self._msg_len = [len(str(msg)) for msg in messages]
+    def __init__(
+        self,
+        messages: list | None = None,
+        store: HistoryStore | None = None,
+        first_index: int = 0,
+        index: SearchIndex | None = None,
+        conversation: str = "default",
+    ) -> None:
+        if index is not None and index.persistent and store is None:
+            # 没有存储后端时下标每次运行都从0开始，会覆盖索引中上次运行的消息
+            raise ValueError("a persistent search index requires a history store")
+        messages = messages or []
+        self._records = [_Message(msg["role"], msg["content"]) for msg in messages]
+        self._json = ["," + fastjson.dumps(msg) for msg in messages]
+        self._lengths = array("L", map(tokens.estimator.message_cost, messages))
+        self._head = 0
+        self.total_len = sum(self._lengths)
+        self.store = store
+        self.first_index = first_index
+        self.index = index
+        self.conversation = conversation
+
+    @classmethod
+    def from_store(cls, store: HistoryStore, max_tokens: int, **kwargs) -> "ChatHistory":
+        """从存储后端加载消息记录
+
+        从最新的消息开始向前分页读取，只把修剪后（与trim_message的结果相同）的
+        上下文窗口载入内存。
+
+        Args:
+            store: HistoryStore 存储后端
+            max_tokens: int 模型的最大token长度
+            **kwargs: 传给__init__的其余参数（index、conversation）
+
+        Returns:
+            ChatHistory: 消息记录
+        """
+        limit = tokens.estimator.to_raw(max_tokens)
+        window = deque()
+        total_len = 0
+        start = len(store)
+        while start > 0:
+            page = store.read(max(start - _PAGE_SIZE, 0), start)
+            for msg in reversed(page):
+                msg_len = tokens.estimator.message_cost(msg)
+                if window and total_len + msg_len > limit:
+                    return cls(list(window), store, start, **kwargs)
+                window.appendleft(msg)
+                total_len += msg_len
+                start -= 1
+        return cls(list(window), store, start, **kwargs)
 
     def __str__(self) -> str:
         return str(self.messages)
 
+    def __len__(self) -> int:
+        return len(self._records) - self._head
+
+    @property
+    def messages(self) -> list:
+        """list: 消息列表（副本）"""
+        return [record.to_dict() for record in self._records[self._head:]]
+
+    @property
+    def token_count(self) -> int:
+        """int: 消息记录的token数（校准后的估计值）"""
+        return tokens.estimator.to_tokens(self.total_len)
+
     def trim_message(self, max_tokens: int) -> None:
         """修剪消息记录
-        
-        修剪消息记录，使得消息的总token长度不超过模型的最大token长度。
+
+        修剪消息记录，使得消息的总token数不超过max_tokens，最后一条消息总会保留。
+        每移除一条消息只需均摊O(1)时间。
 
         Args:
-            max_tokens: int 模型的最大token长度
+            max_tokens: int 消息记录的最大token数
         """
-        while sum(self._msg_len) > max_tokens*1.2:
-            self.messages.pop(0)
-            self._msg_len.pop(0)
+        limit = tokens.estimator.to_raw(max_tokens)
+        head = self._head
+        while self.total_len > limit and len(self._records) - head > 1:
+            self.total_len -= self._lengths[head]
+            self._records[head] = self._json[head] = None # 尽早释放被修剪的消息
+            head += 1
+        self.first_index += head - self._head
+        self._head = head
+        if head > len(self._records) // 2:
+            del self._records[:head]
+            del self._json[:head]
+            del self._lengths[:head]
+            self._head = 0
 
     def append_message(self, role: str, content: str) -> None:
         """追加消息
-        
+
         Args:
             role: str 发送者。可选值："user"、"assistant"
             content: str 消息内容
-        
+
         Raises:
             ValueError: role不是"user"或"assistant"
         """
         if role not in ["user", "assistant"]:
             raise ValueError("role must be 'user' or 'assistant'")
-        
+
         msg = {"role": role, "content": content}
-        self.messages.append(msg)
-        self._msg_len.append(len(str(msg)))
+        msg_len = tokens.estimator.message_cost(msg)
+        self._records.append(_Message(role, content))
+        self._json.append("," + fastjson.dumps(msg))
+        self._lengths.append(msg_len)
+        self.total_len += msg_len
+        if self.store is not None:
+            self.store.append(msg)
+        if self.index is not None:
+            self.index.add(self.conversation, self.first_index + len(self) - 1, role, content)
+
+    def pop_message(self) -> dict:
+        """撤销最后一条消息
+
+        用于请求失败或被取消时撤销尚未得到回答的问题，存储后端和搜索索引中的该消息也会被删除。
+
+        Returns:
+            dict: 被撤销的消息
+
+        Raises:
+            IndexError: 内存中没有消息
+        """
+        if not len(self):
+            raise IndexError("pop from empty ChatHistory")
+        if self.index is not None:
+            self.index.remove(self.conversation, self.first_index + len(self) - 1)
+        record = self._records.pop()
+        self._json.pop()
+        self.total_len -= self._lengths.pop()
+        if self.store is not None:
+            self.store.truncate(len(self.store) - 1)
+        return record.to_dict()
+
+    def encoded_messages(self, prefix: str = "", suffix: str = "") -> str:
+        """获取消息列表的JSON字符串
+
+        由缓存的各条消息的JSON片段拼接而成，消息列表部分与fastjson.dumps(self.messages)的结果相同。
+        前后缀在同一次拼接中加入，长消息记录只需复制一次。
+
+        Args:
+            prefix: str 加在消息列表前的字符串
+            suffix: str 加在消息列表后的字符串
+
+        Returns:
+            str: prefix + 消息列表的JSON字符串 + suffix
+        """
+        parts = [prefix + "[", *self._json[self._head:], "]" + suffix]
+        if len(parts) > 2:
+            parts[1] = parts[1][1:] # 第一条消息前没有逗号
+        return "".join(parts)
+
+    def page(self, start: int, stop: int) -> list:
+        """读取一段消息
+
+        读取下标在[start, stop)之间的消息，下标以存储中的位置计；
+        没有存储后端时从内存中读取。
+
+        Args:
+            start: int 起始下标
+            stop: int 结束下标（不包含）
+
+        Returns:
+            list: 消息列表
+        """
+        if self.store is not None:
+            return self.store.read(start, stop)
+        start = max(start - self.first_index, 0) + self._head
+        stop = max(stop - self.first_index, 0) + self._head
+        return [record.to_dict() for record in self._records[start:stop]]
 
     def clear(self) -> None:
-        """清空消息记录"""
-        self.messages = []
-        self._msg_len = []
\ No newline at end of file
+        """清空消息记录
+
+        只清空内存中的上下文窗口，存储后端和搜索索引中已保存的消息不受影响。
+        """
+        self.first_index += len(self)
+        self._records = []
+        self._json = []
+        self._lengths = array("L")
+        self._head = 0
+        self.total_len = 0
@@ -0,0 +1,176 @@
+"""会话引擎模块
+
+该模块提供以会话为单位的请求引擎，使同一进程内的多个对话可以在同一个事件循环上
+并发进行而互不干扰。
+
+Classes:
+    ChatSession: 会话类，持有一个对话自己的模型、消息记录、参数和uid
+    ChatEngine: 会话引擎类，限制并发数并调度各会话的请求
+
+使用示例：
+    engine = ChatEngine(max_concurrency=16)
+    session = engine.new_session(chat_models[0])
+    answer = await engine.request(session, "你好")
+"""
+
+import asyncio
+import uuid
+from typing import AsyncIterator
+
+from spark_api import config
+from spark_api.cache import ResponseCache
+from spark_api.data_structure import (
+    ChatModel,
+    ChatHistory,
+    ChatParams
+)
+from spark_api.scheduler import wait_with_deadline
+from spark_api.spark_api import stream_chat
+
+
+def new_uid() -> str:
+    """生成一个新的用户id
+
+    Spark要求同一uid同一时间只能有一个连接（否则返回10006），
+    因此每个会话使用独立的uid。
+
+    Returns:
+        str: 32位十六进制字符串
+    """
+    return uuid.uuid4().hex
+
+
+class ChatSession:
+    """会话类
+
+    每个会话持有自己的消息记录和uid，同一会话内的请求串行执行
+    （Spark要求上一个问题回答完毕后才能发送下一个，否则返回10007）。
+
+    Attributes:
+        model: ChatModel 会话使用的模型
+        history: ChatHistory 会话的消息记录
+        params: ChatParams 会话的请求参数
+        uid: str 会话的用户id
+    """
+    def __init__(
+        self,
+        model: ChatModel,
+        history: ChatHistory | None = None,
+        params: ChatParams | None = None,
+        uid: str | None = None,
+    ) -> None:
+        self.model = model
+        self.history = history if history is not None else ChatHistory([])
+        self.params = params if params is not None else ChatParams()
+        self.uid = uid or new_uid()
+        self._lock = asyncio.Lock()
+
+
+class ChatEngine:
+    """会话引擎类
+
+    在同一个事件循环上并发驱动多个会话，所有会话共享一个并发上限。
+
+    Attributes:
+        max_concurrency: int 同时进行的请求数上限
+        cache: ResponseCache | None 所有会话共享的回答缓存，为None时不使用缓存
+    """
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        cache: ResponseCache | None = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency or config.max_concurrency
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def new_session(
+        self,
+        model: ChatModel,
+        history: ChatHistory | None = None,
+        params: ChatParams | None = None,
+    ) -> ChatSession:
+        """创建一个新会话
+
+        Args:
+            model: ChatModel 会话使用的模型
+            history: ChatHistory | None 初始消息记录，为None时新建空记录
+            params: ChatParams | None 请求参数，为None时使用默认参数
+
+        Returns:
+            ChatSession: 新会话
+        """
+        return ChatSession(model, history, params)
+
+    async def stream(
+        self,
+        session: ChatSession,
+        question: str,
+        deadline: float | None = None,
+    ) -> AsyncIterator[str]:
+        """在会话中流式请求聊天
+
+        先等待会话内上一个请求结束，再占用一个全局并发名额，两段等待都计入截止时间。
+
+        Args:
+            session: ChatSession 会话
+            question: str 用户问题
+            deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+        Yields:
+            str: 回答片段（增量）
+        """
+        await wait_with_deadline(session._lock.acquire(), deadline)
+        try:
+            await wait_with_deadline(self._semaphore.acquire(), deadline)
+            try:
+                async for delta in stream_chat(session.model,
+                                               session.history,
+                                               session.params,
+                                               question,
+                                               session.uid,
+                                               self.cache,
+                                               deadline):
+                    yield delta
+            finally:
+                self._semaphore.release()
+        finally:
+            session._lock.release()
+
+    async def request(
+        self,
+        session: ChatSession,
+        question: str,
+        deadline: float | None = None,
+    ) -> str:
+        """在会话中请求聊天
+
+        Args:
+            session: ChatSession 会话
+            question: str 用户问题
+            deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+        Returns:
+            str: 机器人回答
+        """
+        parts = []
+        async for delta in self.stream(session, question, deadline):
+            parts.append(delta)
+        return "".join(parts)
+
+    async def run_many(
+        self,
+        jobs: list[tuple[ChatSession, str]],
+    ) -> list[str | BaseException]:
+        """并发执行多个请求
+
+        Args:
+            jobs: list[tuple[ChatSession, str]] (会话, 问题)列表
+
+        Returns:
+            list[str | BaseException]: 与jobs一一对应的回答，失败的请求对应其异常
+        """
+        return await asyncio.gather(
+            *(self.request(session, question) for session, question in jobs),
+            return_exceptions=True,
+        )
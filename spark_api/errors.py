@@ -0,0 +1,32 @@
+"""异常模块
+
+定义了SparkAPI请求相关的异常，以及按处理方式对错误码的分类。
+错误码对应的提示信息见chat_process.error_code。
+"""
+
+RETRYABLE_CODES = frozenset({10008, 10110, 10222})
+"""frozenset: 服务容量不足、服务忙、引擎网络异常，退避后可以重试"""
+
+RATE_LIMIT_CODES = frozenset({11202, 11203})
+"""frozenset: 秒级流控超限、并发流控超限，需要降低请求速率或并发数"""
+
+DAILY_LIMIT_CODES = frozenset({11201})
+"""frozenset: 日流控超限，当日不应再发送请求"""
+
+
+class SparkApiError(Exception):
+    """SparkAPI请求错误
+
+    Attributes:
+        code: int 错误码
+        response: dict | None 返回错误的完整消息
+    """
+    def __init__(self, code: int, response: dict | None = None) -> None:
+        super().__init__(f"SparkAPI请求错误: Code:'{code}', Message:'{response}'")
+        self.code = code
+        self.response = response
+
+    @property
+    def retryable(self) -> bool:
+        """bool: 是否可以在退避后重试"""
+        return self.code in RETRYABLE_CODES or self.code in RATE_LIMIT_CODES
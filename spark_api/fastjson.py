@@ -0,0 +1,44 @@
+"""JSON编解码模块
+
+请求的序列化和回复的解析都经过这里。安装了可选的orjson（pip install orjson）时使用orjson，
+否则回退到标准库json；两者的编码结果相同：紧凑格式、不转义非ASCII字符的str。
+
+Functions:
+    dumps: 编码为JSON字符串
+    loads: 解码JSON
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """编码为JSON字符串
+
+    Args:
+        obj: 要编码的对象
+
+    Returns:
+        str: 紧凑格式、不转义非ASCII字符的JSON字符串
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data: str | bytes):
+    """解码JSON
+
+    Args:
+        data: str | bytes JSON字符串
+
+    Returns:
+        解码得到的对象
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
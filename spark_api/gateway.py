@@ -0,0 +1,292 @@
+"""网关服务模块
+
+该模块提供一个本地Websockets服务，使多个客户端共享同一个进程中的会话、回答缓存和
+Spark并发名额，而不必每个用户各开一个图形界面。每个会话保存自己的消息记录，
+同一会话内的请求按顺序执行（Spark的10007限制），所有会话共享ChatEngine的并发上限，
+请求经由spark_api.scheduler调度重试和流控。一个连接上可以同时进行多个请求，
+回答片段随到随发，各请求以客户端指定的id区分。会话与连接无关，客户端重连后可以继续使用原来的会话。
+
+客户端发送的消息（JSON文本帧）：
+    {"type": "chat", "id": "r1", "session": "s1", "content": "你好", "model": "1", "timeout": 60}
+        model和timeout可省略，model为序号（从1开始）、名称或domain，默认沿用会话的模型
+    {"type": "cancel", "id": "r1"}
+    {"type": "reset", "session": "s1"}    丢弃会话及其消息记录
+
+服务返回的消息：
+    {"type": "delta", "id": "r1", "content": "..."}    回答片段（增量）
+    {"type": "done", "id": "r1", "content": "..."}     完整回答
+    {"type": "error", "id": "r1", "code": 10013, "message": "..."}
+        code为Spark错误码，或"timeout"、"cancelled"、"bad_request"、"internal"
+
+Classes:
+    GatewayServer: 网关服务
+
+使用方法：
+    python -m spark_api.gateway --port 8765
+"""
+
+import argparse
+import asyncio
+import time
+from collections import OrderedDict
+
+import websockets
+
+from spark_api import config
+from spark_api import fastjson
+from spark_api import metrics
+from spark_api.batch import find_model
+from spark_api.data import chat_models
+from spark_api.engine import ChatEngine, ChatSession
+from spark_api.errors import SparkApiError
+
+
+class GatewayServer:
+    """网关服务
+
+    Attributes:
+        engine: ChatEngine 所有会话共享的会话引擎
+        host: str 监听地址
+        port: int 监听端口，为0时由系统分配
+        max_sessions: int 保留的会话数上限，超过时丢弃最久未使用的空闲会话
+        sessions: OrderedDict[str, ChatSession] 会话id -> 会话，按最近使用的顺序排列
+    """
+    def __init__(
+        self,
+        engine: ChatEngine | None = None,
+        host: str | None = None,
+        port: int | None = None,
+        max_sessions: int | None = None,
+    ) -> None:
+        self.engine = engine or ChatEngine()
+        self.host = host or config.gateway_host
+        self.port = config.gateway_port if port is None else port
+        self.max_sessions = max_sessions or config.gateway_max_sessions
+        self.sessions: OrderedDict[str, ChatSession] = OrderedDict()
+        self._active: dict[str, int] = {} # 会话id -> 排队和进行中的请求数
+        self._server = None
+
+    async def __aenter__(self) -> "GatewayServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        """启动服务"""
+        self._server = await websockets.serve(self._handler, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """停止服务，进行中的请求随连接关闭而取消"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def url(self) -> str:
+        """获取服务地址
+
+        Returns:
+            str: websockets地址
+        """
+        return f"ws://{self.host}:{self.port}"
+
+    def session(self, session_id: str, model_name: str | None = None) -> ChatSession:
+        """获取会话，不存在时新建
+
+        Args:
+            session_id: str 会话id
+            model_name: str | None 模型序号、名称或domain，为None时沿用会话的模型
+
+        Returns:
+            ChatSession: 会话
+
+        Raises:
+            ValueError: 找不到对应的模型
+        """
+        model = find_model(model_name) if model_name else None
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.engine.new_session(model or chat_models[0])
+            self.sessions[session_id] = session
+            self._evict()
+        else:
+            self.sessions.move_to_end(session_id)
+            if model is not None:
+                session.model = model
+        return session
+
+    def _evict(self) -> None:
+        """丢弃超过上限的最久未使用的空闲会话，有排队或进行中的请求的会话不会被丢弃"""
+        excess = len(self.sessions) - self.max_sessions
+        for session_id in list(self.sessions):
+            if excess <= 0:
+                break
+            if not self._active.get(session_id):
+                del self.sessions[session_id]
+                excess -= 1
+
+    def _release(self, session_id: str) -> None:
+        """会话的一个请求结束，会话空闲后丢弃超过上限的会话
+
+        Args:
+            session_id: str 会话id
+        """
+        count = self._active[session_id] - 1
+        if count:
+            self._active[session_id] = count
+        else:
+            del self._active[session_id]
+            self._evict()
+
+    async def _handler(self, ws) -> None:
+        """处理一个客户端连接
+
+        Args:
+            ws: websockets连接
+        """
+        tasks: dict[str, asyncio.Task] = {}
+        try:
+            async for raw in ws:
+                message = None
+                try:
+                    message = fastjson.loads(raw)
+                    kind = message["type"]
+                    if kind == "chat":
+                        request_id = str(message["id"])
+                        if request_id in tasks:
+                            raise ValueError(f"duplicate request id: {request_id}")
+                        timeout = message.get("timeout")
+                        timeout = config.request_timeout if timeout is None else float(timeout)
+                        session_id = str(message["session"])
+                        # 请求在取得会话的锁之前就计入，排队中的会话也不会被丢弃
+                        self._active[session_id] = self._active.get(session_id, 0) + 1
+                        try:
+                            session = self.session(session_id, message.get("model"))
+                        except ValueError:
+                            self._release(session_id)
+                            raise
+                        task = asyncio.create_task(self._chat(
+                            ws, request_id, session, str(message["content"]), timeout))
+                        tasks[request_id] = task
+
+                        def finished(_, rid=request_id, sid=session_id) -> None:
+                            tasks.pop(rid, None)
+                            self._release(sid)
+                        task.add_done_callback(finished)
+                    elif kind == "cancel":
+                        task = tasks.get(str(message["id"]))
+                        if task is not None:
+                            task.cancel()
+                    elif kind == "reset":
+                        self.sessions.pop(str(message["session"]), None)
+                    else:
+                        raise ValueError(f"unknown message type: {kind}")
+                except (ValueError, KeyError, TypeError) as e:
+                    request_id = message.get("id") if isinstance(message, dict) else None
+                    await self._send(ws, "error", request_id,
+                                     code="bad_request", message=str(e))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            # 客户端断开时取消它的请求，未得到回答的问题从会话中撤销
+            for task in list(tasks.values()):
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def _chat(
+        self,
+        ws,
+        request_id: str,
+        session: ChatSession,
+        question: str,
+        timeout: float,
+    ) -> None:
+        """在会话中请求聊天，把回答片段发送给客户端
+
+        Args:
+            ws: websockets连接
+            request_id: str 客户端指定的请求id
+            session: ChatSession 会话
+            question: str 用户问题
+            timeout: float 超时时长（秒），不大于0时不限时
+        """
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+        parts = []
+        try:
+            async for delta in self.engine.stream(session, question, deadline):
+                parts.append(delta)
+                await self._send(ws, "delta", request_id, content=delta)
+        except asyncio.CancelledError:
+            await self._try_send(ws, "error", request_id,
+                                 code="cancelled", message="请求已取消")
+            raise
+        except websockets.ConnectionClosed:
+            return
+        except TimeoutError:
+            await self._try_send(ws, "error", request_id,
+                                 code="timeout", message="请求超时")
+        except SparkApiError as e:
+            await self._try_send(ws, "error", request_id, code=e.code, message=str(e))
+        except Exception as e:
+            await self._try_send(ws, "error", request_id, code="internal",
+                                 message=f"{type(e).__name__}: {e}")
+        else:
+            await self._try_send(ws, "done", request_id, content="".join(parts))
+
+    @staticmethod
+    async def _send(ws, kind: str, request_id: str | None, **fields) -> None:
+        """发送一条消息
+
+        Args:
+            ws: websockets连接
+            kind: str 消息类型
+            request_id: str | None 请求id
+            **fields: 消息的其余字段
+        """
+        await ws.send(fastjson.dumps({"type": kind, "id": request_id, **fields}))
+
+    async def _try_send(self, ws, kind: str, request_id: str | None, **fields) -> None:
+        """发送一条消息，连接已关闭时忽略"""
+        try:
+            await self._send(ws, kind, request_id, **fields)
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def serve(host: str | None = None, port: int | None = None) -> None:
+    """启动网关服务并一直运行
+
+    Args:
+        host: str | None 监听地址，为None时使用config.gateway_host
+        port: int | None 监听端口，为None时使用config.gateway_port
+    """
+    async with GatewayServer(host=host, port=port) as server:
+        print(f"gateway listening on {server.url()}")
+        await asyncio.Future()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """命令行入口
+
+    Args:
+        argv: list[str] | None 命令行参数，为None时使用sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m spark_api.gateway",
+        description="启动网关服务，使多个本地客户端共享会话和Spark并发名额。")
+    parser.add_argument("--host", default=config.gateway_host, help="监听地址")
+    parser.add_argument("--port", type=int, default=config.gateway_port, help="监听端口")
+    args = parser.parse_args(argv)
+
+    metrics.enable_from_config()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
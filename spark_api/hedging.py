@@ -0,0 +1,254 @@
+"""对冲请求模块
+
+该模块提供可选的对冲请求：先向第一个模型发送请求，若在一定延迟内还没有收到首个回答片段，
+再依次向后备模型发送同样的请求，采用最先产出首个片段的那一路，并取消其余请求、关闭它们的连接。
+延迟默认取该模型最近若干次首token延迟的p95，样本不足时使用config.hedge_delay。
+未被采用、尚未产出首个片段的请求在后台继续等待首个片段（最长config.hedge_probe_timeout），
+记录其首token延迟后再关闭，使样本不只来自较快的响应；被取消或等待超时时记录已等待的时长，作为延迟的下界。
+
+Classes:
+    Hedger: 对冲请求类，记录各模型的首token延迟
+
+Functions:
+    hedged_stream_chat: 使用默认Hedger的对冲流式请求
+
+使用示例：
+    async for delta in hedged_stream_chat([chat_models[3], chat_models[1]],
+                                          history, params, "你好"):
+        print(delta, end="")
+"""
+
+import asyncio
+import time
+from collections import deque
+from functools import partial
+from typing import AsyncIterator
+
+from spark_api import config
+from spark_api import spark_api
+from spark_api.data_structure import (
+    ChatModel,
+    ChatHistory,
+    ChatParams
+)
+from spark_api.engine import new_uid
+
+
+class Hedger:
+    """对冲请求类
+
+    Attributes:
+        delay: float | None 固定的对冲延迟（秒），为None时按首token延迟的分位数计算
+        percentile: float 计算对冲延迟使用的分位数
+        window: int 每个模型保留的首token延迟样本数
+    """
+    def __init__(
+        self,
+        delay: float | None = None,
+        percentile: float = 0.95,
+        window: int = 100,
+    ) -> None:
+        self.delay = delay
+        self.percentile = percentile
+        self.window = window
+        self._ttft: dict[str, deque[float]] = {}
+        self._probes: set[asyncio.Task] = set() # 在后台等待首个片段的未被采用的请求
+
+    def record_ttft(self, model: ChatModel, seconds: float) -> None:
+        """记录一次首token延迟
+
+        Args:
+            model: ChatModel 模型
+            seconds: float 首token延迟（秒）
+        """
+        samples = self._ttft.get(model.name)
+        if samples is None:
+            samples = self._ttft[model.name] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def _probe(self, task: asyncio.Task, stream: AsyncIterator[str], model: ChatModel,
+               started: float) -> None:
+        """在后台等待未被采用的请求的首个片段，记录首token延迟后关闭它的流
+
+        Args:
+            task: asyncio.Task 等待首个片段的任务
+            stream: AsyncIterator[str] 请求的流
+            model: ChatModel 请求的模型
+            started: float 请求发出的时间（time.perf_counter()）
+        """
+        async def wait_first() -> None:
+            try:
+                try:
+                    await asyncio.wait_for(task, config.hedge_probe_timeout)
+                except (StopAsyncIteration, TimeoutError):
+                    pass # 超时时没有等到首个片段，已等待的时长是首token延迟的下界
+                except asyncio.CancelledError:
+                    self.record_ttft(model, time.perf_counter() - started)
+                    raise
+                except Exception:
+                    return # 请求失败，不是首token延迟的样本
+                self.record_ttft(model, time.perf_counter() - started)
+            finally:
+                await stream.aclose()
+
+        probe = asyncio.ensure_future(wait_first())
+        self._probes.add(probe)
+        probe.add_done_callback(self._probes.discard)
+
+    def delay_for(self, model: ChatModel) -> float:
+        """计算发出后备请求前的等待时长
+
+        Args:
+            model: ChatModel 先发出请求的模型
+
+        Returns:
+            float: 等待时长（秒）
+        """
+        if self.delay is not None:
+            return self.delay
+        samples = self._ttft.get(model.name)
+        if not samples or len(samples) < 20:
+            return config.hedge_delay
+        ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+
+    async def stream(
+        self,
+        models: list[ChatModel],
+        history: ChatHistory,
+        params: ChatParams,
+        question: str,
+        uid: str | None = None,
+        deadline: float | None = None,
+    ) -> AsyncIterator[str]:
+        """对冲流式请求聊天
+
+        发送前按各模型中最小的context_tokens修剪消息记录。
+        失败、超时或被取消时，撤销消息记录中尚未得到回答的问题。
+
+        Args:
+            models: list[ChatModel] 依次尝试的模型，第一个为主模型
+            history: ChatHistory 消息记录
+            params: ChatParams 请求参数
+            question: str 用户问题
+            uid: str | None 主请求的用户id，后备请求使用新的uid避免10006
+            deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+        Yields:
+            str: 回答片段（增量）
+
+        Raises:
+            Exception: 所有请求都失败时，抛出最后一个请求的异常
+        """
+        history.append_message("user", question)
+        history.trim_message(min(model.context_tokens for model in models))
+        pending: dict[asyncio.Task, tuple[AsyncIterator[str], ChatModel, float]] = {}
+        streams: list[AsyncIterator[str]] = [] # 已发出的所有请求的流
+        launched = 0
+        error = None
+
+        def launch() -> None:
+            nonlocal launched
+            model = models[launched]
+            request = partial(spark_api.connect_ws, model, history, params,
+                              uid if launched == 0 else new_uid(), deadline)
+            stream = spark_api.scheduler.stream(request, deadline)
+            task = asyncio.ensure_future(anext(stream))
+            pending[task] = (stream, model, time.perf_counter())
+            streams.append(stream)
+            launched += 1
+
+        try:
+            launch()
+            winner = None
+            try:
+                while winner is None:
+                    timeout = None
+                    if launched < len(models):
+                        timeout = self.delay_for(models[launched - 1])
+                    done, _ = await asyncio.wait(pending, timeout=timeout,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done: # 超过延迟仍没有首个片段，发出后备请求
+                        launch()
+                        continue
+                    for task in done:
+                        stream, model, started = pending.pop(task)
+                        if task.cancelled():
+                            continue
+                        exc = task.exception()
+                        if exc is None or isinstance(exc, StopAsyncIteration):
+                            self.record_ttft(model, time.perf_counter() - started)
+                            first = "" if exc else task.result()
+                            winner = (stream, first, exc is not None)
+                            break
+                        error = exc
+                    if winner is None and not pending:
+                        if launched >= len(models):
+                            raise error
+                        launch() # 已发出的请求全部失败，立即尝试下一个模型
+            finally:
+                # 有胜出者时，尚未产出首个片段的请求转到后台等待首个片段；
+                # 其余请求取消，并关闭胜出者和后台请求以外所有请求的流（包括同一轮中已完成的请求），
+                # 释放连接和并发名额
+                probed = set()
+                cancelled = []
+                for task, (stream, model, started) in pending.items():
+                    if winner is not None and not task.done():
+                        self._probe(task, stream, model, started)
+                        probed.add(stream)
+                        continue
+                    if not task.done():
+                        # 被取消的请求，已等待的时长是首token延迟的下界
+                        self.record_ttft(model, time.perf_counter() - started)
+                    task.cancel()
+                    cancelled.append(task)
+                await asyncio.gather(*cancelled, return_exceptions=True)
+                for stream in streams:
+                    if stream not in probed and (winner is None or stream is not winner[0]):
+                        await stream.aclose()
+
+            stream, first, finished = winner
+            parts = [first] if first else []
+            try:
+                if first:
+                    yield first
+                if not finished:
+                    async for delta in stream:
+                        parts.append(delta)
+                        yield delta
+            finally:
+                await stream.aclose()
+        except BaseException:
+            history.pop_message()
+            raise
+        history.append_message("assistant", "".join(parts))
+
+
+hedger = Hedger()
+"""Hedger: 默认的对冲请求实例"""
+
+
+async def hedged_stream_chat(
+    models: list[ChatModel],
+    history: ChatHistory,
+    params: ChatParams,
+    question: str,
+    uid: str | None = None,
+    deadline: float | None = None,
+) -> AsyncIterator[str]:
+    """使用默认Hedger对冲流式请求聊天
+
+    Args:
+        models: list[ChatModel] 依次尝试的模型，第一个为主模型
+        history: ChatHistory 消息记录
+        params: ChatParams 请求参数
+        question: str 用户问题
+        uid: str | None 主请求的用户id
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+    Yields:
+        str: 回答片段（增量）
+    """
+    async for delta in hedger.stream(models, history, params, question, uid,
+                                     deadline):
+        yield delta
@@ -0,0 +1,321 @@
+"""性能指标模块
+
+该模块记录每个请求各阶段的耗时，按模型统计直方图，按错误码统计错误次数，
+并通过可插拔的导出器输出（JSON Lines文件、Prometheus文本格式）。
+
+阶段：
+    sign: 获取签名URL
+    connect: DNS、TCP、TLS和Websockets握手
+    first_frame: 发送请求到收到首帧（服务端首token延迟）
+    stream: 首帧到最后一帧
+    render: 将回答转换为html（由chat_process记录）
+    total: 请求的总耗时
+
+默认不启用（recorder为None），此时start_request返回不做任何事的NULL_TRACE，
+请求路径上不会读取时钟或分配对象。
+
+Classes:
+    RequestTrace: 单个请求的耗时记录
+    Metrics: 指标汇总
+    JsonLinesExporter: 每个请求输出一行JSON
+    PrometheusExporter: 定期输出Prometheus文本格式
+
+使用示例：
+    metrics.enable([JsonLinesExporter("spans.jsonl")])
+"""
+
+import json
+import os
+import time
+
+from spark_api import config
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""tuple: 直方图的桶上界（秒）"""
+
+
+class RequestTrace:
+    """单个请求的耗时记录
+
+    通过mark记录从上一个时间点到现在的阶段耗时，finish时汇总到Metrics。
+
+    Attributes:
+        model: str 模型名称
+        phases: dict[str, float] 各阶段耗时（秒）
+        error: str | None 错误码，成功时为None
+        tokens: dict[str, int] Spark返回的token用量，"prompt"和"completion"
+    """
+    def __init__(self, recorder: "Metrics", model: str) -> None:
+        self.model = model
+        self.phases: dict[str, float] = {}
+        self.error: str | None = None
+        self.tokens: dict[str, int] = {}
+        self._recorder = recorder
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def mark(self, phase: str) -> None:
+        """记录一个阶段结束
+
+        Args:
+            phase: str 阶段名称
+        """
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def fail(self, code: int | str) -> None:
+        """记录请求失败
+
+        Args:
+            code: int | str Spark错误码，非Spark错误时为异常类名
+        """
+        self.error = str(code)
+
+    def usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        """记录Spark返回的token用量
+
+        Args:
+            prompt_tokens: int 消息记录（包含问题）的token数
+            completion_tokens: int 回答的token数
+        """
+        self.tokens = {"prompt": prompt_tokens, "completion": completion_tokens}
+
+    def finish(self) -> None:
+        """结束记录并汇总"""
+        self.phases["total"] = time.perf_counter() - self._start
+        self._recorder.record(self)
+
+
+class _NullTrace:
+    """未启用指标时使用的空记录"""
+
+    def mark(self, phase: str) -> None:
+        pass
+
+    def fail(self, code: int | str) -> None:
+        pass
+
+    def usage(self, prompt_tokens: int, completion_tokens: int) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Metrics:
+    """指标汇总
+
+    Attributes:
+        histograms: dict[tuple[str, str], list] (阶段, 模型) -> [各桶计数, 总和, 次数]
+        errors: dict[str, int] 错误码 -> 次数
+        tokens: dict[tuple[str, str], int] (模型, "prompt"/"completion") -> token数
+        exporters: list 导出器
+    """
+    def __init__(self, exporters: list | None = None) -> None:
+        self.histograms: dict[tuple[str, str], list] = {}
+        self.errors: dict[str, int] = {}
+        self.tokens: dict[tuple[str, str], int] = {}
+        self.exporters = list(exporters or [])
+
+    def observe(self, phase: str, model: str, seconds: float) -> None:
+        """记录一次阶段耗时
+
+        Args:
+            phase: str 阶段名称
+            model: str 模型名称
+            seconds: float 耗时（秒）
+        """
+        hist = self.histograms.get((phase, model))
+        if hist is None:
+            hist = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            self.histograms[(phase, model)] = hist
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        hist[0][i] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+    def record(self, trace: RequestTrace) -> None:
+        """汇总一个请求的耗时记录，并交给导出器
+
+        Args:
+            trace: RequestTrace 请求的耗时记录
+        """
+        for phase, seconds in trace.phases.items():
+            self.observe(phase, trace.model, seconds)
+        if trace.error is not None:
+            self.errors[trace.error] = self.errors.get(trace.error, 0) + 1
+        for kind, count in trace.tokens.items():
+            key = (trace.model, kind)
+            self.tokens[key] = self.tokens.get(key, 0) + count
+        for exporter in self.exporters:
+            exporter.export(trace, self)
+
+    def to_prometheus(self) -> str:
+        """输出Prometheus文本格式
+
+        Returns:
+            str: Prometheus文本格式的指标
+        """
+        lines = [
+            "# HELP spark_phase_seconds Time spent in each request phase.",
+            "# TYPE spark_phase_seconds histogram",
+        ]
+        for (phase, model), (counts, total, count) in sorted(self.histograms.items()):
+            labels = f'phase="{phase}",model="{_escape(model)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'spark_phase_seconds_bucket{{{labels},le="{bound}"}} '
+                             f"{cumulative}")
+            lines.append(f'spark_phase_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"spark_phase_seconds_sum{{{labels}}} {total}")
+            lines.append(f"spark_phase_seconds_count{{{labels}}} {count}")
+        lines.append("# HELP spark_errors_total Failed requests by Spark error code.")
+        lines.append("# TYPE spark_errors_total counter")
+        for code, count in sorted(self.errors.items()):
+            lines.append(f'spark_errors_total{{code="{_escape(code)}"}} {count}')
+        lines.append("# HELP spark_tokens_total Tokens reported in Spark usage frames.")
+        lines.append("# TYPE spark_tokens_total counter")
+        for (model, kind), count in sorted(self.tokens.items()):
+            lines.append(f'spark_tokens_total{{model="{_escape(model)}",kind="{kind}"}} '
+                         f"{count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    """转义Prometheus标签值
+
+    Args:
+        value: str 标签值
+
+    Returns:
+        str: 转义后的标签值
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class JsonLinesExporter:
+    """JSON Lines导出器，每个请求输出一行
+
+    Attributes:
+        path: str 输出文件路径
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, trace: RequestTrace, recorder: Metrics) -> None:
+        """输出一个请求的耗时记录
+
+        Args:
+            trace: RequestTrace 请求的耗时记录
+            recorder: Metrics 指标汇总
+        """
+        self._file.write(json.dumps({
+            "ts": time.time(),
+            "model": trace.model,
+            "phases": {phase: round(seconds * 1000, 3)
+                       for phase, seconds in trace.phases.items()},
+            "error": trace.error,
+            "tokens": trace.tokens,
+        }, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+
+class PrometheusExporter:
+    """Prometheus文本格式导出器
+
+    最多每interval秒把全部指标写入一次文件（先写临时文件再替换），
+    可配合node_exporter的textfile collector使用。
+
+    Attributes:
+        path: str 输出文件路径
+        interval: float 写入的最小间隔（秒）
+    """
+    def __init__(self, path: str, interval: float = 10.0) -> None:
+        self.path = path
+        self.interval = interval
+        self._written = 0.0
+
+    def export(self, trace: RequestTrace, recorder: Metrics) -> None:
+        """按间隔写入全部指标
+
+        Args:
+            trace: RequestTrace 请求的耗时记录
+            recorder: Metrics 指标汇总
+        """
+        now = time.monotonic()
+        if now - self._written >= self.interval:
+            self._written = now
+            self.write(recorder)
+
+    def write(self, recorder: Metrics) -> None:
+        """立即写入全部指标
+
+        Args:
+            recorder: Metrics 指标汇总
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(recorder.to_prometheus())
+        os.replace(tmp_path, self.path)
+
+
+recorder: Metrics | None = None
+"""Metrics | None: 当前的指标汇总，为None时不记录"""
+
+
+def enable(exporters: list | None = None) -> Metrics:
+    """启用指标记录
+
+    Args:
+        exporters: list | None 导出器
+
+    Returns:
+        Metrics: 指标汇总
+    """
+    global recorder
+    recorder = Metrics(exporters)
+    return recorder
+
+
+def enable_from_config() -> Metrics | None:
+    """按config中配置的导出路径启用指标记录，未配置任何路径时不启用
+
+    Returns:
+        Metrics | None: 指标汇总
+    """
+    exporters = []
+    if config.metrics_jsonl_path:
+        exporters.append(JsonLinesExporter(config.metrics_jsonl_path))
+    if config.metrics_prometheus_path:
+        exporters.append(PrometheusExporter(config.metrics_prometheus_path))
+    if not exporters:
+        return None
+    return enable(exporters)
+
+
+def disable() -> None:
+    """停用指标记录"""
+    global recorder
+    recorder = None
+
+
+def start_request(model: str) -> RequestTrace | _NullTrace:
+    """开始记录一个请求
+
+    Args:
+        model: str 模型名称
+
+    Returns:
+        RequestTrace | _NullTrace: 请求的耗时记录，未启用时为NULL_TRACE
+    """
+    if recorder is None:
+        return NULL_TRACE
+    return RequestTrace(recorder, model)
@@ -0,0 +1,223 @@
+"""本地模拟Spark服务模块
+
+该模块实现了一个本地的Websockets服务，按照Spark的帧协议返回流式回答，
+用于在没有API信息和网络的情况下进行测试和性能测试。
+
+支持的行为：
+    * 按status 0/1/2分帧返回回答，最后一帧附带payload.usage.text的token统计；
+    * 可配置的首帧延迟和每秒token数；
+    * 按队列或按概率返回指定的错误码；
+    * 同一uid同时连接时返回10006，超过并发上限时返回11203。
+
+Classes:
+    MockSparkServer: 模拟Spark服务
+
+使用示例：
+    async with MockSparkServer(answer="你好") as server:
+        answer = await request_chat(server.model(), history, params, "你好")
+"""
+
+import asyncio
+import json
+import random
+
+import websockets
+
+from spark_api.data_structure import ChatModel
+
+
+class MockSparkServer:
+    """模拟Spark服务
+
+    Attributes:
+        answer: str 每次请求返回的回答，为空时返回"收到：" + 问题
+        chunk_size: int 每帧包含的字符数（视为token数）
+        first_token_latency: float 收到请求到发送首帧的延迟（秒）
+        token_rate: float 每秒发送的token数，0表示不限速
+        errors: list[int] 错误码队列，每个新请求取出一个并以该错误码失败
+        error_code: int 按概率返回的错误码
+        error_rate: float 返回error_code的概率
+        max_concurrency: int 并发上限，0表示不限，超过时返回11203
+        requests: list[dict] 收到的所有请求
+        connections: int 建立过的连接数
+        peak_concurrency: int 观察到的最大并发连接数
+    """
+    def __init__(
+        self,
+        answer: str = "",
+        chunk_size: int = 4,
+        first_token_latency: float = 0.0,
+        token_rate: float = 0.0,
+        errors: list[int] | None = None,
+        error_code: int = 10110,
+        error_rate: float = 0.0,
+        max_concurrency: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.answer = answer
+        self.chunk_size = chunk_size
+        self.first_token_latency = first_token_latency
+        self.token_rate = token_rate
+        self.errors = list(errors or [])
+        self.error_code = error_code
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.host = host
+        self.port = port
+        self.requests: list[dict] = []
+        self.connections = 0
+        self.peak_concurrency = 0
+        self._active_uids: set[str] = set()
+        self._server = None
+
+    async def __aenter__(self) -> "MockSparkServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        """启动服务"""
+        self._server = await websockets.serve(self._handler, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """停止服务"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def url(self, path: str = "/v1.1/chat") -> str:
+        """获取服务地址
+
+        Args:
+            path: str 请求路径
+
+        Returns:
+            str: websockets地址
+        """
+        return f"ws://{self.host}:{self.port}{path}"
+
+    def model(self, domain: str = "lite", max_tokens: int = 4096) -> ChatModel:
+        """获取指向本服务的聊天模型
+
+        Args:
+            domain: str 模型的domain
+            max_tokens: int 模型的最大token长度
+
+        Returns:
+            ChatModel: 聊天模型
+        """
+        return ChatModel(f"Mock {domain}", self.url(), domain, max_tokens)
+
+    async def _handler(self, ws) -> None:
+        """处理一个连接
+
+        Args:
+            ws: websockets连接
+        """
+        self.connections += 1
+        try:
+            request = json.loads(await ws.recv())
+        except websockets.ConnectionClosed: # 例如预热的连接未被使用就关闭了
+            return
+        self.requests.append(request)
+        uid = request["header"]["uid"]
+        code = self._pick_error(uid)
+        if code:
+            await ws.send(json.dumps(self._frame(code)))
+            return
+
+        self._active_uids.add(uid)
+        self.peak_concurrency = max(self.peak_concurrency, len(self._active_uids))
+        try:
+            await self._stream(ws, request)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._active_uids.discard(uid)
+
+    def _pick_error(self, uid: str) -> int:
+        """决定本次请求是否以错误码失败
+
+        Args:
+            uid: str 请求的用户id
+
+        Returns:
+            int: 错误码，0表示不失败
+        """
+        if uid in self._active_uids:
+            return 10006
+        if self.max_concurrency and len(self._active_uids) >= self.max_concurrency:
+            return 11203
+        if self.errors:
+            return self.errors.pop(0)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_code
+        return 0
+
+    async def _stream(self, ws, request: dict) -> None:
+        """按帧发送回答
+
+        Args:
+            ws: websockets连接
+            request: dict 请求
+        """
+        messages = request["payload"]["message"]["text"]
+        answer = self.answer or f"收到：{messages[-1]['content']}"
+        chunks = [answer[i:i + self.chunk_size]
+                  for i in range(0, len(answer), self.chunk_size)] or [""]
+        interval = self.chunk_size / self.token_rate if self.token_rate else 0
+
+        try: # 等待首帧延迟，期间客户端关闭连接则直接结束
+            await asyncio.wait_for(ws.wait_closed(), self.first_token_latency)
+            return
+        except asyncio.TimeoutError:
+            pass
+        for seq, chunk in enumerate(chunks):
+            if seq == len(chunks) - 1:
+                status = 2
+            else:
+                status = 0 if seq == 0 else 1
+            frame = self._frame(0, status, seq, chunk)
+            if status == 2:
+                prompt_tokens = sum(len(msg["content"]) for msg in messages)
+                frame["payload"]["usage"] = {"text": {
+                    "question_tokens": len(messages[-1]["content"]),
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(answer),
+                    "total_tokens": prompt_tokens + len(answer),
+                }}
+            await ws.send(json.dumps(frame, ensure_ascii=False))
+            if interval and status != 2:
+                await asyncio.sleep(interval)
+        await ws.wait_closed()
+
+    @staticmethod
+    def _frame(code: int, status: int = 2, seq: int = 0, content: str = "") -> dict:
+        """生成一帧
+
+        Args:
+            code: int 错误码，0表示成功
+            status: int 帧状态，0首帧、1中间帧、2最后一帧
+            seq: int 帧序号
+            content: str 回答片段
+
+        Returns:
+            dict: 帧
+        """
+        header = {"code": code, "message": "Success" if code == 0 else "Error",
+                  "sid": "mock", "status": status}
+        if code != 0:
+            return {"header": header}
+        return {
+            "header": header,
+            "payload": {"choices": {
+                "status": status,
+                "seq": seq,
+                "text": [{"content": content, "role": "assistant", "index": 0}],
+            }},
+        }
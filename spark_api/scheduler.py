@@ -0,0 +1,456 @@
+"""请求调度模块
+
+该模块根据SparkAPI返回的错误码调度请求：
+
+* 10008/10110/10222：服务端暂时不可用，按指数退避（带随机抖动）重试；
+* 11202/11203：秒级/并发流控超限，降低令牌桶速率或并发上限后退避重试，
+  之后随着请求成功逐步恢复到授权的QPS和并发数；
+* 11201：日流控超限，熔断到次日零点，期间的请求直接失败而不再消耗配额。
+
+配置了多组API信息时，请求由CredentialPool分配给当前负载最低的一组，
+11202/11203只让对应的一组暂停分配一小段时间，11201只隔离对应的一组，
+所有组都被隔离后才熔断。
+
+Classes:
+    TokenBucket: 令牌桶，限制每秒请求数
+    ConcurrencyLimiter: 可动态调整上限的并发限制器
+    CircuitBreaker: 日流控熔断器
+    Credential: 一组API信息及其负载和流控状态
+    CredentialPool: API信息池
+    RequestScheduler: 请求调度器
+
+Functions:
+    remaining_time: 计算距离截止时间的剩余时长
+    wait_with_deadline: 在截止时间之前等待
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, AsyncIterator, Callable, TypeVar
+
+from spark_api import config
+from spark_api.errors import (
+    SparkApiError,
+    DAILY_LIMIT_CODES,
+    RATE_LIMIT_CODES
+)
+
+T = TypeVar("T")
+
+
+def remaining_time(deadline: float | None) -> float | None:
+    """计算距离截止时间的剩余时长
+
+    Args:
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+    Returns:
+        float | None: 剩余时长（秒），不限时时为None
+
+    Raises:
+        TimeoutError: 已经超过截止时间
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("SparkAPI请求超时")
+    return remaining
+
+
+async def wait_with_deadline(awaitable: Awaitable[T], deadline: float | None) -> T:
+    """在截止时间之前等待，用于排队、取令牌和退避等请求发出前的等待
+
+    Args:
+        awaitable: Awaitable[T] 等待的对象，超时时被取消
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+    Returns:
+        T: awaitable的结果
+
+    Raises:
+        TimeoutError: 超过截止时间
+    """
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, remaining_time(deadline))
+    except TimeoutError:
+        raise TimeoutError("SparkAPI请求超时") from None
+
+
+class TokenBucket:
+    """令牌桶
+
+    Attributes:
+        max_rate: float 授权的每秒请求数
+        rate: float 当前的每秒请求数，流控超限时降低，请求成功时逐步恢复
+        capacity: float 桶的容量（允许的突发请求数）
+    """
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        """按经过的时间补充令牌"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """取得一个令牌，没有令牌时等待"""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def throttle(self) -> None:
+        """流控超限，速率减半（不低于授权速率的十分之一）"""
+        self.rate = max(self.max_rate / 10, self.rate / 2)
+
+    def recover(self) -> None:
+        """请求成功，速率增加授权速率的十分之一（不超过授权速率）"""
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class ConcurrencyLimiter:
+    """并发限制器
+
+    与asyncio.Semaphore类似，但上限可以在运行中调整。
+
+    Attributes:
+        max_limit: int 授权的并发数
+        limit: int 当前的并发上限
+        in_flight: int 正在进行的请求数
+    """
+    def __init__(self, limit: int) -> None:
+        self.max_limit = limit
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        """占用一个并发名额，没有名额时等待"""
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake() # 已被唤醒但被取消，把名额让给下一个等待者
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self) -> None:
+        """释放一个并发名额"""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """唤醒与空闲名额数量相同的等待者"""
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def throttle(self) -> None:
+        """并发超限，上限减一（不低于1）"""
+        self.limit = max(1, self.limit - 1)
+
+    def recover(self) -> None:
+        """请求成功，上限加一（不超过授权并发数）"""
+        if self.limit < self.max_limit:
+            self.limit += 1
+            self._wake()
+
+
+class CircuitBreaker:
+    """日流控熔断器
+
+    收到11201后熔断到次日零点（本地时间），期间的请求直接失败。
+
+    Attributes:
+        open_until: float 熔断结束的时间戳，0表示未熔断
+    """
+    def __init__(self) -> None:
+        self.open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        """bool: 是否处于熔断状态"""
+        return time.time() < self.open_until
+
+    def trip(self) -> None:
+        """熔断到次日零点"""
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        self.open_until = datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    def check(self) -> None:
+        """检查是否处于熔断状态
+
+        Raises:
+            SparkApiError: 处于熔断状态，错误码为11201
+        """
+        if self.is_open:
+            raise SparkApiError(11201)
+
+
+class Credential:
+    """一组API信息
+
+    Attributes:
+        app_id: str APPID
+        api_key: str APIKey
+        api_secret: str APISecret
+        qps: float 该组授权的每秒请求数
+        max_concurrency: int 该组授权的并发数
+        in_flight: int 正在使用该组的请求数
+        rate_limited: int 该组收到11202/11203的次数
+        cooldown_until: float 流控超限后暂停分配到的时间（time.monotonic()）
+        breaker: CircuitBreaker 该组的日流控隔离
+    """
+    def __init__(
+        self,
+        app_id: str,
+        api_key: str,
+        api_secret: str,
+        qps: float | None = None,
+        max_concurrency: int | None = None,
+    ) -> None:
+        self.app_id = app_id
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.qps = qps or config.qps
+        self.max_concurrency = max_concurrency or config.max_concurrency
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+        self.breaker = CircuitBreaker()
+
+    @property
+    def load(self) -> float:
+        """float: 负载，正在进行的请求数与并发上限之比"""
+        return self.in_flight / self.max_concurrency
+
+
+class CredentialPool:
+    """API信息池
+
+    Attributes:
+        credentials: list[Credential] 所有API信息
+        cooldown: float 流控超限后暂停分配的时长（秒）
+    """
+    def __init__(
+        self,
+        credentials: list[Credential],
+        cooldown: float | None = None,
+    ) -> None:
+        if not credentials:
+            raise ValueError("credentials must not be empty")
+        self.credentials = list(credentials)
+        self.cooldown = config.credential_cooldown if cooldown is None else cooldown
+
+    @classmethod
+    def from_config(cls) -> "CredentialPool":
+        """按config中的app_id、api_key、api_secret和credentials创建
+
+        Returns:
+            CredentialPool: API信息池
+        """
+        credentials = [Credential(config.app_id, config.api_key, config.api_secret)]
+        credentials += [Credential(**item) for item in config.credentials]
+        return cls(credentials)
+
+    @property
+    def qps(self) -> float:
+        """float: 所有组授权的每秒请求数之和"""
+        return sum(credential.qps for credential in self.credentials)
+
+    @property
+    def max_concurrency(self) -> int:
+        """int: 所有组授权的并发数之和"""
+        return sum(credential.max_concurrency for credential in self.credentials)
+
+    @property
+    def available(self) -> bool:
+        """bool: 是否还有未被日流控隔离的API信息"""
+        return any(not credential.breaker.is_open
+                   for credential in self.credentials)
+
+    def acquire(self) -> Credential:
+        """为一个请求分配API信息
+
+        在未被隔离的API信息中，优先选择不在流控暂停期内的，再选择负载最低的。
+
+        Returns:
+            Credential: 分配的API信息，请求结束后需要调用release
+
+        Raises:
+            SparkApiError: 所有API信息都被日流控隔离，错误码为11201
+        """
+        now = time.monotonic()
+        candidates = [credential for credential in self.credentials
+                      if not credential.breaker.is_open]
+        if not candidates:
+            raise SparkApiError(11201)
+        credential = min(candidates, key=lambda c: (c.cooldown_until > now, c.load))
+        credential.in_flight += 1
+        return credential
+
+    def release(self, credential: Credential) -> None:
+        """请求结束，释放分配的API信息
+
+        Args:
+            credential: Credential 分配的API信息
+        """
+        credential.in_flight -= 1
+
+    def report(self, credential: Credential, code: int) -> None:
+        """记录使用某组API信息的请求返回的错误码
+
+        Args:
+            credential: Credential 请求使用的API信息
+            code: int 错误码
+        """
+        if code in RATE_LIMIT_CODES:
+            credential.rate_limited += 1
+            credential.cooldown_until = time.monotonic() + self.cooldown
+        elif code in DAILY_LIMIT_CODES:
+            credential.breaker.trip()
+
+
+class RequestScheduler:
+    """请求调度器
+
+    对每次请求依次检查熔断器、取得令牌和并发名额，然后执行请求；
+    请求在产出第一个回答片段之前失败且错误可以重试时，退避后重新请求。
+    指定截止时间时，取令牌和并发名额的等待也计入请求时长，退避后会超过截止时间的重试不再进行。
+
+    Attributes:
+        max_retries: int 最大重试次数
+        base_delay: float 退避的基础时长（秒）
+        max_delay: float 退避的最大时长（秒）
+        bucket: TokenBucket 令牌桶
+        limiter: ConcurrencyLimiter 并发限制器
+        breaker: CircuitBreaker 日流控熔断器
+        credentials: CredentialPool | None 请求使用的API信息池，
+            指定时某一组日流控超限后改用其他组重试，所有组都被隔离后才熔断
+    """
+    def __init__(
+        self,
+        max_retries: int | None = None,
+        base_delay: float | None = None,
+        max_delay: float | None = None,
+        qps: float | None = None,
+        max_concurrency: int | None = None,
+        credentials: CredentialPool | None = None,
+    ) -> None:
+        self.max_retries = (config.max_retries
+                            if max_retries is None else max_retries)
+        self.base_delay = (config.retry_base_delay
+                           if base_delay is None else base_delay)
+        self.max_delay = config.retry_max_delay if max_delay is None else max_delay
+        self.bucket = TokenBucket(qps or config.qps)
+        self.limiter = ConcurrencyLimiter(max_concurrency
+                                          or config.max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.credentials = credentials
+
+    def backoff(self, attempt: int) -> float:
+        """计算第attempt次重试前的等待时长（full jitter）
+
+        Args:
+            attempt: int 重试次数，从0开始
+
+        Returns:
+            float: 等待时长（秒）
+        """
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+    def _on_error(self, code: int) -> None:
+        """根据错误码调整流控状态
+
+        Args:
+            code: int 错误码
+        """
+        if code == 11202:
+            self.bucket.throttle()
+        elif code == 11203:
+            self.limiter.throttle()
+        elif code in DAILY_LIMIT_CODES and not self._can_switch_credential():
+            self.breaker.trip()
+
+    def _can_switch_credential(self) -> bool:
+        """是否还能改用其他API信息
+
+        Returns:
+            bool: 指定了API信息池且池中还有未被隔离的API信息
+        """
+        return self.credentials is not None and self.credentials.available
+
+    def _on_success(self) -> None:
+        """请求成功，逐步恢复速率和并发上限"""
+        self.bucket.recover()
+        self.limiter.recover()
+
+    async def stream(
+        self,
+        request: Callable[[], AsyncIterator[str]],
+        deadline: float | None = None,
+    ) -> AsyncIterator[str]:
+        """调度一次流式请求
+
+        Args:
+            request: Callable[[], AsyncIterator[str]] 每次调用发起一次新的流式请求
+            deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+        Yields:
+            str: 回答片段（增量）
+
+        Raises:
+            SparkApiError: 错误不可重试、重试次数用尽、已经产出过回答片段或退避后会超过截止时间
+            TimeoutError: 等待令牌或并发名额时超过截止时间
+        """
+        attempt = 0
+        while True:
+            self.breaker.check()
+            await wait_with_deadline(self.bucket.acquire(), deadline)
+            await wait_with_deadline(self.limiter.acquire(), deadline)
+            started = False
+            try:
+                async for delta in request():
+                    started = True
+                    yield delta
+            except SparkApiError as e:
+                self._on_error(e.code)
+                retryable = e.retryable or (e.code in DAILY_LIMIT_CODES
+                                            and self._can_switch_credential())
+                if started or not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise # 退避之后已超过截止时间，不再重试
+            else:
+                self._on_success()
+                return
+            finally:
+                self.limiter.release()
+
+            await asyncio.sleep(delay)
+            attempt += 1
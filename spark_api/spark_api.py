@@ -1,13 +1,13 @@
 import base64
 import hashlib
 import hmac
-import json
 from datetime import datetime
-from time import mktime
+from functools import partial
+from time import mktime, monotonic
+from typing import TYPE_CHECKING, AsyncIterator
 from urllib.parse import urlencode, urlparse
 from wsgiref.handlers import format_date_time
 
-import websockets
 import asyncio
 
 from spark_api.data_structure import(
@@ -15,6 +15,13 @@ from spark_api.data_structure import(
     ChatHistory,
     ChatParams
 )
+from spark_api import config
+from spark_api import fastjson
+from spark_api import metrics
+from spark_api import tokens
+from spark_api.cache import ResponseCache
+from spark_api.errors import SparkApiError
+from spark_api.scheduler import Credential, CredentialPool, RequestScheduler, remaining_time
 from spark_api.config import(
     app_id, api_secret, api_key # API信息
 )
@@ -23,12 +30,16 @@ from spark_api.data import (
     chat_history
 )
 
+if TYPE_CHECKING:
+    import websockets
 
-def generate_url(url)->str:
+
+def generate_url(url, credential: Credential | None = None)->str:
     """生成带签名的URL
 
     Args:
         url: str 模型的websockets请求地址
+        credential: Credential | None 签名使用的API信息，为None时使用config中的API信息
 
     Returns:
         str: 带签名的URL
@@ -55,8 +66,10 @@ def generate_url(url)->str:
                 digestmod=hashlib.sha256,
             ).digest()
         ).decode(encoding="utf-8")
-    signature = b64_sha256(api_secret, signature_origin)
-    auth_origin = f'api_key="{api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature}"'
+    key, secret = ((credential.api_key, credential.api_secret) if credential
+                   else (api_key, api_secret))
+    signature = b64_sha256(secret, signature_origin)
+    auth_origin = f'api_key="{key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature}"'
     auth = base64.b64encode(auth_origin.encode("utf-8")).decode("utf-8")
 
     # 将请求的鉴权参数组合为字典
@@ -66,19 +79,236 @@ def generate_url(url)->str:
 
     return url
 
-def gen_params(model: ChatModel, history: ChatHistory, params: ChatParams)->dict:
+
+class SignedUrlCache:
+    """签名URL缓存类
+
+    按(APIKey, host, path)缓存generate_url生成的签名URL，在ttl内复用同一个签名；
+    当签名距离过期不足refresh_ahead秒时，返回旧签名并在事件循环中后台刷新，
+    使请求路径上几乎不再有签名计算。
+
+    Attributes:
+        ttl: float 签名URL的复用时长（秒）
+        refresh_ahead: float 提前刷新的时长（秒）
+    """
+    def __init__(
+        self,
+        ttl: float | None = None,
+        refresh_ahead: float | None = None,
+    ) -> None:
+        self.ttl = config.url_sign_ttl if ttl is None else ttl
+        self.refresh_ahead = (config.url_refresh_ahead
+                              if refresh_ahead is None else refresh_ahead)
+        self._entries: dict[tuple[str, str, str], tuple[str, float]] = {}
+        self._refreshing: set[tuple[str, str, str]] = set()
+
+    def get(self, url: str, credential: Credential | None = None) -> str:
+        """获取带签名的URL
+
+        Args:
+            url: str 模型的websockets请求地址
+            credential: Credential | None 签名使用的API信息，为None时使用config中的API信息
+
+        Returns:
+            str: 带签名的URL
+        """
+        parsed_url = urlparse(url)
+        key = (credential.api_key if credential else api_key,
+               parsed_url.netloc, parsed_url.path)
+        entry = self._entries.get(key)
+        now = monotonic()
+        if entry is None or now >= entry[1]:
+            return self._refresh(key, url, credential)
+
+        if now >= entry[1] - self.refresh_ahead and key not in self._refreshing:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return self._refresh(key, url, credential)
+            self._refreshing.add(key)
+            loop.call_soon(self._refresh, key, url, credential)
+        return entry[0]
+
+    def invalidate(self) -> None:
+        """清空缓存，例如在更换API信息之后"""
+        self._entries.clear()
+
+    def _refresh(
+        self,
+        key: tuple[str, str, str],
+        url: str,
+        credential: Credential | None,
+    ) -> str:
+        """重新签名并写入缓存
+
+        Args:
+            key: tuple[str, str, str] 缓存键(APIKey, host, path)
+            url: str 模型的websockets请求地址
+            credential: Credential | None 签名使用的API信息
+
+        Returns:
+            str: 新的带签名的URL
+        """
+        self._refreshing.discard(key)
+        signed_url = generate_url(url, credential)
+        self._entries[key] = (signed_url, monotonic() + self.ttl)
+        return signed_url
+
+
+url_cache = SignedUrlCache()
+"""SignedUrlCache: 默认的签名URL缓存"""
+
+
+class ConnectionPrewarmer:
+    """连接预热类
+
+    在用户发送之前（例如切换模型或开始输入时）提前完成签名、DNS解析、TCP/TLS握手和Websockets升级，
+    为每个请求地址保留一个已就绪的连接，connect_ws取用后只需写入请求。
+    预热的连接占用一个API信息的并发名额，超过ttl仍未被取用时关闭并归还名额。
+
+    Attributes:
+        ttl: float 预热连接的保留时长（秒），不大于0时不预热
+    """
+    def __init__(self, ttl: float | None = None) -> None:
+        self.ttl = config.prewarm_ttl if ttl is None else ttl
+        self._ready: dict[str, tuple["websockets.WebSocketClientProtocol",
+                                     Credential, asyncio.TimerHandle]] = {}
+        self._pending: dict[str, asyncio.Task] = {}
+
+    def warm(self, url: str) -> asyncio.Task | None:
+        """在后台为请求地址建立一个连接，已有就绪或正在建立的连接时什么也不做
+
+        Args:
+            url: str 模型的websockets请求地址
+
+        Returns:
+            asyncio.Task | None: 建立连接的任务，没有发起预热时为None
+        """
+        if self.ttl <= 0 or url in self._ready or url in self._pending:
+            return None
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        task = loop.create_task(self._open(url))
+        self._pending[url] = task
+        task.add_done_callback(lambda _: self._pending.pop(url, None))
+        return task
+
+    def take(self, url: str) -> tuple["websockets.WebSocketClientProtocol",
+                                      Credential] | None:
+        """取用请求地址的预热连接
+
+        Args:
+            url: str 模型的websockets请求地址
+
+        Returns:
+            tuple[WebSocketClientProtocol, Credential] | None: 连接和签名使用的API信息，
+                API信息的名额由取用方在请求结束后release；没有可用的连接时为None
+        """
+        entry = self._ready.pop(url, None)
+        if entry is None:
+            return None
+        ws, credential, handle = entry
+        handle.cancel()
+        if not ws.open: # 服务端已关闭空闲连接
+            self._discard(ws, credential)
+            return None
+        return ws, credential
+
+    async def close(self) -> None:
+        """取消正在建立的连接，关闭所有预热连接"""
+        for task in list(self._pending.values()):
+            task.cancel()
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+        for url in list(self._ready):
+            ws, credential, handle = self._ready.pop(url)
+            handle.cancel()
+            credential_pool.release(credential)
+            await ws.close()
+
+    async def _open(self, url: str) -> None:
+        """建立连接并保留ttl秒，失败时放弃预热
+
+        Args:
+            url: str 模型的websockets请求地址
+        """
+        import websockets
+
+        try:
+            credential = credential_pool.acquire()
+        except SparkApiError:
+            return
+        try:
+            ws = await websockets.connect(url_cache.get(url, credential),
+                                          open_timeout=10.0)
+        except BaseException as e:
+            credential_pool.release(credential)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        handle = asyncio.get_running_loop().call_later(self.ttl, self._expire, url)
+        self._ready[url] = (ws, credential, handle)
+
+    def _expire(self, url: str) -> None:
+        """关闭超过ttl仍未被取用的连接
+
+        Args:
+            url: str 模型的websockets请求地址
+        """
+        entry = self._ready.pop(url, None)
+        if entry is not None:
+            self._discard(entry[0], entry[1])
+
+    @staticmethod
+    def _discard(
+        ws: "websockets.WebSocketClientProtocol",
+        credential: Credential,
+    ) -> None:
+        """在后台关闭连接并归还API信息的名额
+
+        Args:
+            ws: websockets.WebSocketClientProtocol 连接
+            credential: Credential 签名使用的API信息
+        """
+        credential_pool.release(credential)
+        asyncio.ensure_future(ws.close())
+
+
+prewarmer = ConnectionPrewarmer()
+"""ConnectionPrewarmer: 默认的连接预热实例"""
+
+credential_pool = CredentialPool.from_config()
+"""CredentialPool: 默认的API信息池"""
+
+scheduler = RequestScheduler(qps=credential_pool.qps,
+                             max_concurrency=credential_pool.max_concurrency,
+                             credentials=credential_pool)
+"""RequestScheduler: 默认的请求调度器，负责重试、流控和熔断"""
+
+
+def gen_params(
+    model: ChatModel,
+    history: ChatHistory,
+    params: ChatParams,
+    uid: str | None = None,
+    credential: Credential | None = None,
+)->dict:
     """生成请求参数
 
     Args:
         model: ChatModel 模型
         history: ChatHistory 消息记录
         params: ChatParams 请求参数
+        uid: str | None 用户id，同一uid不能同时建立多个连接；为None时使用config.uid
+        credential: Credential | None 请求使用的API信息，为None时使用config中的app_id
 
     Returns:
         dict: 请求参数
     """
     return {
-        "header": {"app_id": app_id, "uid": "CCLMSY"},
+        "header": {"app_id": credential.app_id if credential else app_id,
+                   "uid": uid or config.uid},
         "parameter": {
             "chat": {
                 "domain": model.domain,
@@ -91,64 +321,245 @@ def gen_params(model: ChatModel, history: ChatHistory, params: ChatParams)->dict
     }
 
 
-answer: str = "" # 机器人回答，应对流式响应
+def encode_params(
+    model: ChatModel,
+    history: ChatHistory,
+    params: ChatParams,
+    uid: str | None = None,
+    credential: Credential | None = None,
+)->str:
+    """生成编码后的请求参数
+
+    与fastjson.dumps(gen_params(...))的结果相同，但消息记录部分直接拼接ChatHistory缓存的JSON片段，
+    编码的开销只与新增的消息有关，与消息记录的长度无关。
+
+    Args:
+        model: ChatModel 模型
+        history: ChatHistory 消息记录
+        params: ChatParams 请求参数
+        uid: str | None 用户id，为None时使用config.uid
+        credential: Credential | None 请求使用的API信息，为None时使用config中的app_id
+
+    Returns:
+        str: 请求参数的JSON字符串
+    """
+    head = fastjson.dumps({
+        "header": {"app_id": credential.app_id if credential else app_id,
+                   "uid": uid or config.uid},
+        "parameter": {
+            "chat": {
+                "domain": model.domain,
+                "max_tokens": model.max_tokens,
+                "temperature": params.temperature,
+                "top_k": params.top_k
+            }
+        },
+    })
+    return history.encoded_messages(head[:-1] + ',"payload":{"message":{"text":',
+                                    "}}}")
 
 
 async def on_message(
-    ws: websockets.WebSocketClientProtocol,
+    ws: "websockets.WebSocketClientProtocol",
     message: str | bytes,
-)->None:
+    usage: dict | None = None,
+)->str:
     """处理Websockets接收到的消息
 
-    处理Websockets接收到的消息，将流式回复拼接为完整回复，存储在全局变量answer中。
+    解析一帧流式回复，返回本帧新增的回答片段；收到最后一帧时关闭连接。
 
     Args:
         ws: websockets.WebSocketClientProtocol websocket连接
         message: str | bytes 收到的Websockets消息
-    
+        usage: dict | None 不为None时，写入最后一帧中的payload.usage.text（token用量）
+
+    Returns:
+        str: 本帧新增的回答片段
+
     Raises:
-        Exception: SparkAPI请求错误
+        SparkApiError: SparkAPI请求错误
     """
-    msg = json.loads(message)
+    msg = fastjson.loads(message)
     code = msg["header"]["code"]
 
     if code != 0:
         await ws.close()
-        raise Exception(f"SparkAPI请求错误: Code:'{code}', Message:'{msg}'")
-    
+        raise SparkApiError(code, msg)
+
     choices = msg["payload"]["choices"]
     status = choices["status"]
     content = choices["text"][0]["content"]
 
-    global answer
-    if status == 0: # 收到首个消息，清空answer
-        answer = ""
-    answer += content
     if status == 2: # 收到最后一个消息，关闭连接
+        if usage is not None and "usage" in msg["payload"]:
+            usage.update(msg["payload"]["usage"]["text"])
         await ws.close()
+    return content
+
+
+async def _receive_frames(
+    ws: "websockets.WebSocketClientProtocol",
+    deadline: float | None,
+)->AsyncIterator[str | bytes]:
+    """逐帧接收Websockets消息，超过截止时间时抛出TimeoutError
+
+    Args:
+        ws: websockets.WebSocketClientProtocol websocket连接
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+    Yields:
+        str | bytes: 收到的Websockets消息
+    """
+    import websockets
+
+    if deadline is None:
+        async for message in ws:
+            yield message
+        return
+
+    while True:
+        try:
+            message = await asyncio.wait_for(ws.recv(), remaining_time(deadline))
+        except websockets.ConnectionClosedOK:
+            return
+        yield message
 
 
 async def connect_ws(
     model: ChatModel,
     history: ChatHistory,
     params: ChatParams,
-)->None:
+    uid: str | None = None,
+    deadline: float | None = None,
+)->AsyncIterator[str]:
     """连接到Websockets
 
-    连接到Websockets，发送请求，接收回复并处理。
+    连接到Websockets，发送请求，随着流式回复的到达逐帧产出回答片段。
+    有预热连接时直接在其上发送请求，否则使用credential_pool分配的API信息建立连接；
+    返回的流控错误码记录到对应的API信息上。
+    启用metrics时记录签名、握手、首帧和流式接收各阶段的耗时。
+    最后一帧中的token用量用于校准tokens.estimator。
+    超过截止时间、或调用方取消/关闭生成器时，连接随之关闭。
 
     Args:
         model: ChatModel 模型
         history: ChatHistory 消息记录
         params: ChatParams 请求参数
+        uid: str | None 用户id
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
+
+    Yields:
+        str: 每一帧新增的回答片段
+
+    Raises:
+        TimeoutError: 超过截止时间
     """
-    ws_url = generate_url(model.url)
-    async with websockets.connect(ws_url) as ws:
-        send_message = json.dumps(gen_params(model, history, params))
-        await ws.send(send_message)
-        async for message in ws:
-            await on_message(ws, message)
+    import websockets # 延迟导入，只构造请求或读写消息记录的进程不必加载websockets
+
+    trace = metrics.start_request(model.name)
+    credential = None
+    try:
+        warm = prewarmer.take(model.url)
+        if warm is not None:
+            ws, credential = warm
+            trace.mark("sign")
+        else:
+            credential = credential_pool.acquire()
+            ws_url = url_cache.get(model.url, credential)
+            trace.mark("sign")
+            open_timeout = min(10.0, remaining_time(deadline) or 10.0)
+            ws = await websockets.connect(ws_url, open_timeout=open_timeout)
+        try:
+            trace.mark("connect")
+            send_message = encode_params(model, history, params, uid, credential)
+            prompt_raw = history.total_len
+            await ws.send(send_message)
+            first_frame = True
+            usage = {}
+            async for message in _receive_frames(ws, deadline):
+                delta = await on_message(ws, message, usage)
+                if first_frame:
+                    trace.mark("first_frame")
+                    first_frame = False
+                if delta:
+                    yield delta
+            trace.mark("stream")
+            if usage:
+                tokens.estimator.observe(model.name, prompt_raw, usage)
+                trace.usage(usage.get("prompt_tokens", 0),
+                            usage.get("completion_tokens", 0))
+        finally:
+            await ws.close()
+    except SparkApiError as e:
+        trace.fail(e.code)
+        if credential is not None:
+            credential_pool.report(credential, e.code)
+        raise
+    except asyncio.CancelledError:
+        trace.fail("cancelled")
+        raise
+    except Exception as e:
+        trace.fail(type(e).__name__)
+        raise
+    finally:
+        if credential is not None:
+            credential_pool.release(credential)
+        trace.finish()
+
+
+async def stream_chat(
+    model: ChatModel,
+    history: ChatHistory,
+    params: ChatParams,
+    question: str,
+    uid: str | None = None,
+    cache: ResponseCache | None = None,
+    deadline: float | None = None,
+)->AsyncIterator[str]:
+    """流式请求聊天
+
+    将用户问题发送给机器人，随着回复的到达逐段产出回答片段，
+    回复结束后将完整回答写入消息记录。请求经由scheduler调度重试和流控。
+    发送前按model.context_tokens修剪消息记录，避免超过token上限（10907）。
+    指定缓存且命中时不发送请求，直接重放缓存的回答片段。
+    请求失败、超时或被取消时，撤销消息记录中尚未得到回答的问题。
+
+    Args:
+        model: ChatModel 模型
+        history: ChatHistory 消息记录
+        params: ChatParams 请求参数
+        question: str 用户问题
+        uid: str | None 用户id
+        cache: ResponseCache | None 回答缓存，为None时不使用缓存
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
 
+    Yields:
+        str: 回答片段（增量）
+    """
+    history.append_message("user", question)
+    history.trim_message(model.context_tokens)
+    try:
+        key = None
+        parts = None
+        if cache is not None:
+            key = cache.make_key(model, params, history)
+            parts = cache.get(key)
+            if parts is not None:
+                for delta in parts:
+                    yield delta
+
+        if parts is None:
+            parts = []
+            request = partial(connect_ws, model, history, params, uid, deadline)
+            async for delta in scheduler.stream(request, deadline):
+                parts.append(delta)
+                yield delta
+            if cache is not None:
+                cache.put(key, parts)
+    except BaseException:
+        history.pop_message()
+        raise
+    history.append_message("assistant", "".join(parts))
 
 
 async def request_chat(
@@ -156,6 +567,9 @@ async def request_chat(
     history: ChatHistory,
     params: ChatParams,
     question: str,
+    uid: str | None = None,
+    cache: ResponseCache | None = None,
+    deadline: float | None = None,
 )->str:
     """请求聊天
 
@@ -166,15 +580,18 @@ async def request_chat(
         history: ChatHistory 消息记录
         params: ChatParams 请求参数
         question: str 用户问题
+        uid: str | None 用户id
+        cache: ResponseCache | None 回答缓存，为None时不使用缓存
+        deadline: float | None 截止时间（time.monotonic()），为None时不限时
 
     Returns:
         str: 机器人回答
     """
-    global answer
-    history.append_message("user", question)
-    await connect_ws(model, history, params)
-    history.append_message("assistant", answer)
-    return answer
+    parts = []
+    async for delta in stream_chat(model, history, params, question, uid,
+                                   cache, deadline):
+        parts.append(delta)
+    return "".join(parts)
 
 
 # 测试
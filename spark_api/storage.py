@@ -0,0 +1,233 @@
+"""消息存储模块
+
+该模块为ChatHistory提供可插拔的持久化存储后端。存储只负责按顺序追加和按下标读取消息，
+ChatHistory只把修剪后的上下文窗口保存在内存中，更早的消息按需从存储中分页读取。
+
+Classes:
+    HistoryStore: 存储后端基类
+    JsonlHistoryStore: 追加写的JSONL日志 + 偏移量索引
+    SqliteHistoryStore: SQLite数据库，一个数据库文件可以保存多个对话
+
+Functions:
+    open_store: 根据文件后缀打开对应的存储后端
+"""
+
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from array import array
+
+
+class HistoryStore(ABC):
+    """存储后端基类
+
+    消息按追加顺序从0开始编号，append和按下标读取都应当是O(1)（与总消息数无关）的操作。
+    子类必须实现全部抽象方法，否则无法实例化。
+    """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """存储中的消息数"""
+
+    @abstractmethod
+    def append(self, msg: dict) -> None:
+        """追加一条消息
+
+        Args:
+            msg: dict 消息，包含"role"和"content"
+        """
+
+    @abstractmethod
+    def read(self, start: int, stop: int) -> list[dict]:
+        """读取下标在[start, stop)之间的消息
+
+        Args:
+            start: int 起始下标
+            stop: int 结束下标（不包含）
+
+        Returns:
+            list[dict]: 消息列表
+        """
+
+    @abstractmethod
+    def truncate(self, length: int) -> None:
+        """只保留前length条消息，用于撤销最近追加的消息
+
+        Args:
+            length: int 保留的消息数
+        """
+
+    def close(self) -> None:
+        """关闭存储"""
+
+
+class JsonlHistoryStore(HistoryStore):
+    """JSONL日志存储
+
+    消息以一行一条JSON的形式追加到日志文件中，同时在path + ".idx"中
+    以8字节无符号整数记录每条消息在日志中的偏移量，读取任意一段消息只需一次seek。
+    打开时若索引落后于日志（例如写入途中进程退出），会从最后一条已索引的消息之后重建索引，
+    并丢弃日志末尾不完整的一行。
+
+    Attributes:
+        path: str 日志文件路径
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._log = open(path, "a+b")
+        self._offsets = array("Q")
+        index_path = path + ".idx"
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                data = f.read()
+            self._offsets.frombytes(data[:len(data) // 8 * 8])
+        if self._recover():
+            with open(index_path, "wb") as f:
+                self._offsets.tofile(f)
+        self._index = open(index_path, "ab")
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _recover(self) -> bool:
+        """使索引与日志保持一致
+
+        Returns:
+            bool: 索引是否被修改
+        """
+        self._log.seek(0, os.SEEK_END)
+        end = self._log.tell()
+        changed = False
+        while self._offsets and self._offsets[-1] >= end:
+            self._offsets.pop()
+            changed = True
+
+        pos = 0
+        if self._offsets:
+            self._log.seek(self._offsets[-1])
+            self._log.readline()
+            pos = self._log.tell()
+        self._log.seek(pos)
+        for line in self._log:
+            if not line.endswith(b"\n"):
+                self._log.truncate(pos)
+                break
+            self._offsets.append(pos)
+            pos += len(line)
+            changed = True
+        return changed
+
+    def append(self, msg: dict) -> None:
+        line = json.dumps(msg, ensure_ascii=False).encode("utf-8") + b"\n"
+        self._log.seek(0, os.SEEK_END)
+        offset = self._log.tell()
+        self._log.write(line)
+        self._log.flush()
+        self._offsets.append(offset)
+        self._index.write(offset.to_bytes(8, "little"))
+        self._index.flush()
+
+    def read(self, start: int, stop: int) -> list[dict]:
+        start = max(start, 0)
+        stop = min(stop, len(self._offsets))
+        if start >= stop:
+            return []
+        self._log.seek(self._offsets[start])
+        if stop < len(self._offsets):
+            data = self._log.read(self._offsets[stop] - self._offsets[start])
+        else:
+            data = self._log.read()
+        return [json.loads(line) for line in data.splitlines()]
+
+    def truncate(self, length: int) -> None:
+        if length >= len(self._offsets):
+            return
+        self._log.truncate(self._offsets[length])
+        self._log.flush()
+        del self._offsets[length:]
+        self._index.truncate(length * 8)
+        self._index.flush()
+
+    def close(self) -> None:
+        self._log.close()
+        self._index.close()
+
+
+class SqliteHistoryStore(HistoryStore):
+    """SQLite存储
+
+    所有对话保存在同一个数据库的messages表中，以(conversation, seq)为主键。
+
+    Attributes:
+        path: str 数据库文件路径
+        conversation: str 对话id
+    """
+
+    def __init__(self, path: str, conversation: str = "default") -> None:
+        self.path = path
+        self.conversation = conversation
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "conversation TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, "
+            "PRIMARY KEY (conversation, seq))"
+        )
+        row = self._conn.execute(
+            "SELECT MAX(seq) FROM messages WHERE conversation = ?",
+            (conversation,),
+        ).fetchone()
+        self._len = 0 if row[0] is None else row[0] + 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, msg: dict) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO messages VALUES (?, ?, ?, ?)",
+                (self.conversation, self._len, msg["role"], msg["content"]),
+            )
+        self._len += 1
+
+    def read(self, start: int, stop: int) -> list[dict]:
+        rows = self._conn.execute(
+            "SELECT role, content FROM messages "
+            "WHERE conversation = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (self.conversation, start, stop),
+        )
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def truncate(self, length: int) -> None:
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM messages WHERE conversation = ? AND seq >= ?",
+                (self.conversation, length),
+            )
+        self._len = min(self._len, length)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_store(path: str, conversation: str = "default") -> HistoryStore:
+    """打开存储后端
+
+    后缀为.db或.sqlite的文件使用SqliteHistoryStore，各对话保存在同一个数据库中；
+    其余使用JsonlHistoryStore，默认对话使用path本身，其他对话使用"文件名.对话id.后缀"的文件。
+
+    Args:
+        path: str 文件路径
+        conversation: str 对话id
+
+    Returns:
+        HistoryStore: 存储后端
+    """
+    root, ext = os.path.splitext(path)
+    if ext in (".db", ".sqlite"):
+        return SqliteHistoryStore(path, conversation)
+    if conversation != "default":
+        path = f"{root}.{conversation}{ext}"
+    return JsonlHistoryStore(path)
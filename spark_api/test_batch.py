@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import pytest
+
+from spark_api import spark_api
+from spark_api.batch import run_batch
+from spark_api.mock_server import MockSparkServer
+from spark_api.scheduler import RequestScheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_scheduler(monkeypatch):
+    monkeypatch.setattr(spark_api, "scheduler",
+                        RequestScheduler(max_retries=0, qps=1000))
+
+
+# 测试批量请求以及中断后续跑
+class TestBatchClass():
+    def testcase_0(self, tmp_path):
+        input_path = tmp_path / "prompts.jsonl"
+        output_path = tmp_path / "results.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(20):
+                f.write(json.dumps({"id": f"q{i}", "prompt": f"问题{i}"}) + "\n")
+            f.write(json.dumps({"prompt": "带历史", "history": [
+                {"role": "user", "content": "你好"},
+                {"role": "assistant", "content": "你好！"}]}) + "\n")
+
+        async def main(errors):
+            async with MockSparkServer(errors=errors) as server:
+                res = await run_batch(str(input_path), str(output_path),
+                                      [server.model()], 4)
+                return res, server.requests
+
+        (ok, failed), _ = asyncio.run(main([10013] * 3))
+        assert (ok, failed) == (18, 3)
+        (ok, failed), requests = asyncio.run(main([]))
+        assert (ok, failed) == (3, 0)
+        assert len(requests) == 3
+
+        results = [json.loads(line) for line in open(output_path, encoding="utf-8")]
+        answers = {r["id"]: r["answer"] for r in results if r["error"] is None}
+        assert len(answers) == 21 and answers["q7"] == "收到：问题7"
+        assert answers["21"] == "收到：带历史"
+
+    def testcase_1(self, tmp_path):
+        # 输出文件末尾有中断时写了一半的行，续跑的条目不会接在这一行后面
+        input_path = tmp_path / "prompts.jsonl"
+        output_path = tmp_path / "results.jsonl"
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(3):
+                f.write(json.dumps({"id": f"q{i}", "prompt": f"问题{i}"}) + "\n")
+
+        async def main(partial):
+            async with MockSparkServer() as server:
+                if partial:
+                    with open(output_path, "w", encoding="utf-8") as f:
+                        for i in range(2):
+                            f.write(json.dumps({"id": f"q{i}", "model": server.model().name,
+                                                "answer": "", "error": None}) + "\n")
+                        f.write('{"id": "q2", "mod')
+                res = await run_batch(str(input_path), str(output_path),
+                                      [server.model()], 2)
+                return res, server.requests
+
+        (ok, failed), requests = asyncio.run(main(True))
+        assert (ok, failed) == (1, 0) and len(requests) == 1
+        results = [json.loads(line) for line in open(output_path, encoding="utf-8")]
+        assert [r["id"] for r in results] == ["q0", "q1", "q2"]
+        (ok, failed), requests = asyncio.run(main(False))
+        assert (ok, failed) == (0, 0) and requests == []
@@ -0,0 +1,37 @@
+from spark_api.cache import ResponseCache
+from spark_api.data import chat_models
+from spark_api.data_structure import ChatHistory, ChatParams
+
+# 测试回答缓存的键、淘汰和磁盘缓存
+class TestCacheClass():
+    def testcase_0(self):
+        history = ChatHistory([])
+        history.append_message("user", "你好")
+        key = ResponseCache.make_key(chat_models[0], ChatParams(), history)
+        assert key != ResponseCache.make_key(chat_models[1], ChatParams(), history)
+        assert key != ResponseCache.make_key(chat_models[0], ChatParams(0.9), history)
+
+    def testcase_1(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", ["1"])
+        cache.put("b", ["2"])
+        assert cache.get("a") == ["1"]
+        cache.put("c", ["3"])
+        assert cache.get("b") is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    def testcase_2(self):
+        cache = ResponseCache(ttl=-1)
+        cache.put("a", ["1"])
+        assert cache.get("a") is None
+
+    def testcase_3(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        cache = ResponseCache(disk_path=path, disk_max_bytes=15)
+        cache.put("a", ["你好"])
+        cache.put("b", ["世界"])
+        cache.close()
+        cache = ResponseCache(disk_path=path)
+        assert cache.get("a") is None
+        assert cache.get("b") == ["世界"]
+        cache.close()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from spark_api import spark_api
+from spark_api.engine import ChatEngine
+from spark_api.gateway import GatewayServer
+from spark_api.mock_server import MockSparkServer
+from spark_api.scheduler import RequestScheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_scheduler(monkeypatch):
+    monkeypatch.setattr(spark_api, "scheduler",
+                        RequestScheduler(base_delay=0.001, qps=1000))
+
+
+async def collect(ws, count: int) -> dict[str, list[dict]]:
+    """接收消息直到count个请求结束，按请求id分组"""
+    replies: dict[str, list[dict]] = {}
+    finished = 0
+    while finished < count:
+        reply = json.loads(await ws.recv())
+        replies.setdefault(reply["id"], []).append(reply)
+        finished += reply["type"] in ("done", "error")
+    return replies
+
+
+class FakeClient:
+    """直接交给GatewayServer._handler的客户端连接，发完消息后等到所有请求结束再断开"""
+    def __init__(self, gateway: GatewayServer, messages: list[dict]) -> None:
+        self.gateway = gateway
+        self.messages = messages
+        self.sent: list[dict] = []
+        self.sessions: list[str] = []
+        self._finished = asyncio.Event()
+
+    async def __aiter__(self):
+        for message in self.messages:
+            yield json.dumps(message)
+        # 处理完所有消息时，请求的任务都还没有开始执行
+        self.sessions = list(self.gateway.sessions)
+        await self._finished.wait()
+
+    async def send(self, raw: str) -> None:
+        self.sent.append(json.loads(raw))
+        if sum(reply["type"] in ("done", "error") for reply in self.sent) == len(self.messages):
+            self._finished.set()
+
+
+# 测试网关在一个进程中为多个客户端保持各自的会话，并共享并发上限
+class TestGatewayClass():
+    def testcase_0(self, monkeypatch):
+        async def main():
+            async with MockSparkServer(chunk_size=2, token_rate=100,
+                                       max_concurrency=2) as server:
+                monkeypatch.setattr("spark_api.gateway.chat_models", [server.model()])
+                engine = ChatEngine(max_concurrency=2)
+                async with GatewayServer(engine, port=0) as gateway, \
+                        websockets.connect(gateway.url()) as a, \
+                        websockets.connect(gateway.url()) as b:
+                    for ws, name in ((a, "a"), (b, "b")):
+                        for i in range(2):
+                            await ws.send(json.dumps({"type": "chat", "id": f"{name}{i}",
+                                                      "session": name,
+                                                      "content": f"{name}问题{i}"}))
+                    replies = {**await collect(a, 2), **await collect(b, 2)}
+                    lengths = [len(request["payload"]["message"]["text"])
+                               for request in server.requests]
+                    return replies, lengths, server.peak_concurrency, gateway
+        replies, lengths, peak, gateway = asyncio.run(main())
+        for name in ("a", "b"):
+            for i in range(2):
+                reply = replies[f"{name}{i}"]
+                assert reply[-1] == {"type": "done", "id": f"{name}{i}",
+                                     "content": f"收到：{name}问题{i}"}
+                assert "".join(r["content"] for r in reply[:-1]) == reply[-1]["content"]
+        # 同一会话的第二个问题带上了第一轮的问答
+        assert sorted(lengths) == [1, 1, 3, 3]
+        assert peak <= 2
+        assert gateway.sessions["a"].history.messages[-1]["content"] == "收到：a问题1"
+
+    def testcase_1(self, monkeypatch):
+        async def main():
+            async with MockSparkServer(first_token_latency=5) as server:
+                monkeypatch.setattr("spark_api.gateway.chat_models", [server.model()])
+                async with GatewayServer(port=0) as gateway, \
+                        websockets.connect(gateway.url()) as ws:
+                    await ws.send("not json")
+                    bad = json.loads(await ws.recv())
+                    await ws.send(json.dumps({"type": "chat", "id": "r",
+                                              "session": "s", "content": "hi"}))
+                    while not server.requests:
+                        await asyncio.sleep(0.01)
+                    await ws.send(json.dumps({"type": "cancel", "id": "r"}))
+                    cancelled = json.loads(await ws.recv())
+                    return bad, cancelled, gateway.sessions["s"].history.messages
+        bad, cancelled, messages = asyncio.run(main())
+        assert bad["type"] == "error" and bad["code"] == "bad_request"
+        assert cancelled == {"type": "error", "id": "r", "code": "cancelled",
+                             "message": "请求已取消"}
+        assert messages == []
+
+    def testcase_2(self, monkeypatch):
+        async def main():
+            async with MockSparkServer() as server:
+                monkeypatch.setattr("spark_api.gateway.chat_models", [server.model()])
+                async with GatewayServer(port=0) as gateway, \
+                        websockets.connect(gateway.url()) as ws:
+                    # 超时时长格式错误时返回bad_request，不新建会话也不发出请求
+                    await ws.send(json.dumps({"type": "chat", "id": "r", "session": "s",
+                                              "content": "hi", "timeout": "abc"}))
+                    bad = json.loads(await asyncio.wait_for(ws.recv(), 5))
+                    await ws.send(json.dumps({"type": "chat", "id": "r", "session": "s",
+                                              "content": "hi", "timeout": "30"}))
+                    replies = await collect(ws, 1)
+                    return bad, replies, server.requests
+        bad, replies, requests = asyncio.run(main())
+        assert bad["id"] == "r" and bad["code"] == "bad_request"
+        assert replies["r"][-1] == {"type": "done", "id": "r", "content": "收到：hi"}
+        assert len(requests) == 1
+
+    def testcase_3(self, monkeypatch):
+        # 连续收到两个会话的请求，第一个请求还没有开始执行时，它的会话也不会被丢弃
+        async def main():
+            async with MockSparkServer() as server:
+                monkeypatch.setattr("spark_api.gateway.chat_models", [server.model()])
+                gateway = GatewayServer(port=0, max_sessions=1)
+                ws = FakeClient(gateway, [{"type": "chat", "id": name, "session": name,
+                                           "content": name} for name in ("a", "b")])
+                await gateway._handler(ws)
+                return ws
+        ws = asyncio.run(main())
+        assert ws.sessions == ["a", "b"]
+        assert sorted(reply["id"] for reply in ws.sent if reply["type"] == "done") == ["a", "b"]
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from spark_api import config
+from spark_api import spark_api
+from spark_api.data_structure import ChatHistory, ChatParams
+from spark_api.hedging import Hedger
+from spark_api.mock_server import MockSparkServer
+from spark_api.scheduler import RequestScheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_scheduler(monkeypatch):
+    monkeypatch.setattr(spark_api, "scheduler",
+                        RequestScheduler(max_retries=0, qps=1000))
+
+
+# 测试对冲请求：主模型过慢或失败时采用后备模型
+class TestHedgingClass():
+    def _run(self, slow: MockSparkServer, fast: MockSparkServer):
+        async def main():
+            async with slow, fast:
+                history = ChatHistory([])
+                answer = "".join([delta async for delta in Hedger(delay=0.05).stream(
+                    [slow.model(), fast.model("max")], history, ChatParams(), "hi")])
+                return answer, history.messages
+        return asyncio.run(main())
+
+    def testcase_0(self):
+        slow = MockSparkServer(answer="slow", first_token_latency=2)
+        fast = MockSparkServer(answer="fast")
+        answer, messages = self._run(slow, fast)
+        assert answer == "fast"
+        assert [m["role"] for m in messages] == ["user", "assistant"]
+
+    def testcase_1(self):
+        primary = MockSparkServer(answer="primary")
+        backup = MockSparkServer(answer="backup")
+        assert self._run(primary, backup)[0] == "primary"
+        assert backup.requests == []
+
+    def testcase_2(self):
+        failing = MockSparkServer(errors=[10013])
+        backup = MockSparkServer(answer="backup")
+        assert self._run(failing, backup)[0] == "backup"
+
+    def testcase_3(self, monkeypatch):
+        # 主请求和后备请求在同一轮中都返回了首个片段，未被采用的流也要立即关闭
+        closed = []
+        both_started = asyncio.Event()
+
+        async def fake_stream(name):
+            try:
+                # 主请求等到后备请求发出后才返回，使两者在同一轮中完成
+                if name == "primary":
+                    await both_started.wait()
+                else:
+                    both_started.set()
+                yield name
+                yield name
+            finally:
+                closed.append(name)
+
+        names = iter(["primary", "backup"])
+        monkeypatch.setattr(spark_api.scheduler, "stream",
+                            lambda request, deadline=None: fake_stream(next(names)))
+
+        async def main():
+            models = [MockSparkServer().model(), MockSparkServer().model("max")]
+            answer = "".join([delta async for delta in Hedger(delay=0).stream(
+                models, ChatHistory([]), ChatParams(), "hi")])
+            return answer, sorted(closed)
+        answer, closed_streams = asyncio.run(main())
+        assert answer in ("primaryprimary", "backupbackup")
+        assert closed_streams == ["backup", "primary"]
+
+    def testcase_4(self, monkeypatch):
+        # 主模型变慢、后备模型胜出时，主模型的首token延迟仍被记录，对冲延迟不会低于主模型的延迟
+        monkeypatch.setattr(config, "hedge_delay", 0.02)
+        hedger = Hedger(window=20)
+
+        async def main():
+            async with MockSparkServer(answer="slow", first_token_latency=0.2) as slow, \
+                    MockSparkServer(answer="fast") as fast:
+                models = [slow.model(), fast.model("max")]
+                for _ in range(20): # 之前的样本都很快
+                    hedger.record_ttft(models[0], 0.01)
+                for _ in range(20):
+                    answer = "".join([delta async for delta in hedger.stream(
+                        models, ChatHistory([]), ChatParams(), "hi")])
+                    assert answer == "fast"
+                await asyncio.sleep(0.5) # 等待后台的主模型请求收到首个片段
+                return hedger.delay_for(models[0])
+        assert asyncio.run(main()) >= 0.2
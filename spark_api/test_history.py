@@ -0,0 +1,146 @@
+import json
+import sys
+
+import pytest
+
+from spark_api import fastjson
+from spark_api import spark_api
+from spark_api.data_structure import ChatHistory, ChatParams
+from spark_api.storage import HistoryStore, JsonlHistoryStore, open_store
+from spark_api.tokens import estimator, TokenEstimator
+
+# 测试消息记录的追加与修剪
+class TestHistoryClass():
+    def testcase_0(self):
+        history = ChatHistory([])
+        for i in range(100):
+            history.append_message("user", f"消息{i}")
+        assert len(history) == 100
+        assert history.total_len == sum(estimator.message_cost(m)
+                                        for m in history.messages)
+
+    def testcase_1(self):
+        history = ChatHistory([])
+        for i in range(1000):
+            history.append_message("assistant", f"消息{i}")
+        history.trim_message(100)
+        assert 0 < history.token_count <= 100
+        assert history.messages[-1]["content"] == "消息999"
+        assert history.total_len == sum(estimator.message_cost(m)
+                                        for m in history.messages)
+
+    def testcase_2(self):
+        history = ChatHistory([])
+        history.append_message("user", "你好")
+        history.clear()
+        assert history.messages == [] and history.total_len == 0
+
+    def testcase_3(self, tmp_path):
+        for name in ("history.jsonl", "history.db"):
+            store = open_store(str(tmp_path / name))
+            history = ChatHistory([], store)
+            for i in range(1000):
+                history.append_message("user", f"消息{i}")
+            store.close()
+
+            store = open_store(str(tmp_path / name))
+            history = ChatHistory.from_store(store, 100)
+            trimmed = ChatHistory(store.read(0, len(store)))
+            trimmed.trim_message(100)
+            assert history.messages == trimmed.messages
+            assert history.first_index == 1000 - len(history)
+            assert history.page(10, 12)[1]["content"] == "消息11"
+            store.close()
+
+    def testcase_4(self, tmp_path):
+        path = str(tmp_path / "history.jsonl")
+        store = JsonlHistoryStore(path)
+        store.append({"role": "user", "content": "你好"})
+        store.close()
+        # 模拟写入日志后、写入索引前退出
+        with open(path, "ab") as f:
+            f.write(b'{"role": "assistant", "content": "hi"}\n{"role": "us')
+        store = JsonlHistoryStore(path)
+        assert len(store) == 2
+        store.append({"role": "user", "content": "再见"})
+        assert [m["content"] for m in store.read(0, 3)] == ["你好", "hi", "再见"]
+        store.close()
+
+    def testcase_5(self, tmp_path):
+        for name in ("history.jsonl", "history.db"):
+            store = open_store(str(tmp_path / name))
+            history = ChatHistory([], store)
+            history.append_message("user", "你好")
+            history.append_message("assistant", "hi")
+            history.append_message("user", "没有回答的问题")
+            history.pop_message()
+            assert history.messages == [{"role": "user", "content": "你好"},
+                                        {"role": "assistant", "content": "hi"}]
+            assert history.total_len == ChatHistory(history.messages).total_len
+            store.close()
+            store = open_store(str(tmp_path / name))
+            assert store.read(0, len(store)) == history.messages
+            store.close()
+
+    @pytest.mark.parametrize("backend", ["orjson", "json"])
+    def testcase_6(self, backend, monkeypatch):
+        if backend == "json":
+            monkeypatch.setattr(fastjson, "orjson", None)
+        history = ChatHistory([{"role": "user", "content": "早\n\"好\""}])
+        for i in range(50):
+            history.append_message("assistant" if i % 2 else "user", f"消息{i}")
+        history.trim_message(100)
+        history.pop_message()
+        assert json.loads(history.encoded_messages()) == history.messages
+        model = spark_api.chat_models[2]
+        encoded = spark_api.encode_params(model, history, ChatParams(), "u")
+        assert encoded == fastjson.dumps(
+            spark_api.gen_params(model, history, ChatParams(), "u"))
+        history.clear()
+        assert history.encoded_messages() == "[]"
+
+    def testcase_7(self):
+        tokens = TokenEstimator(cjk_weight=1.0, other_weight=0.25, message_overhead=0)
+        assert tokens.raw_count("你好世界") == 4
+        assert tokens.raw_count("abcdefgh") == 2
+        assert tokens.raw_count("你好abcd") == 3
+        for _ in range(50):
+            tokens.calibrate(100, 150)
+        assert abs(tokens.scale - 1.5) < 0.01
+        assert tokens.count("你好世界") == 6
+        tokens.observe("lite", 100, {"prompt_tokens": 150, "completion_tokens": 7})
+        assert tokens.usage == {"lite": [1, 150, 7]}
+
+    def testcase_8(self, tmp_path):
+        # 默认构造的消息记录互不共享，角色字符串经过驻留
+        a, b = ChatHistory(), ChatHistory()
+        a.append_message("user", "你好")
+        assert b.messages == [] and len(a) == 1
+        role = json.loads('"assistant"')
+        history = ChatHistory([{"role": role, "content": f"消息{i}"} for i in range(10)])
+        assert history._records[0].role is history._records[9].role is sys.intern(role)
+        # 多次修剪后下标、估计值与消息保持一致
+        for i in range(300):
+            history.append_message("user", f"消息{i}")
+            history.trim_message(50)
+        assert history.messages[-1]["content"] == "消息299"
+        assert history.first_index == 310 - len(history)
+        assert history.total_len == sum(estimator.message_cost(m) for m in history.messages)
+        assert json.loads(history.encoded_messages()) == history.messages
+        # 各对话的消息记录分别保存
+        for name in ("history.jsonl", "history.db"):
+            stores = [open_store(str(tmp_path / name), c) for c in ("default", "tab")]
+            for store, content in zip(stores, ("甲", "乙")):
+                ChatHistory(store=store).append_message("user", content)
+            assert [s.read(0, len(s))[0]["content"] for s in stores] == ["甲", "乙"]
+            for store in stores:
+                store.close()
+
+    def testcase_9(self):
+        # 没有实现全部方法的存储后端在创建时就报错
+        class IncompleteStore(HistoryStore):
+            def __len__(self):
+                return 0
+
+        with pytest.raises(TypeError):
+            IncompleteStore()
@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+import pytest
+
+from spark_api import metrics
+from spark_api import spark_api
+from spark_api import tokens
+from spark_api.data_structure import ChatHistory, ChatParams
+from spark_api.engine import ChatEngine
+from spark_api.errors import SparkApiError
+from spark_api.mock_server import MockSparkServer
+from spark_api.scheduler import Credential, CredentialPool, RequestScheduler
+
+
+@pytest.fixture(autouse=True)
+def fast_scheduler(monkeypatch):
+    monkeypatch.setattr(spark_api, "scheduler",
+                        RequestScheduler(base_delay=0.001, qps=1000))
+
+
+# 使用本地模拟服务测试请求流程，不需要API信息和网络
+class TestMockServerClass():
+    def testcase_0(self):
+        async def main():
+            async with MockSparkServer(answer="你好，世界！", chunk_size=2) as server:
+                history = ChatHistory([])
+                deltas = [delta async for delta in spark_api.stream_chat(
+                    server.model(), history, ChatParams(), "你好")]
+                return deltas, history.messages
+        deltas, messages = asyncio.run(main())
+        assert deltas == ["你好", "，世", "界！"]
+        assert messages[-1] == {"role": "assistant", "content": "你好，世界！"}
+
+    def testcase_1(self):
+        async def main():
+            async with MockSparkServer(errors=[10110, 10222]) as server:
+                answer = await spark_api.request_chat(
+                    server.model(), ChatHistory([]), ChatParams(), "hi")
+                return answer, len(server.requests)
+        assert asyncio.run(main()) == ("收到：hi", 3)
+
+    def testcase_2(self):
+        async def main():
+            async with MockSparkServer(errors=[10013]) as server:
+                await spark_api.request_chat(
+                    server.model(), ChatHistory([]), ChatParams(), "hi")
+        with pytest.raises(SparkApiError) as e:
+            asyncio.run(main())
+        assert e.value.code == 10013
+
+    def testcase_3(self):
+        async def main():
+            async with MockSparkServer(token_rate=200, max_concurrency=4) as server:
+                engine = ChatEngine(max_concurrency=4)
+                sessions = [engine.new_session(server.model()) for _ in range(12)]
+                answers = await engine.run_many(
+                    [(session, f"问题{i}") for i, session in enumerate(sessions)])
+                return answers, server.peak_concurrency
+        answers, peak = asyncio.run(main())
+        assert answers == [f"收到：问题{i}" for i in range(12)]
+        assert peak <= 4
+
+    def testcase_4(self):
+        async def main():
+            async with MockSparkServer(errors=[10110]) as server:
+                await spark_api.request_chat(
+                    server.model(), ChatHistory([]), ChatParams(), "hi")
+                return server.model().name
+        recorder = metrics.enable()
+        try:
+            name = asyncio.run(main())
+        finally:
+            metrics.disable()
+        phases = {phase for phase, model in recorder.histograms if model == name}
+        assert {"sign", "connect", "first_frame", "stream", "total"} <= phases
+        assert recorder.errors == {"10110": 1}
+        assert 'spark_errors_total{code="10110"} 1' in recorder.to_prometheus()
+        assert recorder.tokens[(name, "completion")] == len("收到：hi")
+
+    def testcase_5(self):
+        async def main():
+            async with MockSparkServer(first_token_latency=5) as server:
+                history = ChatHistory([{"role": "user", "content": "早"}])
+                start = time.monotonic()
+                with pytest.raises(TimeoutError):
+                    await spark_api.request_chat(server.model(), history,
+                                                 ChatParams(), "hi",
+                                                 deadline=start + 0.2)
+                return time.monotonic() - start, history.messages
+        elapsed, messages = asyncio.run(main())
+        assert elapsed < 2
+        assert messages == [{"role": "user", "content": "早"}]
+
+    def testcase_6(self):
+        async def main():
+            async with MockSparkServer(token_rate=20) as server:
+                history = ChatHistory([])
+                task = asyncio.ensure_future(spark_api.request_chat(
+                    server.model(), history, ChatParams(), "很长的问题" * 4))
+                await asyncio.sleep(0.3)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                await asyncio.sleep(0.1)
+                return history.messages, server._active_uids
+        messages, active = asyncio.run(main())
+        assert messages == []
+        assert not active
+
+    def testcase_7(self, monkeypatch):
+        monkeypatch.setattr(tokens, "estimator", tokens.TokenEstimator())
+        async def main():
+            async with MockSparkServer(answer="好的") as server:
+                history = ChatHistory([])
+                for i in range(5):
+                    await spark_api.request_chat(server.model(), history,
+                                                 ChatParams(), "这是一个中文问题" * 10)
+                return server.model().name, server.requests[-1]
+        name, request = asyncio.run(main())
+        # 模拟服务按字符数计算token，一个汉字约为0.67个token的估计会被校准到接近1
+        assert tokens.estimator.scale > 1.2
+        assert tokens.estimator.usage[name][0] == 5
+        prompt_tokens = sum(len(m["content"]) for m in request["payload"]["message"]["text"])
+        assert tokens.estimator.usage[name][1] >= prompt_tokens
+
+    def testcase_8(self, monkeypatch):
+        pool = CredentialPool([Credential("app1", "key1", "secret1"),
+                               Credential("app2", "key2", "secret2")])
+        monkeypatch.setattr(spark_api, "credential_pool", pool)
+        monkeypatch.setattr(spark_api, "scheduler", RequestScheduler(
+            base_delay=0.001, qps=1000, credentials=pool))
+        async def main():
+            async with MockSparkServer(errors=[11201]) as server:
+                answer = await spark_api.request_chat(
+                    server.model(), ChatHistory([]), ChatParams(), "hi")
+                return answer, [r["header"]["app_id"] for r in server.requests]
+        answer, app_ids = asyncio.run(main())
+        assert answer == "收到：hi"
+        assert app_ids == ["app1", "app2"]
+        assert pool.credentials[0].breaker.is_open
+        assert [c.in_flight for c in pool.credentials] == [0, 0]
+
+    def testcase_9(self, monkeypatch):
+        pool = CredentialPool([Credential("app1", "key1", "secret1")])
+        monkeypatch.setattr(spark_api, "credential_pool", pool)
+        monkeypatch.setattr(spark_api, "prewarmer", spark_api.ConnectionPrewarmer(ttl=0.2))
+        async def main():
+            async with MockSparkServer() as server:
+                model = server.model()
+                # 预热的连接被请求取用，不再建立新连接
+                await spark_api.prewarmer.warm(model.url)
+                assert pool.credentials[0].in_flight == 1
+                answer = await spark_api.request_chat(model, ChatHistory([]),
+                                                      ChatParams(), "hi")
+                used = (answer, server.connections, pool.credentials[0].in_flight)
+                # 超过ttl未被取用的连接被关闭，名额归还
+                await spark_api.prewarmer.warm(model.url)
+                await asyncio.sleep(0.3)
+                expired = (spark_api.prewarmer.take(model.url),
+                           pool.credentials[0].in_flight)
+                return used, expired
+        used, expired = asyncio.run(main())
+        assert used == ("收到：hi", 1, 0)
+        assert expired == (None, 0)
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+
+from spark_api.data_structure import ChatModel
+from spark_api.engine import ChatEngine
+from spark_api.errors import SparkApiError
+from spark_api.scheduler import Credential, CredentialPool, RequestScheduler
+
+# 测试按错误码重试、熔断
+class TestSchedulerClass():
+    def _run(self, scheduler, codes):
+        calls = []
+
+        async def request():
+            calls.append(1)
+            if codes:
+                raise SparkApiError(codes.pop(0))
+            yield "ok"
+
+        async def main():
+            return [delta async for delta in scheduler.stream(request)]
+        return asyncio.run(main()), len(calls)
+
+    def testcase_0(self):
+        scheduler = RequestScheduler(base_delay=0.001, qps=1000)
+        assert self._run(scheduler, [10110, 11202]) == (["ok"], 3)
+        assert scheduler.bucket.rate < 1000
+
+    def testcase_1(self):
+        scheduler = RequestScheduler(max_retries=1, base_delay=0.001, qps=1000)
+        with pytest.raises(SparkApiError):
+            self._run(scheduler, [10110, 10110])
+        with pytest.raises(SparkApiError):
+            self._run(scheduler, [10013])
+
+    def testcase_2(self):
+        scheduler = RequestScheduler(base_delay=0.001, qps=1000)
+        with pytest.raises(SparkApiError):
+            self._run(scheduler, [11201])
+        assert scheduler.breaker.is_open
+        with pytest.raises(SparkApiError) as e:
+            self._run(scheduler, [])
+        assert e.value.code == 11201
+
+    def testcase_3(self):
+        pool = CredentialPool([Credential("a", "k", "s", 1, 2),
+                               Credential("b", "k", "s", 1, 4)], cooldown=60)
+        assert (pool.qps, pool.max_concurrency) == (2, 6)
+        picked = [pool.acquire().app_id for _ in range(3)]
+        assert picked == ["a", "b", "b"]
+        a, b = pool.credentials
+        pool.report(b, 11203)
+        assert pool.acquire() is a and b.rate_limited == 1
+        pool.report(a, 11201)
+        assert pool.acquire() is b
+        pool.report(b, 11201)
+        assert not pool.available
+        with pytest.raises(SparkApiError) as e:
+            pool.acquire()
+        assert e.value.code == 11201
+
+    def testcase_4(self):
+        pool = CredentialPool([Credential("a", "k", "s"), Credential("b", "k", "s")])
+        scheduler = RequestScheduler(base_delay=0.001, qps=1000, credentials=pool)
+        pool.credentials[0].breaker.trip()
+        assert self._run(scheduler, [11201]) == (["ok"], 2)
+        assert not scheduler.breaker.is_open
+
+    def testcase_5(self):
+        # 等待并发名额、令牌和退避的时间都计入截止时间
+        async def request():
+            yield "ok"
+
+        async def main():
+            scheduler = RequestScheduler(qps=1000, max_concurrency=1)
+            await scheduler.limiter.acquire() # 名额被其他请求占用
+            start = time.monotonic()
+            with pytest.raises(TimeoutError):
+                await anext(scheduler.stream(request, start + 0.05))
+            waited = time.monotonic() - start
+            scheduler.limiter.release()
+            slow = RequestScheduler(qps=0.5)
+            await slow.bucket.acquire() # 下一个令牌在2秒后
+            with pytest.raises(TimeoutError):
+                await anext(slow.stream(request, time.monotonic() + 0.05))
+            return waited, scheduler.limiter.in_flight
+        waited, in_flight = asyncio.run(main())
+        assert waited < 0.5 and in_flight == 0
+
+    def testcase_6(self):
+        # 退避之后会超过截止时间时不再重试，直接抛出错误
+        calls = []
+
+        async def request():
+            calls.append(1)
+            raise SparkApiError(10110)
+            yield
+
+        async def main():
+            scheduler = RequestScheduler(base_delay=5, max_delay=5, qps=1000)
+            scheduler.backoff = lambda attempt: 5
+            start = time.monotonic()
+            with pytest.raises(SparkApiError):
+                await anext(scheduler.stream(request, start + 1))
+            return time.monotonic() - start
+        assert asyncio.run(main()) < 0.5
+        assert len(calls) == 1
+
+    def testcase_7(self):
+        # 会话引擎的全局并发名额被占满时，排队的时间同样计入截止时间
+        async def main():
+            engine = ChatEngine(max_concurrency=1)
+            session = engine.new_session(ChatModel("m", "ws://127.0.0.1:1", "d", 8192))
+            await engine._semaphore.acquire()
+            with pytest.raises(TimeoutError):
+                await anext(engine.stream(session, "hi", time.monotonic() + 0.05))
+            engine._semaphore.release()
+            return session._lock.locked(), session.history.messages
+        assert asyncio.run(main()) == (False, [])
@@ -0,0 +1,69 @@
+import pytest
+
+from spark_api import config
+from spark_api import search
+from spark_api.data_structure import ChatHistory
+from spark_api.search import SearchIndex, build_query, segment, snippet
+from spark_api.storage import open_store
+
+
+# 测试消息搜索：中文子串匹配、跨对话排序，以及随消息记录增量更新
+class TestSearchClass():
+    def testcase_0(self):
+        assert segment("你好世界, Python") == " 你好 好世 世界 界 , Python"
+        assert build_query("世界 python") == '"世界" AND "python"'
+        assert build_query("界") == '"界" *'
+        assert build_query('。。 "') == ""
+
+    def testcase_1(self):
+        index = SearchIndex(":memory:")
+        index.add_many("a", [(0, "user", "你好世界"), (1, "assistant", "Python的用法")])
+        index.add("b", 0, "user", "世界和平，世界大同")
+        for query, expected in [("世界", {("a", 0), ("b", 0)}), ("界", {("a", 0), ("b", 0)}),
+                                ("好世", {("a", 0)}), ("PYTHON 用法", {("a", 1)}),
+                                ("平", {("b", 0)}), ("你世", set())]:
+            assert {(r.conversation, r.seq) for r in index.search(query)} == expected
+        # 出现次数多的排在前面，可以只搜索一个对话
+        assert index.search("世界")[0].conversation == "b"
+        assert [r.seq for r in index.search("世界", conversation="a")] == [0]
+
+    def testcase_2(self, tmp_path):
+        index = SearchIndex(str(tmp_path / "search.db"))
+        store = open_store(str(tmp_path / "history.db"))
+        history = ChatHistory(store=store, index=index, conversation="c")
+        history.append_message("user", "旧的问题")
+        history.append_message("assistant", "旧的回答")
+        history.append_message("user", "没有回答的问题")
+        history.pop_message()
+        assert [r.seq for r in index.search("问题")] == [0]
+        history.clear()
+        history.append_message("user", "新的问题")
+        assert sorted(r.seq for r in index.search("问题")) == [0, 2]
+        # 索引建立之前保存的消息可以补建索引
+        other = open_store(str(tmp_path / "history.db"), "old")
+        for i in range(3000):
+            other.append({"role": "user", "content": f"第{i}条消息"})
+        assert index.sync("old", other) == 3000
+        assert index.sync("old", other) == 0
+        assert [r.seq for r in index.search("第2999条")] == [2999]
+        assert len(index.search("消息", limit=50)) == 50
+        assert snippet("甲" * 100 + "第2999条" + "乙" * 100, "第2999条", 30) == \
+            "…" + "甲" * 10 + "第2999条" + "乙" * 14 + "…"
+        store.close()
+        other.close()
+        index.close()
+
+    def testcase_3(self, tmp_path, monkeypatch):
+        # 持久化的索引必须与存储后端一起使用，否则下次运行会覆盖同一对话的消息
+        index = SearchIndex(str(tmp_path / "search.db"))
+        with pytest.raises(ValueError):
+            ChatHistory(index=index)
+        ChatHistory(index=SearchIndex(":memory:")).append_message("user", "只在内存中")
+        index.close()
+        # 未配置索引路径时不建立共享索引
+        monkeypatch.setattr(search, "_shared", None)
+        monkeypatch.setattr(config, "search_index_path", "")
+        assert search.shared_index() is None
+        monkeypatch.setattr(config, "search_index_path", str(tmp_path / "shared.db"))
+        assert search.shared_index() is search.shared_index() is not None
+        search.shared_index().close()
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+
+from spark_api import spark_api
+from spark_api.spark_api import SignedUrlCache
+
+URL = "wss://spark-api.xf-yun.com/v1.1/chat"
+
+
+@pytest.fixture
+def signs(monkeypatch):
+    """把签名替换为计数的假签名，返回每次签名的URL"""
+    calls = []
+
+    def fake_generate_url(url, credential=None):
+        calls.append(url)
+        return f"{url}?sig={len(calls)}"
+    monkeypatch.setattr(spark_api, "generate_url", fake_generate_url)
+    return calls
+
+
+# 测试签名URL缓存在有效期内复用签名、过期后重新签名，以及临近过期时在后台刷新
+class TestUrlCacheClass():
+    def testcase_0(self, signs):
+        cache = SignedUrlCache(ttl=60, refresh_ahead=0)
+        assert cache.get(URL) == f"{URL}?sig=1"
+        assert cache.get(URL) == f"{URL}?sig=1"
+        # 不同的路径分别签名
+        other = URL.replace("v1.1", "v3.5")
+        assert cache.get(other) == f"{other}?sig=2"
+        assert signs == [URL, other]
+
+    def testcase_1(self, signs):
+        cache = SignedUrlCache(ttl=0.05, refresh_ahead=0)
+        assert cache.get(URL) == f"{URL}?sig=1"
+        time.sleep(0.06)
+        # 过期后在请求路径上重新签名，不再返回过期的签名
+        assert cache.get(URL) == f"{URL}?sig=2"
+        assert cache.get(URL) == f"{URL}?sig=2"
+        assert len(signs) == 2
+
+    def testcase_2(self, signs):
+        cache = SignedUrlCache(ttl=0.2, refresh_ahead=0.15)
+
+        async def main():
+            first = cache.get(URL)
+            await asyncio.sleep(0.08)
+            # 临近过期时先返回旧签名，同一时间只安排一次后台刷新
+            stale = [cache.get(URL), cache.get(URL)]
+            count = len(signs)
+            await asyncio.sleep(0)
+            return first, stale, count, cache.get(URL)
+        first, stale, count, refreshed = asyncio.run(main())
+        assert first == f"{URL}?sig=1"
+        assert stale == [first, first] and count == 1
+        assert refreshed == f"{URL}?sig=2"
+        assert len(signs) == 2
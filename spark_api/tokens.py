@@ -0,0 +1,136 @@
+"""token估计模块
+
+该模块按字符类别估计消息的token数，并用Spark最后一帧返回的payload.usage.text中的
+实际token数自动校准，同时按模型累计token用量。
+
+估计方法：一个汉字（以及其他多字节字符）约为cjk_weight个token，其余字符约为other_weight个token，
+每条消息另有message_overhead个token的角色标记开销。多字节字符数由UTF-8编码长度与字符数之差得到，
+两次计算都在C层完成，不需要逐字符遍历。未校准的估计值是整数，ChatHistory为每条消息缓存一次，
+校准只改变scale，不需要重新估计已有的消息。
+
+Classes:
+    TokenEstimator: token估计类
+
+使用示例：
+    tokens = estimator.count("你好，world")
+"""
+
+import math
+
+
+class TokenEstimator:
+    """token估计类
+
+    Attributes:
+        cjk_weight: float 每个多字节字符的token数
+        other_weight: float 每个单字节字符的token数
+        message_overhead: int 每条消息的额外token数
+        scale: float 校准系数，实际token数约为未校准的估计值乘以scale
+        alpha: float 校准时新样本的权重
+        usage: dict[str, list[int]] 模型名称 -> [请求数, prompt tokens, completion tokens]
+    """
+    def __init__(
+        self,
+        cjk_weight: float = 0.67,
+        other_weight: float = 0.25,
+        message_overhead: int = 4,
+        alpha: float = 0.2,
+    ) -> None:
+        self.cjk_weight = cjk_weight
+        self.other_weight = other_weight
+        self.message_overhead = message_overhead
+        self.scale = 1.0
+        self.alpha = alpha
+        self.usage: dict[str, list[int]] = {}
+
+    def raw_count(self, text: str) -> int:
+        """未校准的token估计值
+
+        Args:
+            text: str 文本
+
+        Returns:
+            int: 未校准的token数
+        """
+        chars = len(text)
+        # ASCII字符占1字节，汉字占3字节，多出的字节数的一半即为汉字数
+        cjk = min((len(text.encode("utf-8")) - chars) / 2, chars)
+        return round(cjk * self.cjk_weight + (chars - cjk) * self.other_weight)
+
+    def message_cost(self, msg: dict) -> int:
+        """一条消息未校准的token估计值
+
+        Args:
+            msg: dict 消息，包含"role"和"content"
+
+        Returns:
+            int: 未校准的token数
+        """
+        return self.raw_count(msg["content"]) + self.message_overhead
+
+    def to_tokens(self, raw: int) -> int:
+        """把未校准的估计值换算为token数
+
+        Args:
+            raw: int 未校准的token数
+
+        Returns:
+            int: 校准后的token数
+        """
+        return math.ceil(raw * self.scale)
+
+    def to_raw(self, tokens: int) -> float:
+        """把token数换算为未校准的估计值，用于与缓存的估计值比较
+
+        Args:
+            tokens: int token数
+
+        Returns:
+            float: 未校准的token数
+        """
+        return tokens / self.scale
+
+    def count(self, text: str) -> int:
+        """估计文本的token数
+
+        Args:
+            text: str 文本
+
+        Returns:
+            int: token数
+        """
+        return self.to_tokens(self.raw_count(text))
+
+    def calibrate(self, raw: int, actual: int) -> None:
+        """用一次实际的token数校准
+
+        Args:
+            raw: int 未校准的估计值
+            actual: int Spark返回的实际token数
+        """
+        if raw <= 0 or actual <= 0:
+            return
+        ratio = min(max(actual / raw, 0.25), 4.0)
+        self.scale += self.alpha * (ratio - self.scale)
+
+    def observe(self, model: str, prompt_raw: int, usage: dict) -> None:
+        """记录一次请求的token用量，并用其中的prompt_tokens校准
+
+        Args:
+            model: str 模型名称
+            prompt_raw: int 请求中消息记录未校准的估计值
+            usage: dict Spark返回的payload.usage.text
+        """
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        self.calibrate(prompt_raw, prompt_tokens)
+        totals = self.usage.get(model)
+        if totals is None:
+            totals = self.usage[model] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += completion_tokens
+
+
+estimator = TokenEstimator()
+"""TokenEstimator: 默认的token估计实例"""
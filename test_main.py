@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+
+import main
+from chat_process.processor import _AnswerRenderer
+
+app = QApplication.instance() or QApplication([])
+
+
+def stream(tab, renderer, text):
+    for i in range(0, len(text), 4):
+        tab._on_process_partial(*renderer.feed(text[i:i + 4]))
+        tab._flush_partial()
+
+
+# 测试回答期间显示的消息在回答变长后位置仍然正确，移出显示区时删除的范围正确
+class TestMainClass():
+    def testcase_0(self):
+        tab = main.ChatTab("test-main", "1.Spark Lite")
+        tab._on_process_start(["1", "1", "user", "你好"])
+        renderer = _AnswerRenderer("", False)
+        stream(tab, renderer, "第一段\n```\nx = 1\n")
+        # 回答期间切换模型，提示消息显示在回答之后
+        tab.set_model("2.Spark Pro")
+        stream(tab, renderer, "y = 2\n```\n- a\n- b\n结束")
+        tab._on_process_finish(renderer.finish())
+        document = tab.chat_display.document()
+        entry = tab._entries[-1]
+        assert entry.tag == "system"
+        assert document.characterCount() - 1 - entry.start == len("\n已切换到 2.Spark Pro")
+
+        tab._trim_display(1)
+        assert tab.chat_display.toPlainText().strip() == "已切换到 2.Spark Pro"
+        assert [msg["role"] for msg in tab.display_archive.read(0, 2)] == ["user", "ai"]
+
+        async def close():
+            await tab.shutdown()
+        asyncio.run(close())